@@ -0,0 +1,175 @@
+"""
+Offline benchmark: the original extract_body_recursive (decode every part in
+full, four regex passes over the HTML, truncate afterwards) vs the streaming
+extractor in gmail_backend.py, over pages of synthetic /query messages.
+Reports CPU time and peak traced memory per page, and checks both give the
+same body for messages without quoted replies.
+
+Usage:
+    python bench_body_extract.py [pages]
+"""
+import os
+import re
+import sys
+import time
+import base64
+import random
+import tracemalloc
+
+# gmail_backend refuses to import without OAuth settings; dummy values are fine offline
+os.environ.setdefault("GOOGLE_CLIENT_ID", "bench")
+os.environ.setdefault("GOOGLE_CLIENT_SECRET", "bench")
+os.environ.setdefault("REDIRECT_URI", "http://localhost/callback")
+
+import gmail_backend
+from fake_gmail import make_message
+
+PAGE_SIZE = 50
+CSS_RULE = ".c{n} td.col{n} {{ padding: 0 12px; font-family: Arial, sans-serif; color: #33{n:04d}; }}\n"
+FILLER = ("We appreciate the time you invested in your application and your interest in our firm. "
+          "Our team reviews every profile carefully and will be in touch about next steps. ")
+
+
+def _b64(text):
+    return base64.urlsafe_b64encode(text.encode("utf-8")).decode("ascii")
+
+
+def legacy_extract_body(payload, prefer_html=False):
+    """The original implementation."""
+    mime_type = payload.get('mimeType', '')
+
+    if mime_type == 'text/plain':
+        body_data = payload.get('body', {}).get('data')
+        if body_data:
+            return base64.urlsafe_b64decode(body_data).decode('utf-8', errors='ignore')
+
+    if mime_type == 'text/html' and prefer_html:
+        body_data = payload.get('body', {}).get('data')
+        if body_data:
+            html = base64.urlsafe_b64decode(body_data).decode('utf-8', errors='ignore')
+            text = re.sub(r'<style[^>]*>.*?</style>', '', html, flags=re.DOTALL)
+            text = re.sub(r'<script[^>]*>.*?</script>', '', text, flags=re.DOTALL)
+            text = re.sub(r'<[^>]+>', ' ', text)
+            text = re.sub(r'\s+', ' ', text).strip()
+            return text
+
+    if 'parts' in payload:
+        plain_text = None
+        html_text = None
+        for part in payload['parts']:
+            part_mime = part.get('mimeType', '')
+            if part.get('filename'):
+                continue
+            if part_mime.startswith('multipart/'):
+                result = legacy_extract_body(part, prefer_html)
+                if result:
+                    return result
+            elif part_mime == 'text/plain':
+                body_data = part.get('body', {}).get('data')
+                if body_data:
+                    plain_text = base64.urlsafe_b64decode(body_data).decode('utf-8', errors='ignore')
+            elif part_mime == 'text/html':
+                body_data = part.get('body', {}).get('data')
+                if body_data:
+                    html = base64.urlsafe_b64decode(body_data).decode('utf-8', errors='ignore')
+                    text = re.sub(r'<style[^>]*>.*?</style>', '', html, flags=re.DOTALL)
+                    text = re.sub(r'<script[^>]*>.*?</script>', '', text, flags=re.DOTALL)
+                    text = re.sub(r'<[^>]+>', ' ', text)
+                    text = re.sub(r'\s+', ' ', text).strip()
+                    html_text = text
+        if plain_text:
+            return plain_text
+        if html_text:
+            return html_text
+
+    body_data = payload.get('body', {}).get('data')
+    if body_data:
+        return base64.urlsafe_b64decode(body_data).decode('utf-8', errors='ignore')
+    return ""
+
+
+def marketing_html(rng):
+    """HTML-only newsletter: large <style> head, table layout, ~100-200KB."""
+    css = "".join(CSS_RULE.format(n=n) for n in range(rng.randint(200, 600)))
+    rows = "".join(
+        f'<tr><td class="col{n}" style="padding:8px"><a href="https://example.com/jobs/{n}">'
+        f'<span>Analyst role {n}</span></a><p>{FILLER}</p></td></tr>\n'
+        for n in range(rng.randint(300, 800))
+    )
+    return f"<html><head><style>{css}</style></head><body><table>{rows}</table></body></html>"
+
+
+def reply_chain(rng):
+    """Plain-text reply with a long quoted history."""
+    quoted = "".join(f"> {FILLER}\n" for _ in range(rng.randint(200, 600)))
+    return ("Thanks, Thursday at 2pm works for me.\n\nBest,\nAlex\n\n"
+            "On Mon, 3 Nov 2025 at 09:00, Recruiting <careers@ubs.com> wrote:\n" + quoted)
+
+
+def html_reply(rng):
+    """Gmail-style HTML reply: short answer, then the quoted thread in a blockquote."""
+    quoted = "".join(f"<p>{FILLER}</p>" for _ in range(rng.randint(200, 600)))
+    return ('<div dir="ltr">Thanks, see you on Thursday.</div><div class="gmail_quote">'
+            '<div class="gmail_attr">On Mon, 3 Nov 2025 at 09:00, Recruiting &lt;careers@ubs.com&gt; wrote:<br></div>'
+            f'<blockquote class="gmail_quote">{quoted}</blockquote></div>')
+
+
+def make_payloads(pages, seed=5):
+    """ATS notifications (plain + HTML) mixed with newsletters and reply chains."""
+    rng = random.Random(seed)
+    payloads = []
+    for i in range(pages * PAGE_SIZE):
+        roll = rng.random()
+        if roll < 0.6:
+            payloads.append(("ats", make_message(i)["payload"]))
+        elif roll < 0.8:
+            payloads.append(("newsletter", {"mimeType": "text/html", "body": {"data": _b64(marketing_html(rng))}}))
+        elif roll < 0.9:
+            payloads.append(("reply", {"mimeType": "text/plain", "body": {"data": _b64(reply_chain(rng))}}))
+        else:
+            payloads.append(("reply", {"mimeType": "multipart/alternative", "parts": [
+                {"mimeType": "text/html", "filename": "", "body": {"data": _b64(html_reply(rng))}},
+            ]}))
+    return payloads
+
+
+def run_pages(fn, payloads):
+    """Returns (seconds per page, peak traced KB per page, bodies)."""
+    bodies = []
+    cpu = 0.0
+    peak = 0
+    for start in range(0, len(payloads), PAGE_SIZE):
+        page = payloads[start:start + PAGE_SIZE]
+        tracemalloc.start()
+        t0 = time.process_time()
+        bodies.extend(fn(payload, prefer_html=True) for _, payload in page)
+        cpu += time.process_time() - t0
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    pages = len(payloads) / PAGE_SIZE
+    return cpu / pages, peak / 1024, bodies
+
+
+def main():
+    pages = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    payloads = make_payloads(pages)
+    print(f"Extracting bodies for {pages} pages of {PAGE_SIZE} messages")
+
+    legacy_cpu, legacy_peak, legacy = run_pages(
+        lambda p, prefer_html: legacy_extract_body(p, prefer_html)[:gmail_backend.BODY_MAX_CHARS], payloads)
+    new_cpu, new_peak, new = run_pages(gmail_backend.extract_body_recursive, payloads)
+
+    print(f"  legacy     {legacy_cpu * 1000:7.1f}ms CPU/page  peak {legacy_peak:8.0f}KB")
+    print(f"  streaming  {new_cpu * 1000:7.1f}ms CPU/page  peak {new_peak:8.0f}KB  "
+          f"({legacy_cpu / new_cpu:4.1f}x CPU, {legacy_peak / new_peak:4.1f}x memory)")
+
+    mismatched = sum(1 for (kind, _), a, b in zip(payloads, legacy, new) if kind != "reply" and a != b)
+    quoted_chars = sum(len(a) - len(b) for (kind, _), a, b in zip(payloads, legacy, new) if kind == "reply")
+    print(f"  bodies differing outside replies: {mismatched}  "
+          f"quoted-reply characters dropped: {quoted_chars}")
+    if mismatched:
+        sys.exit("Streaming extractor output differs from the original")
+
+
+if __name__ == "__main__":
+    main()
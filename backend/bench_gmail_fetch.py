@@ -0,0 +1,63 @@
+"""
+Offline benchmark: per-message Gmail fetch vs batched fetch.
+Runs against fake_gmail.FakeGmailService, so no credentials are needed.
+
+Usage:
+    python bench_gmail_fetch.py [num_messages] [latency_seconds]
+"""
+import os
+import sys
+import time
+
+# gmail_backend refuses to import without OAuth settings; dummy values are fine offline
+os.environ.setdefault("GOOGLE_CLIENT_ID", "bench")
+os.environ.setdefault("GOOGLE_CLIENT_SECRET", "bench")
+os.environ.setdefault("REDIRECT_URI", "http://localhost/callback")
+# The fake service has no quota, so don't pace calls to Gmail's per-user limit
+os.environ.setdefault("GMAIL_QUOTA_PER_SEC", "1000000")
+
+import gmail_backend
+from fake_gmail import FakeGmailService
+
+
+def fetch_sequential(service, query, max_results=200):
+    """The original one-request-per-message loop, kept for comparison."""
+    all_msgs = []
+    page_token = None
+    while len(all_msgs) < max_results:
+        list_params = {'userId': 'me', 'q': query, 'maxResults': 50}
+        if page_token:
+            list_params['pageToken'] = page_token
+        resp = service.users().messages().list(**list_params).execute()
+        for msg in resp.get('messages', []):
+            if len(all_msgs) >= max_results:
+                break
+            msg_data = service.users().messages().get(userId='me', id=msg['id'], format='full').execute()
+            all_msgs.append(gmail_backend.parse_message(msg_data))
+        page_token = resp.get('nextPageToken')
+        if not page_token:
+            break
+    return all_msgs
+
+
+def run(label, fn, num_messages, latency):
+    service = FakeGmailService(num_messages=num_messages, latency=latency)
+    t0 = time.perf_counter()
+    emails = fn(service, "in:inbox", max_results=num_messages)
+    elapsed = time.perf_counter() - t0
+    print(f"  {label:<12} {elapsed:7.2f}s  round trips: {service.round_trips:4d}  emails: {len(emails)}")
+    return emails
+
+
+def main():
+    num_messages = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.05
+
+    print(f"Fetching {num_messages} messages, {latency * 1000:.0f}ms simulated latency per round trip")
+    sequential = run("sequential", fetch_sequential, num_messages, latency)
+    batched = run("batched", gmail_backend.fetch_all_emails, num_messages, latency)
+    print(f"  identical output: {sequential == batched}")
+
+
+if __name__ == "__main__":
+    main()
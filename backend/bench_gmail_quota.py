@@ -0,0 +1,79 @@
+"""
+Offline benchmark: parallel Gmail fetching against a per-user quota.
+Several workers page through one user's mailbox at once (like local_server's
+page prefetch + concurrent company fetches) on a fake_gmail.FakeGmailService
+that rejects calls with 429 once its quota bucket is empty.
+
+Compared:
+  unpaced   - no limiter, no retries (a 429 fails the request)
+  retries   - no limiter, jittered retries only
+  limiter   - QuotaLimiter pacing + AIMD + jittered retries
+
+Usage:
+    python bench_gmail_quota.py [workers] [messages_per_worker] [quota_units_per_sec] [latency_seconds]
+"""
+import os
+import sys
+import time
+import threading
+
+# gmail_backend refuses to import without OAuth settings; dummy values are fine offline
+os.environ.setdefault("GOOGLE_CLIENT_ID", "bench")
+os.environ.setdefault("GOOGLE_CLIENT_SECRET", "bench")
+os.environ.setdefault("REDIRECT_URI", "http://localhost/callback")
+
+import gmail_backend
+from fake_gmail import FakeGmailService
+
+UNLIMITED = 1e9
+
+
+def run(label, workers, per_worker, quota, latency, limit, retries):
+    service = FakeGmailService(num_messages=per_worker, latency=latency, quota_per_sec=quota)
+    limiter = gmail_backend.QuotaLimiter(limit)
+    gmail_backend.GMAIL_MAX_RETRIES = retries
+    fetched, failures = [], []
+
+    def worker():
+        try:
+            emails = gmail_backend.fetch_all_emails(service, "in:inbox", max_results=per_worker, limiter=limiter)
+            fetched.append(len(emails))
+        except Exception as e:
+            failures.append(e)
+
+    t0 = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(workers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - t0
+
+    emails = sum(fetched)
+    # Quota available during the run: the full one-second bucket at the start + the refill
+    utilization = service.units_charged / (quota * (elapsed + 1))
+    print(f"  {label:<8} {elapsed:6.2f}s  emails: {emails:5d}/{workers * per_worker}  failed workers: {len(failures)}  "
+          f"{emails / elapsed:6.0f} msg/s  quota used: {utilization:5.1%}  "
+          f"429s: {service.rate_limited:4d}  retries: {limiter.retries:3d}")
+    return failures, limiter
+
+
+def main():
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    per_worker = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    quota = float(sys.argv[3]) if len(sys.argv) > 3 else 500
+    latency = float(sys.argv[4]) if len(sys.argv) > 4 else 0.02
+    max_retries = gmail_backend.GMAIL_MAX_RETRIES
+
+    print(f"{workers} workers x {per_worker} messages, quota {quota:.0f} units/s, "
+          f"{latency * 1000:.0f}ms simulated latency")
+    run("unpaced", workers, per_worker, quota, latency, UNLIMITED, 0)
+    run("retries", workers, per_worker, quota, latency, UNLIMITED, max_retries)
+    failures, limiter = run("limiter", workers, per_worker, quota, latency, quota, max_retries)
+    print(f"  limiter stats: {limiter.stats()}")
+    if failures:
+        sys.exit(f"Limiter run failed: {failures[0]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""
+Offline load test: many users, each logged in with their own session, paging
+through /query at the same time. Every session gets its own
+fake_gmail.FakeGmailService (looked up from the session's token file), so no
+credentials are needed.
+
+Checks that each session only ever sees its own mailbox, and compares the
+light users' page latency alone vs next to a heavy user running many
+parallel paginations.
+
+Usage:
+    python bench_multi_tenant.py [light_users] [heavy_streams] [latency_seconds]
+"""
+import os
+import sys
+import time
+import tempfile
+import threading
+import statistics
+
+# gmail_backend refuses to import without OAuth settings; dummy values are fine offline
+os.environ.setdefault("GOOGLE_CLIENT_ID", "bench")
+os.environ.setdefault("GOOGLE_CLIENT_SECRET", "bench")
+os.environ.setdefault("REDIRECT_URI", "http://localhost/callback")
+# The fake services have no quota, so don't pace calls to Gmail's per-user limit
+os.environ.setdefault("GMAIL_QUOTA_PER_SEC", "1000000")
+
+import gmail_backend
+from fake_gmail import FakeGmailService
+
+LIGHT_MESSAGES = 150
+HEAVY_MESSAGES = 1000
+
+
+class FakeCreds:
+    def __init__(self, token_file=None):
+        self.token_file = token_file
+        self.refresh_token = None
+
+    def to_json(self):
+        return "{}"
+
+
+def install_fakes(services):
+    """Route each token file to its user's fake service."""
+    gmail_backend.Credentials.from_authorized_user_file = staticmethod(
+        lambda path, scopes=None: FakeCreds(path))
+    gmail_backend.build = lambda *a, credentials=None, **k: services[credentials.token_file]
+
+
+def login(services, num_messages, latency, email_address):
+    session_id = gmail_backend.sessions.create(FakeCreds())
+    services[gmail_backend.sessions.token_file(session_id)] = FakeGmailService(
+        num_messages=num_messages, latency=latency, email_address=email_address)
+    return session_id
+
+
+def paginate(session_id, expected_email, expected_count, latencies, errors):
+    """Read the whole mailbox through /query, recording each page's latency."""
+    client = gmail_backend.app.test_client()
+    headers = {gmail_backend.SESSION_HEADER: session_id}
+
+    email = client.get("/user-info", headers=headers).get_json().get("email")
+    if email != expected_email:
+        errors.append(f"{expected_email}: /user-info returned {email}")
+
+    count, page_token = 0, None
+    while True:
+        params = {"format": "metadata"}
+        if page_token:
+            params["page_token"] = page_token
+        t0 = time.perf_counter()
+        resp = client.get("/query", query_string=params, headers=headers)
+        latencies.append(time.perf_counter() - t0)
+        if resp.status_code != 200:
+            errors.append(f"{expected_email}: /query returned {resp.status_code}")
+            return
+        data = resp.get_json()
+        count += len(data["messages"])
+        page_token = data.get("next_page_token")
+        if not page_token:
+            break
+    if count != expected_count:
+        errors.append(f"{expected_email}: saw {count} messages, mailbox has {expected_count}")
+
+
+def run(light, heavy, errors):
+    """Run all paginations in parallel; returns the light users' page latencies."""
+    light_latencies, heavy_latencies = [], []
+    threads = [threading.Thread(target=paginate, args=(sid, email, LIGHT_MESSAGES, light_latencies, errors))
+               for sid, email in light]
+    threads += [threading.Thread(target=paginate, args=(sid, email, HEAVY_MESSAGES, heavy_latencies, errors))
+                for sid, email in heavy]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return light_latencies
+
+
+def report(label, latencies):
+    latencies = sorted(latencies)
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(f"  {label:<22} pages: {len(latencies):4d}  "
+          f"p50 {statistics.median(latencies) * 1000:6.0f}ms  p95 {p95 * 1000:6.0f}ms")
+    return p95
+
+
+def main():
+    num_light = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    heavy_streams = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+    latency = float(sys.argv[3]) if len(sys.argv) > 3 else 0.02
+
+    gmail_backend.sessions = gmail_backend.SessionRegistry(
+        tempfile.mkdtemp(), os.path.join(tempfile.mkdtemp(), "token.json"))
+    gmail_backend.SESSION_WAIT = 600  # the heavy user queues behind its own slots instead of getting 429s
+    services = {}
+    install_fakes(services)
+
+    light = [(login(services, LIGHT_MESSAGES, latency, f"user{i}@example.com"), f"user{i}@example.com")
+             for i in range(num_light)]
+    heavy_id = login(services, HEAVY_MESSAGES, latency, "heavy@example.com")
+    heavy = [(heavy_id, "heavy@example.com")] * heavy_streams
+
+    print(f"{num_light} light users ({LIGHT_MESSAGES} messages), 1 heavy user "
+          f"({heavy_streams} parallel paginations of {HEAVY_MESSAGES}), "
+          f"{latency * 1000:.0f}ms simulated latency, {gmail_backend.SESSION_MAX_CONCURRENCY} slots per session")
+
+    errors = []
+    alone = report("light users alone", run(light, [], errors))
+    t0 = time.perf_counter()
+    contended = report("light users + heavy", run(light, heavy, errors))
+    print(f"  contended run took {time.perf_counter() - t0:.2f}s; light p95 slowdown {contended / alone:4.2f}x")
+
+    # Without a session id nobody is logged in, and a logged-out session stays out
+    client = gmail_backend.app.test_client()
+    if client.get("/query").status_code != 401:
+        errors.append("request without a session id was served")
+    sid, _ = light[0]
+    client.get("/logout", headers={gmail_backend.SESSION_HEADER: sid})
+    if client.get("/query", headers={gmail_backend.SESSION_HEADER: sid}).status_code != 401:
+        errors.append("logged-out session was still served")
+
+    print(f"  isolation errors: {len(errors)}")
+    if errors:
+        sys.exit("\n".join(errors[:10]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Offline benchmark: the original parse_date vs date_utils.parse_date.
+Each date is parsed three times, as the pipeline does (sort key, stage
+pre-detection, prompt formatting). Checks the new function agrees wherever
+the original could parse the date, and counts dates only the new one parses.
+
+Usage:
+    python bench_parse_date.py [num_emails]
+"""
+import re
+import sys
+import time
+import random
+from datetime import datetime, timedelta, timezone
+
+import date_utils
+
+RFC_SHAPES = [
+    "%a, %d %b %Y %H:%M:%S {tz}",
+    "%a, %d %b %Y %H:%M:%S {tz} (UTC)",
+    "%d %b %Y %H:%M:%S {tz}",
+    "%a, %d %b %Y %H:%M:%S GMT",     # not parsed by the original
+    "%a, %d %b %Y %H:%M {tz}",       # no seconds - not parsed by the original
+]
+OFFSETS = ["+0000", "-0500", "+0900", "+0100", "-0800"]
+
+
+def legacy_parse_date(date_str):
+    """The original implementation (regex, then strptime with the zone stripped)."""
+    if not date_str:
+        return None
+
+    match = re.search(r"(\d{4}-\d{2}-\d{2})", date_str)
+    if match:
+        return match.group(1)
+
+    try:
+        clean = re.sub(r'\s*\([^)]*\)\s*$', '', date_str)
+        clean = re.sub(r'\s*[+-]\d{4}\s*$', '', clean)
+        clean = clean.strip()
+
+        for fmt in [
+            "%a, %d %b %Y %H:%M:%S",
+            "%d %b %Y %H:%M:%S",
+        ]:
+            try:
+                dt = datetime.strptime(clean, fmt)
+                return dt.strftime("%Y-%m-%d")
+            except:
+                continue
+    except:
+        pass
+
+    return None
+
+
+def make_dates(n, seed=11):
+    """~80% ISO strings (what gmail_backend returns), the rest raw RFC 2822 headers."""
+    rng = random.Random(seed)
+    start = datetime(2025, 6, 1, tzinfo=timezone.utc)
+    dates = []
+    for _ in range(n):
+        dt = start + timedelta(minutes=rng.randrange(0, 200 * 24 * 60))
+        if rng.random() < 0.8:
+            dates.append(dt.isoformat())
+        else:
+            shape = rng.choice(RFC_SHAPES).replace("{tz}", rng.choice(OFFSETS))
+            dates.append(dt.strftime(shape))
+    return dates
+
+
+def timed(fn, dates, repeats=3):
+    t0 = time.perf_counter()
+    for _ in range(repeats):
+        results = [fn(d) for d in dates]
+    return time.perf_counter() - t0, results
+
+
+def main():
+    num_emails = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    dates = make_dates(num_emails)
+    print(f"Parsing {num_emails} email dates x3")
+
+    date_utils.parse_date.cache_clear()
+    legacy_time, legacy = timed(legacy_parse_date, dates)
+    new_time, new = timed(date_utils.parse_date, dates)
+    date_utils.parse_date.cache_clear()
+    cold_time, _ = timed(date_utils.parse_date, dates, repeats=1)
+
+    disagree = sum(1 for a, b in zip(legacy, new) if a is not None and a != b)
+    newly_parsed = sum(1 for a, b in zip(legacy, new) if a is None and b is not None)
+    print(f"  legacy             {legacy_time * 1000:7.1f}ms")
+    print(f"  date_utils (x3)    {new_time * 1000:7.1f}ms  ({legacy_time / new_time:4.1f}x)")
+    print(f"  date_utils (cold)  {cold_time * 1000:7.1f}ms  single pass, empty memo")
+    print(f"  disagreements: {disagree}  dates only the new parser reads: {newly_parsed}")
+    if disagree:
+        sys.exit("date_utils.parse_date disagrees with the original on parseable dates")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Offline benchmark: per-pattern re.search loops vs the compiled stage/skip classifiers.
+Runs over a synthetic corpus and checks both give identical results.
+secondfilter.py's patterns are the ones local_server.py uses (see stage_classifier.py).
+
+Usage:
+    python bench_stage_classifier.py [num_emails]
+"""
+import os
+import re
+import sys
+import time
+import random
+
+# gmail_backend refuses to import without OAuth settings; dummy values are fine offline
+os.environ.setdefault("GOOGLE_CLIENT_ID", "bench")
+os.environ.setdefault("GOOGLE_CLIENT_SECRET", "bench")
+os.environ.setdefault("REDIRECT_URI", "http://localhost/callback")
+
+import gmail_backend
+import secondfilter
+
+COMPANIES = ["Goldman Sachs", "BlackRock", "UBS", "ION Group", "MUFG", "Bloomberg", "Jane Street", "HSBC"]
+SENDERS = [
+    "no-reply@hire.lever.co", "careers@{d}.com", "noreply@myworkday.com", "talent@greenhouse.io",
+    "support@zendesk.com", "notifications@hackerrank.com", "badges@credly.com", "recruiting@{d}.com",
+]
+SUBJECTS = [
+    "Thank you for applying to {c}", "{c} | Application update", "Your application to {c}",
+    "Interview scheduled with {c}", "HireVue video interview invitation - {c}",
+    "Your HackerRank coding test for {c}", "Ticket #48213: We are waiting for your response",
+    "New jobs for: Analyst in London", "Event Reminder: {c} virtual insight day", "{c} - next steps",
+]
+PHRASES = [
+    "thank you for your application", "we've received your application", "application received",
+    "please complete the pymetrics games", "the talent q assessment", "psychometric test",
+    "our job simulation on the forage", "situational judgement test", "complete the codility challenge",
+    "the coding assessment must be completed", "technical assessment", "take home assignment",
+    "record your answer to each question", "one-way video interview", "pre-recorded video",
+    "we would like to meet with you", "the interview invitation is attached", "assessment centre",
+    "unfortunately we will not be moving forward", "we regret to inform you", "decided not to proceed",
+    "we are delighted to offer you", "please find your offer letter", "congratulations on your offer",
+]
+# Non-ASCII text, including letters re.IGNORECASE folds onto ASCII ("ſimulation" matches "simulation")
+UNICODE_PHRASES = ["we’ve received your application", "café", "ſimulation", "İnterview scheduled", "Kodility"]
+FILLER = ("We appreciate the time you invested in your application and your interest in our firm. "
+          "Our team reviews every profile carefully. Please do not reply to this automated message. ")
+
+
+def make_corpus(n, seed=7):
+    rng = random.Random(seed)
+    emails = []
+    for i in range(n):
+        company = rng.choice(COMPANIES)
+        domain = company.lower().replace(" ", "")
+        parts = [FILLER] * rng.randint(1, 6)
+        for _ in range(rng.randint(0, 3)):
+            parts.insert(rng.randrange(len(parts) + 1), rng.choice(PHRASES).capitalize() + ". ")
+        if rng.random() < 0.1:
+            parts.insert(0, rng.choice(UNICODE_PHRASES) + ". ")
+        emails.append({
+            "id": f"msg{i:06d}",
+            "subject": rng.choice(SUBJECTS).format(c=company),
+            "from_email": f"{company} <{rng.choice(SENDERS).format(d=domain)}>",
+            "body": "".join(parts),
+        })
+    return emails
+
+
+def legacy_detect_stages(email, stage_patterns):
+    """The original loop: one re.search per pattern."""
+    subject = email.get("subject", "").lower()
+    from_email = email.get("from_email", "").lower()
+    body = email.get("body", "").lower()[:500]
+    text = f"{subject} {from_email} {body}"
+
+    detected = []
+    for stage, patterns in stage_patterns.items():
+        for pattern in patterns:
+            if re.search(pattern, text, re.IGNORECASE):
+                detected.append(stage)
+                break
+    return detected
+
+
+def legacy_should_skip(email, skip_patterns):
+    subject = email.get("subject", "").lower()
+    from_email = email.get("from_email", "").lower()
+    text = f"{subject} {from_email}"
+
+    for pattern in skip_patterns:
+        if re.search(pattern, text, re.IGNORECASE):
+            return True
+    return False
+
+
+def timed(fn, emails):
+    t0 = time.perf_counter()
+    results = [fn(e) for e in emails]
+    return time.perf_counter() - t0, results
+
+
+def compare(label, legacy_fn, compiled_fn, emails):
+    legacy_time, legacy = timed(legacy_fn, emails)
+    compiled_time, compiled = timed(compiled_fn, emails)
+    print(f"  {label:<30} legacy {legacy_time * 1000:7.1f}ms  compiled {compiled_time * 1000:7.1f}ms  "
+          f"({legacy_time / compiled_time:4.1f}x)  identical: {legacy == compiled}")
+    return legacy == compiled
+
+
+def main():
+    num_emails = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    emails = make_corpus(num_emails)
+    print(f"Classifying {num_emails} synthetic emails")
+
+    ok = compare("secondfilter.detect_stages",
+                 lambda e: legacy_detect_stages(e, secondfilter.STAGE_PATTERNS), secondfilter.detect_stages, emails)
+    ok &= compare("secondfilter.should_skip",
+                  lambda e: legacy_should_skip(e, secondfilter.SKIP_PATTERNS), secondfilter.should_skip, emails)
+    ok &= compare("gmail_backend.detect_stages",
+                  lambda e: legacy_detect_stages(e, gmail_backend.STAGE_PATTERNS), gmail_backend.detect_stages, emails)
+    if not ok:
+        sys.exit("Compiled classifier results differ from the per-pattern loop")
+
+
+if __name__ == "__main__":
+    main()
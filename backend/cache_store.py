@@ -0,0 +1,310 @@
+"""
+Transactional storage for the local server's per-user application cache.
+Replaces the whole-file cache.json rewrites with SQLite (WAL mode):
+- users: one row per user (date range, Gmail history id, last update time)
+- companies: one row per company, so CRUD edits touch a single record
+Each write runs in its own IMMEDIATE transaction, so concurrent requests
+cannot lose each other's updates.
+
+Reads are served from an in-memory copy of each user's entry. Writes through
+this store refresh that copy; commits by other processes are detected via
+SQLite's data_version counter and drop the copy.
+"""
+import os
+import json
+import time
+import sqlite3
+import threading
+
+CACHE_DB = os.path.join(os.path.dirname(__file__), "cache.db")
+
+
+class CompanyNotFound(KeyError):
+    pass
+
+
+class InvalidPositionIndex(IndexError):
+    pass
+
+
+class CacheStore:
+    """Per-user application cache with atomic single-company updates."""
+
+    def __init__(self, path=CACHE_DB):
+        self.path = path
+        self._lock = threading.RLock()
+        # Autocommit mode; transactions are opened explicitly in _transaction()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS users (
+                user_email TEXT PRIMARY KEY,
+                earliest_date TEXT,
+                latest_date TEXT,
+                history_id TEXT,
+                timestamp REAL
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS companies (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_email TEXT NOT NULL,
+                name_lower TEXT NOT NULL,
+                data TEXT NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS companies_user ON companies (user_email, name_lower)")
+
+        # Parsed user entries, valid while data_version is unchanged
+        self._memory = {}
+        self._memory_complete = False
+        self._memory_version = None
+
+    # -------------------------
+    # Internal helpers
+    # -------------------------
+    def _transaction(self):
+        return _Transaction(self)
+
+    def _companies(self, user_email):
+        rows = self._conn.execute(
+            "SELECT data FROM companies WHERE user_email = ? ORDER BY id", (user_email,)
+        ).fetchall()
+        return [json.loads(r[0]) for r in rows]
+
+    def _find_company(self, user_email, company_name):
+        row = self._conn.execute(
+            "SELECT id, data FROM companies WHERE user_email = ? AND name_lower = ? ORDER BY id LIMIT 1",
+            (user_email, company_name.lower())
+        ).fetchone()
+        if row is None:
+            raise CompanyNotFound(company_name)
+        return row[0], json.loads(row[1])
+
+    def _write_company(self, row_id, company):
+        self._conn.execute(
+            "UPDATE companies SET name_lower = ?, data = ? WHERE id = ?",
+            (company["name"].lower(), json.dumps(company), row_id)
+        )
+
+    def _insert_company(self, user_email, company):
+        self._conn.execute(
+            "INSERT INTO companies (user_email, name_lower, data) VALUES (?, ?, ?)",
+            (user_email, company["name"].lower(), json.dumps(company))
+        )
+
+    def _check_memory(self):
+        """Drop remembered entries if another connection has committed since they were read."""
+        version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        if version != self._memory_version:
+            self._memory.clear()
+            self._memory_complete = False
+            self._memory_version = version
+
+    def _load_user(self, user_email):
+        row = self._conn.execute(
+            "SELECT earliest_date, latest_date, history_id, timestamp FROM users WHERE user_email = ?",
+            (user_email,)
+        ).fetchone()
+        if row is None:
+            return None
+        companies = self._companies(user_email)
+
+        earliest_date, latest_date, history_id, timestamp = row
+        return {
+            "earliest_date": earliest_date,
+            "latest_date": latest_date,
+            "companies": companies,
+            "total_companies": len(companies),
+            "total_applications": sum(len(c.get("positions", [])) for c in companies),
+            "timestamp": timestamp,
+            "history_id": history_id,
+        }
+
+    def _remember(self, user_email):
+        """Refresh the in-memory entry after a write (called inside the write transaction)."""
+        entry = self._load_user(user_email)
+        if entry is None:
+            self._memory.pop(user_email, None)
+        else:
+            self._memory[user_email] = entry
+        return entry
+
+    def _touch_user(self, user_email):
+        self._conn.execute("""
+            INSERT INTO users (user_email, timestamp) VALUES (?, ?)
+            ON CONFLICT (user_email) DO UPDATE SET timestamp = excluded.timestamp
+        """, (user_email, time.time()))
+
+    # -------------------------
+    # Reads
+    # -------------------------
+    def get_user(self, user_email):
+        """Return the user's cache entry (same shape as the old cache.json entry), or None.
+        Entries are shared in-memory objects: treat them as read-only."""
+        with self._lock:
+            self._check_memory()
+            if user_email in self._memory:
+                return self._memory[user_email]
+            if self._memory_complete:
+                return None
+            return self._remember(user_email)
+
+    def all_users(self):
+        """Return {user_email: entry} for every cached user."""
+        with self._lock:
+            self._check_memory()
+            if not self._memory_complete:
+                for (user_email,) in self._conn.execute("SELECT user_email FROM users").fetchall():
+                    if user_email not in self._memory:
+                        self._remember(user_email)
+                self._memory_complete = True
+            return dict(sorted(self._memory.items()))
+
+    # -------------------------
+    # Writes
+    # -------------------------
+    def save_user(self, user_email, earliest_date, latest_date, companies, history_id=None):
+        """Replace a user's whole cache entry (after a processing run)."""
+        with self._transaction():
+            self._conn.execute("""
+                INSERT INTO users (user_email, earliest_date, latest_date, history_id, timestamp)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (user_email) DO UPDATE SET
+                    earliest_date = excluded.earliest_date,
+                    latest_date = excluded.latest_date,
+                    history_id = excluded.history_id,
+                    timestamp = excluded.timestamp
+            """, (user_email, earliest_date, latest_date, history_id, time.time()))
+            self._conn.execute("DELETE FROM companies WHERE user_email = ?", (user_email,))
+            for company in companies:
+                self._insert_company(user_email, company)
+            self._remember(user_email)
+
+    def add_position(self, user_email, company_name, position):
+        """Append a position to a company, creating the company (marked manual) if needed.
+        Returns the user's updated company list."""
+        with self._transaction():
+            try:
+                row_id, company = self._find_company(user_email, company_name)
+                company["positions"].append(position)
+                self._write_company(row_id, company)
+            except CompanyNotFound:
+                self._insert_company(user_email, {
+                    "name": company_name,
+                    "positions": [position],
+                    "email_count": 0,
+                    "manual": True
+                })
+            self._touch_user(user_email)
+            return self._remember(user_email)["companies"]
+
+    def update_company(self, user_email, company_name, new_company_name=None, position_index=None, position=None):
+        """Rename a company and/or replace one of its positions.
+        Returns the user's updated company list."""
+        with self._transaction():
+            row_id, company = self._find_company(user_email, company_name)
+
+            if new_company_name:
+                company["name"] = new_company_name
+
+            if position is not None and position_index is not None:
+                if position_index < 0 or position_index >= len(company["positions"]):
+                    raise InvalidPositionIndex(position_index)
+                company["positions"][position_index] = position
+
+            self._write_company(row_id, company)
+            self._touch_user(user_email)
+            return self._remember(user_email)["companies"]
+
+    def delete(self, user_email, company_name, position_index=None):
+        """Delete one position (and the company if it becomes empty), or the whole company.
+        Returns the user's updated company list."""
+        with self._transaction():
+            row_id, company = self._find_company(user_email, company_name)
+
+            if position_index is not None:
+                if position_index < 0 or position_index >= len(company["positions"]):
+                    raise InvalidPositionIndex(position_index)
+                company["positions"].pop(position_index)
+
+            if position_index is None or not company["positions"]:
+                self._conn.execute("DELETE FROM companies WHERE id = ?", (row_id,))
+            else:
+                self._write_company(row_id, company)
+
+            self._touch_user(user_email)
+            return self._remember(user_email)["companies"]
+
+    def clear(self):
+        with self._transaction():
+            self._conn.execute("DELETE FROM companies")
+            self._conn.execute("DELETE FROM users")
+            self._memory.clear()
+            self._memory_complete = True
+
+    # -------------------------
+    # Migration
+    # -------------------------
+    def migrate_from_json(self, json_path):
+        """
+        One-time import of the legacy cache.json format ({user_email: entry}).
+        The JSON file is renamed to <name>.migrated afterwards.
+        Returns the number of users imported.
+        """
+        if not os.path.exists(json_path):
+            return 0
+
+        try:
+            with open(json_path, 'r') as f:
+                legacy = json.load(f)
+        except (json.JSONDecodeError, IOError) as e:
+            print(f"Warning: Could not read legacy cache {json_path}: {e}")
+            return 0
+
+        with self._transaction():
+            for user_email, entry in legacy.items():
+                if self.get_user(user_email) is not None:
+                    continue  # Never overwrite data already in the store
+                self.save_user(
+                    user_email,
+                    entry.get("earliest_date"),
+                    entry.get("latest_date"),
+                    entry.get("companies", []),
+                    entry.get("history_id")
+                )
+                if entry.get("timestamp"):
+                    self._conn.execute("UPDATE users SET timestamp = ? WHERE user_email = ?",
+                                       (entry["timestamp"], user_email))
+                    self._remember(user_email)
+
+        os.replace(json_path, json_path + ".migrated")
+        return len(legacy)
+
+
+class _Transaction:
+    """Re-entrant BEGIN IMMEDIATE ... COMMIT/ROLLBACK block holding the store lock."""
+
+    def __init__(self, store):
+        self.store = store
+
+    def __enter__(self):
+        self.store._lock.acquire()
+        self.outer = not self.store._conn.in_transaction
+        if self.outer:
+            self.store._conn.execute("BEGIN IMMEDIATE")
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if self.outer:
+                if exc_type:
+                    self.store._conn.execute("ROLLBACK")
+                    # Entries refreshed inside the rolled-back transaction are no longer valid
+                    self.store._memory.clear()
+                    self.store._memory_complete = False
+                else:
+                    self.store._conn.execute("COMMIT")
+        finally:
+            self.store._lock.release()
+        return False
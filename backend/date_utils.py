@@ -0,0 +1,45 @@
+"""
+Date normalization shared by local_server.py and secondfilter.py
+(gmail_backend.py keeps its own copy, since it is deployed as a single file).
+
+parse_date() turns the date strings found on emails into YYYY-MM-DD:
+- ISO strings (what gmail_backend.parse_message produces) take a slice fast path
+- RFC 2822 headers go through email.utils.parsedate_to_datetime, so zone
+  suffixes such as "+0000 (UTC)", "GMT" or "EST" parse instead of failing
+The date is the sender's local calendar date, the same one the ISO strings
+carry (they keep the sender's UTC offset). Results are memoized.
+"""
+import re
+from functools import lru_cache
+from email.utils import parsedate_to_datetime
+
+ISO_DATE_RE = re.compile(r"(\d{4}-\d{2}-\d{2})")
+
+
+def _iso_prefix(date_str):
+    head = date_str[:10]
+    if (len(head) == 10 and head[4] == "-" and head[7] == "-"
+            and head[:4].isdecimal() and head[5:7].isdecimal() and head[8:].isdecimal()):
+        return head
+    return None
+
+
+@lru_cache(maxsize=65536)
+def parse_date(date_str):
+    """Normalize date to YYYY-MM-DD format (None if it can't be parsed)"""
+    if not date_str:
+        return None
+
+    # ISO format: 2025-10-02T03:43:14+00:00
+    iso = _iso_prefix(date_str)
+    if iso:
+        return iso
+    match = ISO_DATE_RE.search(date_str)
+    if match:
+        return match.group(1)
+
+    # RFC format: Mon, 03 Nov 2025 21:43:20 +0000
+    try:
+        return parsedate_to_datetime(date_str).strftime("%Y-%m-%d")
+    except (TypeError, ValueError, IndexError, OverflowError):
+        return None
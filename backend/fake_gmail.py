@@ -0,0 +1,210 @@
+"""
+In-memory stand-in for the Gmail API client returned by
+googleapiclient.discovery.build('gmail', 'v1', ...).
+Used to benchmark gmail_backend fetch paths offline.
+
+Every .execute() sleeps for `latency` seconds to simulate one HTTPS round
+trip, so batch requests cost one round trip no matter how many calls they hold.
+With quota_per_sec set, calls are charged Gmail quota units from a per-user
+bucket (one second of burst) and fail with HttpError 429 once it is empty,
+like Gmail's per-user rate limit.
+"""
+import time
+import base64
+import threading
+from datetime import datetime, timedelta, timezone
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+SAMPLE_SUBJECTS = [
+    "Thank you for applying to {company}",
+    "{company} | Application update",
+    "Your HackerRank coding test for {company}",
+    "HireVue video interview invitation - {company}",
+    "Interview scheduled with {company}",
+    "Your application to {company}",
+]
+SAMPLE_COMPANIES = ["Goldman Sachs", "BlackRock", "UBS", "ION Group", "MUFG", "Bloomberg"]
+
+
+def _b64(text):
+    return base64.urlsafe_b64encode(text.encode("utf-8")).decode("ascii")
+
+
+def make_message(idx):
+    """Build a synthetic Gmail message resource (format='full')."""
+    company = SAMPLE_COMPANIES[idx % len(SAMPLE_COMPANIES)]
+    subject = SAMPLE_SUBJECTS[idx % len(SAMPLE_SUBJECTS)].format(company=company)
+    domain = company.lower().replace(" ", "") + ".com"
+    sent = datetime(2025, 8, 1, 9, 30, tzinfo=timezone.utc) + timedelta(hours=7 * idx)
+    body = (f"Dear candidate, thank you for your application to {company}. "
+            "We will review your profile and be in touch. " * 4)
+    html = f"<html><style>p{{color:red}}</style><body><p>{body}</p></body></html>"
+    return {
+        "id": f"msg{idx:06d}",
+        "threadId": f"thr{idx:06d}",
+        "payload": {
+            "mimeType": "multipart/alternative",
+            "headers": [
+                {"name": "Subject", "value": subject},
+                {"name": "From", "value": f"Recruiting <careers@{domain}>"},
+                {"name": "Date", "value": sent.strftime("%a, %d %b %Y %H:%M:%S %z")},
+            ],
+            "parts": [
+                {"mimeType": "text/plain", "filename": "", "body": {"data": _b64(body)}},
+                {"mimeType": "text/html", "filename": "", "body": {"data": _b64(html)}},
+            ],
+        },
+    }
+
+
+def _rate_limit_error():
+    return HttpError(httplib2.Response({"status": 429}),
+                     b'{"error": {"code": 429, "errors": [{"reason": "rateLimitExceeded"}]}}')
+
+
+class _Request:
+    def __init__(self, service, fn, units=5):
+        self._service = service
+        self._fn = fn
+        self._units = units
+
+    def execute(self):
+        self._service.round_trips += 1
+        time.sleep(self._service.latency)
+        self._service.charge(self._units)
+        return self._fn()
+
+
+class _BatchRequest:
+    def __init__(self, service, callback):
+        self._service = service
+        self._callback = callback
+        self._requests = []
+
+    def add(self, request, callback=None, request_id=None):
+        self._requests.append((request, callback or self._callback, request_id or str(len(self._requests))))
+
+    def execute(self):
+        self._service.round_trips += 1
+        time.sleep(self._service.latency)
+        for request, callback, request_id in self._requests:
+            try:
+                self._service.charge(request._units)
+                response, exception = request._fn(), None
+            except Exception as e:
+                response, exception = None, e
+            callback(request_id, response, exception)
+
+
+class _Messages:
+    def __init__(self, service):
+        self._service = service
+
+    def list(self, userId, q=None, maxResults=100, pageToken=None, **kwargs):
+        def run():
+            start = int(pageToken or 0)
+            ids = self._service.message_ids[start:start + maxResults]
+            resp = {"messages": [{"id": i, "threadId": i} for i in ids],
+                    "resultSizeEstimate": len(self._service.message_ids)}
+            if start + maxResults < len(self._service.message_ids):
+                resp["nextPageToken"] = str(start + maxResults)
+            return resp
+        return _Request(self._service, run, 5)
+
+    def get(self, userId, id, format="full", **kwargs):
+        def run():
+            if id not in self._service.messages:
+                raise KeyError(f"Message {id} not found")
+            msg = self._service.messages[id]
+            if format == "metadata":
+                return {**msg, "payload": {"mimeType": msg["payload"]["mimeType"],
+                                           "headers": msg["payload"]["headers"]}}
+            return msg
+        return _Request(self._service, run, 5)
+
+
+class _History:
+    def __init__(self, service):
+        self._service = service
+
+    def list(self, userId, startHistoryId, historyTypes=None, labelId=None, pageToken=None, maxResults=100, **kwargs):
+        def run():
+            records = [{"id": str(hid), "messagesAdded": [{"message": {"id": msg_id, "labelIds": ["INBOX"]}}]}
+                       for hid, msg_id in self._service.history if hid > int(startHistoryId)]
+            start = int(pageToken or 0)
+            resp = {"history": records[start:start + maxResults], "historyId": str(self._service.history_id)}
+            if start + maxResults < len(records):
+                resp["nextPageToken"] = str(start + maxResults)
+            return resp
+        return _Request(self._service, run, 2)
+
+
+class _Users:
+    def __init__(self, service):
+        self._service = service
+
+    def messages(self):
+        return _Messages(self._service)
+
+    def history(self):
+        return _History(self._service)
+
+    def getProfile(self, userId):
+        return _Request(self._service, lambda: {
+            "emailAddress": self._service.email_address,
+            "messagesTotal": len(self._service.message_ids),
+            "threadsTotal": len(self._service.message_ids),
+            "historyId": str(self._service.history_id),
+        }, 1)
+
+
+class FakeGmailService:
+    """Minimal fake of the Gmail v1 service object."""
+
+    def __init__(self, num_messages=200, latency=0.05, email_address="candidate@example.com", quota_per_sec=None):
+        self.latency = latency
+        self.email_address = email_address
+        self.round_trips = 0
+        self.quota_per_sec = quota_per_sec
+        self.units_charged = 0
+        self.rate_limited = 0
+        self._quota = quota_per_sec or 0
+        self._quota_updated = time.monotonic()
+        self._quota_lock = threading.Lock()
+        self.messages = {}
+        self.message_ids = []
+        self.history = []
+        self.history_id = 1000
+        for _ in range(num_messages):
+            self.add_message()
+
+    def add_message(self):
+        """Deliver a new synthetic message (recorded in the mailbox history)."""
+        msg = make_message(len(self.message_ids))
+        self.messages[msg["id"]] = msg
+        self.message_ids.append(msg["id"])
+        self.history_id += 1
+        self.history.append((self.history_id, msg["id"]))
+        return msg
+
+    def charge(self, units):
+        """Spend quota units; raises HttpError 429 if the per-user bucket is empty."""
+        if not self.quota_per_sec:
+            return
+        with self._quota_lock:
+            now = time.monotonic()
+            self._quota = min(self.quota_per_sec, self._quota + (now - self._quota_updated) * self.quota_per_sec)
+            self._quota_updated = now
+            if self._quota < units:
+                self.rate_limited += 1
+                raise _rate_limit_error()
+            self._quota -= units
+            self.units_charged += units
+
+    def users(self):
+        return _Users(self)
+
+    def new_batch_http_request(self, callback=None):
+        return _BatchRequest(self, callback)
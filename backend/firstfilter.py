@@ -7,7 +7,9 @@ import json
 import time
 import requests
 from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
 from openai import AzureOpenAI
+from llm_cache import cached_completion
 
 # =========================
 # 0) Azure OpenAI CONFIG
@@ -25,6 +27,14 @@ MODEL = "gpt-5-mini"
 BASE_URL = "https://gmail-login-backend.onrender.com/query"
 OUTPUT_DIR = "applied_companies"  # New output folder for comparison
 
+# Keep-alive session reused for every Render request
+session = requests.Session()
+
+# Render session id shown after logging in at the Render URL (each login is its own session)
+GMAIL_SESSION_ID = os.environ.get("GMAIL_SESSION_ID")
+if GMAIL_SESSION_ID:
+    session.headers["X-Session-Id"] = GMAIL_SESSION_ID
+
 # Generic tokens to EXCLUDE from search queries (too broad)
 GENERIC_TOKENS = {
     "group", "teams", "page", "career", "careers", "jobs", "job",
@@ -44,34 +54,42 @@ ATS_DOMAINS = {
 # =========================
 # 2) Fetch Gmail with Pagination
 # =========================
-def fetch_all_emails(query, max_loops=50, format_type="full"):
-    """Fetch ALL Gmail emails by following next_page_token.
+def iter_all_emails(query, max_loops=50, format_type="full"):
+    """Stream Gmail emails by following next_page_token.
+    The next page is requested in the background while the current one is consumed.
 
     Args:
         query: Gmail search query
         max_loops: Maximum pagination loops
         format_type: "full" for complete email with body, "metadata" for headers only
     """
-    all_msgs = []
-    next_page = None
-
-    for _ in range(max_loops):
+    def fetch_page(page_token):
         params = {"q": query, "format": format_type}
-        if next_page:
-            params["page_token"] = next_page
+        if page_token:
+            params["page_token"] = page_token
 
-        resp = requests.get(BASE_URL, params=params, timeout=60)
+        resp = session.get(BASE_URL, params=params, timeout=60)
         resp.raise_for_status()
-        d = resp.json()
+        return resp.json()
 
-        msgs = d.get("messages", [])
-        all_msgs.extend(msgs)
+    with ThreadPoolExecutor(max_workers=1) as prefetcher:
+        future = prefetcher.submit(fetch_page, None)
+        for loop in range(max_loops):
+            d = future.result()
 
-        next_page = d.get("next_page_token")
-        if not next_page:
-            break
+            next_page = d.get("next_page_token") if loop + 1 < max_loops else None
+            if next_page:
+                future = prefetcher.submit(fetch_page, next_page)
 
-    return {"messages": all_msgs}
+            yield from d.get("messages", [])
+
+            if not next_page:
+                break
+
+
+def fetch_all_emails(query, max_loops=50, format_type="full"):
+    """Fetch ALL Gmail emails by following next_page_token (see iter_all_emails)."""
+    return {"messages": list(iter_all_emails(query, max_loops, format_type))}
 
 
 # =========================
@@ -312,7 +330,8 @@ Emails:
 
     # Step 4: Call GPT to extract companies
     print("\n🤖 Calling GPT to extract companies...")
-    response = client.chat.completions.create(
+    raw_output = cached_completion(
+        client,
         model=MODEL,
         messages=[
             {"role": "system", "content": "You extract company names from job application emails."},
@@ -320,7 +339,6 @@ Emails:
         ]
     )
 
-    raw_output = response.choices[0].message.content or ""
     only_json = extract_first_json(raw_output)
 
     try:
@@ -342,7 +360,8 @@ Input: {companies_raw}
 Output JSON: {{"clean_companies": ["Company1", "Company2", ...]}}"""
 
     print("\n🤖 Cleaning company names...")
-    resp2 = client.chat.completions.create(
+    clean_output = cached_completion(
+        client,
         model=MODEL,
         messages=[
             {"role": "system", "content": "You clean and deduplicate company names."},
@@ -350,7 +369,7 @@ Output JSON: {{"clean_companies": ["Company1", "Company2", ...]}}"""
         ]
     )
 
-    clean_json = extract_first_json(resp2.choices[0].message.content or "")
+    clean_json = extract_first_json(clean_output)
     try:
         companies = json.loads(clean_json).get("clean_companies", [])
     except:
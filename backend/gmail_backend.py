@@ -1,17 +1,33 @@
 import os
 import re
 import base64
+import codecs
+import html
 import json
-from flask import Flask, request, jsonify, redirect
+import time
+import random
+import secrets
+import threading
+from collections import OrderedDict, deque
+from functools import lru_cache
+from email.utils import parsedate_to_datetime
+from flask import Flask, request, jsonify, redirect, g
 from flask_cors import CORS
 from google_auth_oauthlib.flow import Flow
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
 from google.oauth2.credentials import Credentials
-from datetime import datetime
+from google.auth.transport.requests import Request
+from google.auth.exceptions import RefreshError
+from datetime import datetime, timedelta, timezone
 from openai import AzureOpenAI
 
 app = Flask(__name__)
-CORS(app)  # Enable CORS for frontend requests
+
+# The only page allowed to call this API from a browser and to receive the
+# session id from the login popup (a session id gives access to the mailbox)
+FRONTEND_ORIGIN = os.environ.get("FRONTEND_ORIGIN", "http://localhost:3000")
+CORS(app, origins=[FRONTEND_ORIGIN])
 
 # Allow OAuth without https during local dev (Render uses https automatically)
 os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1'
@@ -53,7 +69,50 @@ CLIENT_CONFIG = {
     }
 }
 
+# Single-user token from before sessions. Requests without a session id only use it
+# when ALLOW_LEGACY_TOKEN=true (single-user deployments); otherwise they get 401
 TOKEN_FILE = "/opt/render/project/token.json"
+ALLOW_LEGACY_TOKEN = os.environ.get("ALLOW_LEGACY_TOKEN", "").lower() == "true"
+
+# Per-user tokens, one <session id>.json per login
+TOKEN_DIR = os.environ.get("TOKEN_DIR", "/opt/render/project/tokens")
+SESSION_HEADER = "X-Session-Id"
+SESSION_ID_RE = re.compile(r"^[A-Za-z0-9_-]{32,64}$")
+# Sessions whose Gmail clients are kept built in memory (least recently used are dropped)
+MAX_CACHED_SESSIONS = int(os.environ.get("MAX_CACHED_SESSIONS", 256))
+# Concurrent Gmail requests per session; more wait up to SESSION_WAIT seconds, then get 429
+SESSION_MAX_CONCURRENCY = int(os.environ.get("SESSION_MAX_CONCURRENCY", 4))
+SESSION_WAIT = float(os.environ.get("SESSION_WAIT", 30))
+
+# Max requests per Gmail batch call (Google recommends <= 50 to avoid rate limiting)
+BATCH_SIZE = 50
+
+# format=metadata returns only these headers (no body download or MIME decoding)
+METADATA_HEADERS = ['Subject', 'From', 'Date']
+QUERY_FORMATS = ('full', 'metadata', 'ids')
+
+# Body text kept per message; extraction stops once this much has been produced
+BODY_MAX_CHARS = 2000
+# base64 characters decoded per step while extracting a body (multiple of 4)
+BODY_DECODE_CHUNK = 16384
+
+# Refresh the access token this long before it expires, rather than on a 401 mid-request
+TOKEN_REFRESH_MARGIN = timedelta(minutes=5)
+
+# Gmail quota units per call and the per-user ceiling (units/second)
+# https://developers.google.com/gmail/api/reference/quota
+QUOTA_UNITS = {"messages.list": 5, "messages.get": 5, "history.list": 2, "getProfile": 1}
+GMAIL_QUOTA_PER_SEC = float(os.environ.get("GMAIL_QUOTA_PER_SEC", 250))
+# AIMD on the allowed rate: x0.5 on a rate-limit error, +2% of the ceiling per successful call, never below 10%
+AIMD_DECREASE = 0.5
+AIMD_INCREASE = 0.02
+AIMD_MIN_FRACTION = 0.1
+# Rate-limit and 5xx errors are retried with full-jitter exponential backoff
+GMAIL_MAX_RETRIES = int(os.environ.get("GMAIL_MAX_RETRIES", 5))
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 16
+# Seconds of history behind the utilization metric
+QUOTA_WINDOW = 10
 
 # =========================
 # GENERIC TOKENS TO EXCLUDE
@@ -115,31 +174,171 @@ STAGE_PATTERNS = {
 }
 
 
+# Compiled stage matchers (same approach as backend/stage_classifier.py, copied here
+# because this file is deployed on its own). Text is already lowercased, so patterns
+# are lowercased instead of using re.IGNORECASE (which disables re's fast literal
+# scan) and plain literals become substring checks - same matches as before.
+REGEX_META = set(".^$*+?{}[]|()\\")
+CASE_FOLDED_ONLY = ("ſ", "ı")  # re.IGNORECASE also matches these onto ASCII 's'/'i'
+
+
+def lower_literals(pattern):
+    """Lowercase a pattern's letters, leaving escapes such as \\S or \\D intact."""
+    return re.sub(r"\\.|[A-Z]+", lambda m: m.group(0) if m.group(0)[0] == "\\" else m.group(0).lower(), pattern)
+
+
+def compile_stage_matchers(patterns):
+    """(substring literals, case-sensitive searches, IGNORECASE searches) for one stage."""
+    lowered = [lower_literals(p) for p in patterns]
+    return (
+        tuple(p for p in lowered if not REGEX_META & set(p)),
+        [re.compile(p).search for p in lowered if REGEX_META & set(p)],
+        [re.compile(p, re.IGNORECASE).search for p in patterns],
+    )
+
+
+STAGE_MATCHERS = {stage: compile_stage_matchers(patterns) for stage, patterns in STAGE_PATTERNS.items()}
+
+
 # =========================
 # HELPER FUNCTIONS
 # =========================
-def extract_body_recursive(payload, prefer_html=False):
-    """Recursively parse Gmail message payload to extract body content."""
+WHITESPACE_RE = re.compile(r"\s+")
+
+# One token per match: skipped block | unterminated style/script/comment | quote | tag | text
+HTML_TOKEN_RE = re.compile(
+    r"(?P<skip><(style|script)\b.*?</\2\s*>|<!--.*?-->)"
+    r"|(?P<open><(?:style|script)\b|<!--)"
+    r"|(?P<quote><blockquote\b[^>]*>)"
+    r"|(?P<tag><[^>]*>)"
+    r"|(?P<text>[^<]+)"
+    r"|(?P<lt><)",
+    re.DOTALL | re.IGNORECASE
+)
+BARE_TAG_RE = re.compile(r"<[^>]*>|<")
+# "On Mon, 3 Nov 2025 at 09:00, Recruiting <jobs@x.com> wrote:" (may wrap onto a second line)
+REPLY_HEADER_RE = re.compile(
+    r"^(On\b[^\n]{0,300}(?:\n[^\n]{0,300})?\bwrote:|-{2,}\s*Original Message\s*-{2,})\s*$"
+)
+REPLY_TAIL_RE = re.compile(r"\s*\bOn\s.{0,300}\bwrote:\s*$")
+
+
+def iter_decoded(body_data):
+    """Decode base64url body data to text a chunk at a time."""
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='ignore')
+    for start in range(0, len(body_data), BODY_DECODE_CHUNK):
+        piece = body_data[start:start + BODY_DECODE_CHUNK]
+        final = start + BODY_DECODE_CHUNK >= len(body_data)
+        if final:
+            piece += "=" * (-len(piece) % 4)
+        yield decoder.decode(base64.urlsafe_b64decode(piece), final=final)
+
+
+def plain_text_body(body_data, max_chars=BODY_MAX_CHARS):
+    """Decode a text/plain part up to max_chars, dropping '>' quoted lines and
+    stopping at a reply header ("On ... wrote:", "-----Original Message-----")."""
+    lines = []
+    length = 0
+    pending = ""
+    chunks = iter_decoded(body_data)
+    while length < max_chars:
+        chunk = next(chunks, None)
+        final = chunk is None
+        pending += chunk or ""
+        complete = pending.splitlines(keepends=True)
+        pending = complete.pop() if complete and not final and not complete[-1].endswith(("\n", "\r")) else ""
+        for line in complete:
+            if line.startswith(">"):
+                continue
+            if REPLY_HEADER_RE.match(line.rstrip("\r\n")):
+                return "".join(lines)[:max_chars]
+            if lines and REPLY_HEADER_RE.match(lines[-1].rstrip("\r\n") + "\n" + line.rstrip("\r\n")):
+                lines.pop()
+                return "".join(lines)[:max_chars]
+            lines.append(line)
+            length += len(line)
+            if length >= max_chars:
+                break
+        if final:
+            break
+    return "".join(lines)[:max_chars]
+
+
+def html_to_text(body_data, max_chars=BODY_MAX_CHARS):
+    """Decode and strip a text/html part incrementally, stopping once max_chars of
+    text have been produced or a quoted reply (<blockquote>) starts.
+    Style/script/comment blocks are dropped, tags become spaces, entities are
+    unescaped and whitespace is collapsed."""
+    out = []
+    length = 0
+    buf = ""
+    pos = 0
+    final = False
+    chunks = iter_decoded(body_data)
+    quoted = False
+
+    def emit(piece):
+        nonlocal length
+        piece = WHITESPACE_RE.sub(" ", piece)
+        if piece.startswith(" ") and (not out or out[-1].endswith(" ")):
+            piece = piece[1:]
+        if piece:
+            out.append(piece)
+            length += len(piece)
+
+    while length < max_chars:
+        m = HTML_TOKEN_RE.match(buf, pos) if pos < len(buf) else None
+        # A token touching the end of the buffer may continue in the next chunk
+        if not final and (m is None or m.end() == len(buf) or m.group('open') or m.group('lt')):
+            chunk = next(chunks, None)
+            if chunk is None:
+                final = True
+            else:
+                buf = buf[pos:] + chunk
+                pos = 0
+            continue
+        if m is None:
+            break
+        if m.group('open'):
+            # Never closed: strip just the opening tag, like any other tag
+            m = BARE_TAG_RE.match(buf, pos)
+            emit(" ")
+        elif m.group('quote'):
+            if "".join(out).strip():
+                quoted = True
+                break
+            emit(" ")
+        elif m.group('tag'):
+            emit(" ")
+        elif m.group('text') or m.group('lt'):
+            emit(html.unescape(m.group(0)))
+        pos = m.end()
+
+    text = "".join(out)
+    if length < max_chars:
+        text = text.rstrip()
+    if quoted:
+        text = REPLY_TAIL_RE.sub("", text)
+    return text[:max_chars]
+
+
+def extract_body_recursive(payload, prefer_html=False, max_chars=BODY_MAX_CHARS):
+    """Recursively parse Gmail message payload to extract body content (at most max_chars)."""
     mime_type = payload.get('mimeType', '')
 
     if mime_type == 'text/plain':
         body_data = payload.get('body', {}).get('data')
         if body_data:
-            return base64.urlsafe_b64decode(body_data).decode('utf-8', errors='ignore')
+            return plain_text_body(body_data, max_chars)
 
     if mime_type == 'text/html' and prefer_html:
         body_data = payload.get('body', {}).get('data')
         if body_data:
-            html = base64.urlsafe_b64decode(body_data).decode('utf-8', errors='ignore')
-            text = re.sub(r'<style[^>]*>.*?</style>', '', html, flags=re.DOTALL)
-            text = re.sub(r'<script[^>]*>.*?</script>', '', text, flags=re.DOTALL)
-            text = re.sub(r'<[^>]+>', ' ', text)
-            text = re.sub(r'\s+', ' ', text).strip()
-            return text
+            return html_to_text(body_data, max_chars)
 
     if 'parts' in payload:
         plain_text = None
-        html_text = None
+        html_data = None
 
         for part in payload['parts']:
             part_mime = part.get('mimeType', '')
@@ -148,33 +347,31 @@ def extract_body_recursive(payload, prefer_html=False):
                 continue
 
             if part_mime.startswith('multipart/'):
-                result = extract_body_recursive(part, prefer_html)
+                result = extract_body_recursive(part, prefer_html, max_chars)
                 if result:
                     return result
 
             elif part_mime == 'text/plain':
                 body_data = part.get('body', {}).get('data')
                 if body_data:
-                    plain_text = base64.urlsafe_b64decode(body_data).decode('utf-8', errors='ignore')
+                    plain_text = plain_text_body(body_data, max_chars)
 
             elif part_mime == 'text/html':
                 body_data = part.get('body', {}).get('data')
                 if body_data:
-                    html = base64.urlsafe_b64decode(body_data).decode('utf-8', errors='ignore')
-                    text = re.sub(r'<style[^>]*>.*?</style>', '', html, flags=re.DOTALL)
-                    text = re.sub(r'<script[^>]*>.*?</script>', '', text, flags=re.DOTALL)
-                    text = re.sub(r'<[^>]+>', ' ', text)
-                    text = re.sub(r'\s+', ' ', text).strip()
-                    html_text = text
+                    html_data = body_data
 
         if plain_text:
             return plain_text
-        if html_text:
-            return html_text
+        # HTML is only decoded when there is no plain-text alternative
+        if html_data:
+            html_text = html_to_text(html_data, max_chars)
+            if html_text:
+                return html_text
 
     body_data = payload.get('body', {}).get('data')
     if body_data:
-        return base64.urlsafe_b64decode(body_data).decode('utf-8', errors='ignore')
+        return plain_text_body(body_data, max_chars)
 
     return ""
 
@@ -220,14 +417,22 @@ def extract_json(text):
     return {}
 
 
+@lru_cache(maxsize=65536)
 def parse_date(date_str):
-    """Extract YYYY-MM-DD from various date formats."""
+    """Extract YYYY-MM-DD from various date formats (same logic as backend/date_utils.py)."""
     if not date_str:
         return None
+    head = date_str[:10]  # ISO fast path: 2025-10-02T03:43:14+00:00
+    if (len(head) == 10 and head[4] == "-" and head[7] == "-"
+            and head[:4].isdecimal() and head[5:7].isdecimal() and head[8:].isdecimal()):
+        return head
     match = re.search(r'(\d{4}-\d{2}-\d{2})', date_str)
     if match:
         return match.group(1)
-    return None
+    try:
+        return parsedate_to_datetime(date_str).strftime("%Y-%m-%d")
+    except (TypeError, ValueError, IndexError, OverflowError):
+        return None
 
 
 def clean_domain(email):
@@ -249,17 +454,246 @@ def detect_stages(email):
     body = email.get("body", "").lower()[:500]
     text = f"{subject} {from_email} {body}"
 
+    case_folding = any(c in text for c in CASE_FOLDED_ONLY)
     detected = []
-    for stage, patterns in STAGE_PATTERNS.items():
-        for pattern in patterns:
-            if re.search(pattern, text, re.IGNORECASE):
-                detected.append(stage)
-                break
+    for stage, (literals, searches, folding_searches) in STAGE_MATCHERS.items():
+        if case_folding:
+            matched = any(search(text) for search in folding_searches)
+        else:
+            matched = any(literal in text for literal in literals) or any(search(text) for search in searches)
+        if matched:
+            detected.append(stage)
     return detected
 
 
-def fetch_all_emails(service, query, max_results=200):
+def parse_message(msg_data):
+    """Convert a Gmail message resource into a {subject, date, from_email, body} record."""
+    headers = msg_data.get('payload', {}).get('headers', [])
+    subject = next((h['value'] for h in headers if h['name'] == 'Subject'), '(No Subject)')
+    from_email = next((h['value'] for h in headers if h['name'] == 'From'), '(Unknown Sender)')
+    date_raw = next((h['value'] for h in headers if h['name'] == 'Date'), None)
+
+    # RFC 2822 header -> ISO 8601, keeping the sender's UTC offset ("-0000" is UTC)
+    try:
+        date_obj = parsedate_to_datetime(date_raw)
+        if date_obj.tzinfo is None:
+            date_obj = date_obj.replace(tzinfo=timezone.utc)
+        date_iso = date_obj.isoformat()
+    except (TypeError, ValueError, IndexError, OverflowError):
+        date_iso = date_raw or ""
+
+    payload = msg_data.get('payload', {})
+    body_text = extract_body_recursive(payload, max_chars=BODY_MAX_CHARS)
+
+    return {
+        "id": msg_data.get('id'),
+        "subject": subject,
+        "date": date_iso,
+        "from_email": from_email,
+        "body": body_text
+    }
+
+
+# =========================
+# GMAIL QUOTA LIMITER
+# =========================
+class QuotaLimiter:
+    """
+    Token bucket in Gmail quota units for one user. Calls take their units
+    before they are sent and wait when the bucket is empty, so parallel
+    fetches stay under the per-user ceiling instead of failing with 429s.
+    The refill rate adapts (AIMD): every rate-limit error multiplies it by
+    AIMD_DECREASE, every successful call adds AIMD_INCREASE of the ceiling back.
+    """
+
+    def __init__(self, limit=GMAIL_QUOTA_PER_SEC):
+        self.limit = limit
+        self.rate = limit
+        self.tokens = limit  # bucket holds one second of quota
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self._window = deque()  # (time, units) spent in the last QUOTA_WINDOW seconds
+        self.units_total = 0
+        self.calls = 0
+        self.throttled_seconds = 0.0
+        self.rate_limited = 0
+        self.retries = 0
+
+    def _refill(self, now):
+        self.tokens = min(self.limit, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, units):
+        """Wait until `units` can be spent."""
+        units = min(units, self.limit)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self.tokens >= units:
+                    self.tokens -= units
+                    self.units_total += units
+                    self.calls += 1
+                    self._window.append((now, units))
+                    return
+                delay = (units - self.tokens) / self.rate
+                self.throttled_seconds += delay
+            time.sleep(delay)
+
+    def on_success(self):
+        with self._lock:
+            self.rate = min(self.limit, self.rate + self.limit * AIMD_INCREASE)
+
+    def on_rate_limited(self):
+        """A quota error (429 / 403 rate limit): back off multiplicatively. Not for 5xx."""
+        with self._lock:
+            self.rate = max(self.limit * AIMD_MIN_FRACTION, self.rate * AIMD_DECREASE)
+            self.tokens = 0
+            self.rate_limited += 1
+
+    def on_retry(self):
+        with self._lock:
+            self.retries += 1
+
+    def stats(self):
+        """Live utilization: units/s spent over the last QUOTA_WINDOW seconds against the ceiling."""
+        with self._lock:
+            now = time.monotonic()
+            while self._window and self._window[0][0] < now - QUOTA_WINDOW:
+                self._window.popleft()
+            units_per_sec = sum(units for _, units in self._window) / QUOTA_WINDOW
+            return {
+                "limit_units_per_sec": self.limit,
+                "allowed_units_per_sec": round(self.rate, 1),
+                "units_per_sec": round(units_per_sec, 1),
+                "utilization": round(units_per_sec / self.limit, 3),
+                "units_total": self.units_total,
+                "calls": self.calls,
+                "throttled_seconds": round(self.throttled_seconds, 2),
+                "rate_limited": self.rate_limited,
+                "retries": self.retries,
+            }
+
+
+def is_rate_limited(error):
+    """429, or 403 with a rateLimitExceeded / userRateLimitExceeded reason."""
+    status = error.resp.status
+    return status == 429 or (status == 403 and b"ratelimitexceeded" in (error.content or b"").lower())
+
+
+def is_retryable(error):
+    return is_rate_limited(error) or error.resp.status in (500, 502, 503, 504)
+
+
+def backoff_delay(attempt):
+    """Full-jitter exponential backoff."""
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+
+
+def execute_with_quota(limiter, request, units):
+    """request.execute() under the limiter; rate-limit and 5xx errors are retried
+    GMAIL_MAX_RETRIES times, then raised."""
+    for attempt in range(GMAIL_MAX_RETRIES + 1):
+        limiter.acquire(units)
+        try:
+            result = request.execute()
+        except HttpError as e:
+            if not is_retryable(e) or attempt == GMAIL_MAX_RETRIES:
+                raise
+            if is_rate_limited(e):
+                limiter.on_rate_limited()
+            limiter.on_retry()
+            time.sleep(backoff_delay(attempt))
+            continue
+        limiter.on_success()
+        return result
+
+
+def message_get_params(msg_id, format_type):
+    """Build messages.get kwargs; metadata format only asks for the headers we use."""
+    params = {'userId': 'me', 'id': msg_id, 'format': format_type}
+    if format_type == 'metadata':
+        params['metadataHeaders'] = METADATA_HEADERS
+    return params
+
+
+def fetch_messages_batch(service, message_ids, format_type='full', limiter=None):
+    """
+    Fetch many messages with Gmail batch HTTP requests (one round trip per
+    BATCH_SIZE ids instead of one per message), paced by the quota limiter.
+    Returns message resources in the same order as message_ids, leaving out
+    ids Gmail no longer has (404: deleted since they were listed).
+    Ids that fail with a retryable error inside a batch are sent again in a
+    later batch after a backoff, within one GMAIL_MAX_RETRIES budget; if any
+    are still failing after it, their error is raised. Ids that fail with any
+    other error are fetched once individually.
+    """
+    limiter = limiter or QuotaLimiter()
+    fetched = {}
+    gone = set()
+    retryable = {}  # idx -> HttpError from this round
+
+    def on_response(request_id, response, exception):
+        if exception is None:
+            fetched[int(request_id)] = response
+        elif isinstance(exception, HttpError) and exception.resp.status == 404:
+            gone.add(int(request_id))
+        elif isinstance(exception, HttpError) and is_retryable(exception):
+            retryable[int(request_id)] = exception
+
+    pending = list(range(len(message_ids)))
+    for attempt in range(GMAIL_MAX_RETRIES + 1):
+        for start in range(0, len(pending), BATCH_SIZE):
+            chunk = pending[start:start + BATCH_SIZE]
+            batch = service.new_batch_http_request(callback=on_response)
+            for idx in chunk:
+                batch.add(
+                    service.users().messages().get(**message_get_params(message_ids[idx], format_type)),
+                    request_id=str(idx)
+                )
+            limiter.acquire(QUOTA_UNITS["messages.get"] * len(chunk))
+            try:
+                batch.execute()
+            except HttpError as e:
+                if not is_retryable(e):
+                    raise
+                retryable.update((idx, e) for idx in chunk)
+
+        errors = {idx: e for idx, e in retryable.items() if idx not in fetched}
+        retryable.clear()
+        if not errors:
+            break
+        if attempt == GMAIL_MAX_RETRIES:
+            raise next(iter(errors.values()))
+        # Only quota errors slow the limiter down; 5xx are just retried
+        if any(is_rate_limited(e) for e in errors.values()):
+            limiter.on_rate_limited()
+        limiter.on_retry()
+        time.sleep(backoff_delay(attempt))
+        pending = sorted(errors)
+    limiter.on_success()
+
+    ordered = []
+    for idx, msg_id in enumerate(message_ids):
+        if idx in gone:
+            continue
+        msg_data = fetched.get(idx)
+        if msg_data is None:
+            limiter.acquire(QUOTA_UNITS["messages.get"])
+            try:
+                msg_data = service.users().messages().get(**message_get_params(msg_id, format_type)).execute()
+            except HttpError as e:
+                if e.resp.status != 404:
+                    raise
+                continue
+        ordered.append(msg_data)
+
+    return ordered
+
+
+def fetch_all_emails(service, query, max_results=200, limiter=None):
     """Fetch emails with pagination."""
+    limiter = limiter or QuotaLimiter()
     all_msgs = []
     page_token = None
 
@@ -268,36 +702,12 @@ def fetch_all_emails(service, query, max_results=200):
         if page_token:
             list_params['pageToken'] = page_token
 
-        resp = service.users().messages().list(**list_params).execute()
-        messages = resp.get('messages', [])
-
-        for msg in messages:
-            if len(all_msgs) >= max_results:
-                break
-            msg_data = service.users().messages().get(
-                userId='me', id=msg['id'], format='full'
-            ).execute()
-
-            headers = msg_data.get('payload', {}).get('headers', [])
-            subject = next((h['value'] for h in headers if h['name'] == 'Subject'), '(No Subject)')
-            from_email = next((h['value'] for h in headers if h['name'] == 'From'), '(Unknown Sender)')
-            date_raw = next((h['value'] for h in headers if h['name'] == 'Date'), None)
+        resp = execute_with_quota(limiter, service.users().messages().list(**list_params), QUOTA_UNITS["messages.list"])
+        message_ids = [m['id'] for m in resp.get('messages', [])]
+        message_ids = message_ids[:max_results - len(all_msgs)]
 
-            try:
-                date_obj = datetime.strptime(date_raw, "%a, %d %b %Y %H:%M:%S %z")
-                date_iso = date_obj.isoformat()
-            except:
-                date_iso = date_raw or ""
-
-            payload = msg_data.get('payload', {})
-            body_text = extract_body_recursive(payload)
-
-            all_msgs.append({
-                "subject": subject,
-                "date": date_iso,
-                "from_email": from_email,
-                "body": body_text[:2000]
-            })
+        for msg_data in fetch_messages_batch(service, message_ids, limiter=limiter):
+            all_msgs.append(parse_message(msg_data))
 
         page_token = resp.get('nextPageToken')
         if not page_token:
@@ -306,14 +716,241 @@ def fetch_all_emails(service, query, max_results=200):
     return all_msgs
 
 
+# =========================
+# GMAIL SERVICE POOL
+# =========================
+class GmailServicePool:
+    """
+    Built Gmail clients sharing one set of credentials, so requests skip
+    re-reading the token file and rebuilding the discovery client, and keep
+    their HTTP connections alive.
+    A client's HTTP connection isn't thread-safe, so each request checks one
+    out and returns it when done. Clients are dropped when the token file changes.
+    """
+
+    def __init__(self, token_file):
+        self.token_file = token_file
+        self._lock = threading.Lock()
+        self._creds = None
+        self._version = None  # token file mtime the credentials were loaded from
+        self._idle = []
+
+    def _load(self):
+        try:
+            version = os.stat(self.token_file).st_mtime_ns
+        except FileNotFoundError:
+            self._clear()
+            return False
+        if version != self._version:
+            self._creds = Credentials.from_authorized_user_file(self.token_file, SCOPES)
+            self._idle = []
+            self._version = version
+        return True
+
+    def _refresh_if_expiring(self):
+        creds = self._creds
+        if not creds.refresh_token:
+            return
+        now = datetime.now(timezone.utc).replace(tzinfo=None)  # google-auth expiry is naive UTC
+        if creds.valid and (creds.expiry is None or creds.expiry - now > TOKEN_REFRESH_MARGIN):
+            return
+        creds.refresh(Request())
+        with open(self.token_file, 'w') as token:
+            token.write(creds.to_json())
+        self._version = os.stat(self.token_file).st_mtime_ns
+
+    def checkout(self):
+        """Return (service, version), or (None, None) if not authenticated."""
+        with self._lock:
+            if not self._load():
+                return None, None
+            try:
+                self._refresh_if_expiring()
+            except RefreshError as e:
+                print(f"Token refresh failed: {e}")
+                return None, None
+            service = self._idle.pop() if self._idle else None
+            creds, version = self._creds, self._version
+
+        if service is None:
+            service = build('gmail', 'v1', credentials=creds, cache_discovery=False)
+        return service, version
+
+    def release(self, service, version):
+        with self._lock:
+            if version == self._version:
+                self._idle.append(service)
+
+    def _clear(self):
+        self._creds = None
+        self._version = None
+        self._idle = []
+
+    def reset(self):
+        """Forget the credentials and clients (after login/logout)."""
+        with self._lock:
+            self._clear()
+
+
+class SessionRegistry:
+    """
+    Per-user Gmail sessions: each session id has its own token file, its own
+    GmailServicePool, its own concurrency limit and its own QuotaLimiter, so
+    users never share credentials or clients and one user's long /query
+    pagination only queues behind that user's own requests.
+    Requests without a session id use legacy_token_file, if one is given
+    (None: they are not authenticated).
+    """
+
+    def __init__(self, token_dir, legacy_token_file, max_cached=MAX_CACHED_SESSIONS):
+        self.token_dir = token_dir
+        self.legacy_token_file = legacy_token_file
+        self.max_cached = max_cached
+        self._lock = threading.Lock()
+        self._sessions = OrderedDict()  # session id -> (GmailServicePool, BoundedSemaphore, QuotaLimiter)
+        self._in_use = {}  # session id -> requests holding its entry (never evicted while > 0)
+
+    def token_file(self, session_id):
+        """Token path for a session id (None for a malformed id, or a missing one without a legacy token)."""
+        if session_id is None:
+            return self.legacy_token_file
+        if not SESSION_ID_RE.match(session_id):
+            return None
+        return os.path.join(self.token_dir, f"{session_id}.json")
+
+    def create(self, creds):
+        """Store credentials from a new login under a fresh session id."""
+        session_id = secrets.token_urlsafe(32)
+        os.makedirs(self.token_dir, exist_ok=True)
+        path = self.token_file(session_id)
+        tmp = f"{path}.tmp"
+        with open(os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as token:
+            token.write(creds.to_json())
+        os.replace(tmp, path)
+        return session_id
+
+    def exists(self, session_id):
+        path = self.token_file(session_id)
+        return path is not None and os.path.exists(path)
+
+    def get(self, session_id):
+        """
+        (pool, semaphore, quota limiter) for a session, or (None, None, None) for
+        a malformed id. The entry is held until release(session_id), so its
+        concurrency limit and quota bucket survive evictions mid-request.
+        """
+        path = self.token_file(session_id)
+        if path is None:
+            return None, None, None
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                entry = (GmailServicePool(path), threading.BoundedSemaphore(SESSION_MAX_CONCURRENCY), QuotaLimiter())
+                self._sessions[session_id] = entry
+            else:
+                self._sessions.move_to_end(session_id)
+            self._in_use[session_id] = self._in_use.get(session_id, 0) + 1
+            self._evict()
+            return entry
+
+    def release(self, session_id):
+        with self._lock:
+            held = self._in_use.get(session_id, 0) - 1
+            if held > 0:
+                self._in_use[session_id] = held
+            else:
+                self._in_use.pop(session_id, None)
+            self._evict()
+
+    def _evict(self):
+        """Drop least recently used idle entries beyond max_cached (entries in use are kept)."""
+        excess = len(self._sessions) - self.max_cached
+        for session_id in list(self._sessions):
+            if excess <= 0:
+                break
+            if session_id not in self._in_use:
+                del self._sessions[session_id]
+                excess -= 1
+
+    def delete(self, session_id):
+        """Log a session out: remove its token and drop its clients."""
+        path = self.token_file(session_id)
+        if path is None:
+            return
+        with self._lock:
+            entry = self._sessions.pop(session_id, None)
+        if entry:
+            entry[0].reset()
+        if os.path.exists(path):
+            os.remove(path)
+
+
+sessions = SessionRegistry(TOKEN_DIR, TOKEN_FILE if ALLOW_LEGACY_TOKEN else None)
+
+
+def current_session_id():
+    """Session id sent by the caller (None for single-user requests)."""
+    return request.headers.get(SESSION_HEADER) or None
+
+
+class SessionBusy(Exception):
+    """The session already has SESSION_MAX_CONCURRENCY requests in flight."""
+
+
+def get_gmail_service():
+    """
+    Gmail client for the current request's session (returned to its pool on
+    teardown), or None if not authenticated. Raises SessionBusy if the session
+    is at its concurrency limit for longer than SESSION_WAIT.
+    """
+    if "gmail_service" not in g:
+        session_id = current_session_id()
+        pool, slots, quota = sessions.get(session_id)
+        if pool is None:
+            g.gmail_service = None
+            return None
+        g.gmail_session_id = session_id  # released on teardown
+        if not slots.acquire(timeout=SESSION_WAIT):
+            raise SessionBusy()
+        g.gmail_slots = slots
+        g.gmail_pool = pool
+        g.gmail_quota = quota
+        g.gmail_service, g.gmail_service_version = pool.checkout()
+    return g.gmail_service
+
+
+@app.errorhandler(SessionBusy)
+def session_busy(exc):
+    return jsonify({"error": "Too many concurrent requests for this session"}), 429
+
+
+@app.errorhandler(HttpError)
+def gmail_error(exc):
+    """Gmail errors left after retries: rate limits become 429 with Retry-After, the rest 502."""
+    if is_rate_limited(exc):
+        return jsonify({"error": "Gmail rate limit exceeded", "retryable": True}), 429, {"Retry-After": "2"}
+    return jsonify({"error": f"Gmail API error: {exc}", "retryable": is_retryable(exc)}), 502
+
+
+@app.teardown_appcontext
+def release_gmail_service(exc):
+    service = g.pop("gmail_service", None)
+    pool = g.pop("gmail_pool", None)
+    if service is not None and pool is not None:
+        pool.release(service, g.pop("gmail_service_version"))
+    slots = g.pop("gmail_slots", None)
+    if slots is not None:
+        slots.release()
+    if "gmail_session_id" in g:
+        sessions.release(g.pop("gmail_session_id"))
+
+
 # =========================
 # ROUTES
 # =========================
 @app.route('/')
 def index():
-    if os.path.exists(TOKEN_FILE):
-        return '<p>Already authenticated! Use /query?q=... or /process</p>'
-
+    """Start the Google login (every login gets its own session)."""
     flow = Flow.from_client_config(CLIENT_CONFIG, scopes=SCOPES, redirect_uri=REDIRECT_URI)
     auth_url, _ = flow.authorization_url(prompt='consent', access_type='offline')
     return redirect(auth_url)
@@ -325,41 +962,45 @@ def callback():
     flow.fetch_token(authorization_response=request.url)
     creds = flow.credentials
 
-    with open(TOKEN_FILE, 'w') as token:
-        token.write(creds.to_json())
+    # The opener keeps the session id and sends it as X-Session-Id from now on;
+    # it is only posted to FRONTEND_ORIGIN, never to whichever page opened the popup
+    session_id = sessions.create(creds)
 
-    return """
+    # Opened without the dashboard (command-line use), the page shows the id to export instead
+    return f"""
 <script>
-  if (window.opener) {
-    window.opener.postMessage({ status: "success", authenticated: true }, "*");
-  }
-  window.close();
+  if (window.opener) {{
+    window.opener.postMessage({{ status: "success", authenticated: true, session_id: {json.dumps(session_id)} }}, {json.dumps(FRONTEND_ORIGIN)});
+    window.close();
+  }}
 </script>
+<p>Authenticated! To use this login from the command-line scripts (e.g. firstfilter.py), run:</p>
+<pre>export GMAIL_SESSION_ID={session_id}</pre>
 """
 
 
 @app.route('/status')
 def status():
-    """Check authentication status."""
-    authenticated = os.path.exists(TOKEN_FILE)
+    """Check authentication status of the caller's session."""
+    authenticated = sessions.exists(current_session_id())
     return jsonify({"authenticated": authenticated})
 
 
 @app.route('/user-info')
 def user_info():
     """Get authenticated user's Gmail profile info."""
-    if not os.path.exists(TOKEN_FILE):
+    service = get_gmail_service()
+    if service is None:
         return jsonify({"error": "Not authenticated", "authenticated": False}), 401
 
     try:
-        creds = Credentials.from_authorized_user_file(TOKEN_FILE, SCOPES)
-        service = build('gmail', 'v1', credentials=creds)
-        profile = service.users().getProfile(userId='me').execute()
+        profile = execute_with_quota(g.gmail_quota, service.users().getProfile(userId='me'), QUOTA_UNITS["getProfile"])
 
         return jsonify({
             "email": profile.get("emailAddress", ""),
             "messagesTotal": profile.get("messagesTotal", 0),
-            "threadsTotal": profile.get("threadsTotal", 0)
+            "threadsTotal": profile.get("threadsTotal", 0),
+            "historyId": profile.get("historyId")
         })
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -367,10 +1008,9 @@ def user_info():
 
 @app.route('/logout')
 def logout():
-    """Clear authentication and log out."""
+    """Clear the caller's session and log out."""
     try:
-        if os.path.exists(TOKEN_FILE):
-            os.remove(TOKEN_FILE)
+        sessions.delete(current_session_id())
         return jsonify({"success": True, "message": "Logged out successfully"})
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
@@ -378,52 +1018,40 @@ def logout():
 
 @app.route('/query')
 def query():
+    """
+    Search messages, one page (50) at a time.
+    format=full (default) returns bodies; format=metadata returns headers only
+    with an empty body - use /messages to hydrate bodies for chosen ids.
+    format=ids skips messages.get entirely and returns only [{"id": ...}].
+    """
     q = request.args.get('q', 'in:inbox')
     page_token = request.args.get('page_token', None)
+    format_type = request.args.get('format', 'full')
 
-    if not os.path.exists(TOKEN_FILE):
-        return jsonify({"error": "Not authenticated", "authenticated": False}), 401
+    if format_type not in QUERY_FORMATS:
+        return jsonify({"error": f"Invalid format '{format_type}'. Use one of: {', '.join(QUERY_FORMATS)}"}), 400
 
-    creds = Credentials.from_authorized_user_file(TOKEN_FILE, SCOPES)
-    service = build('gmail', 'v1', credentials=creds)
+    service = get_gmail_service()
+    if service is None:
+        return jsonify({"error": "Not authenticated", "authenticated": False}), 401
 
     list_params = {'userId': 'me', 'q': q, 'maxResults': 50}
     if page_token:
         list_params['pageToken'] = page_token
 
-    resp = service.users().messages().list(**list_params).execute()
+    resp = execute_with_quota(g.gmail_quota, service.users().messages().list(**list_params), QUOTA_UNITS["messages.list"])
     messages = resp.get('messages', [])
     next_page_token = resp.get('nextPageToken', None)
-    results = []
-
-    for msg in messages:
-        msg_data = service.users().messages().get(
-            userId='me', id=msg['id'], format='full'
-        ).execute()
-
-        headers = msg_data.get('payload', {}).get('headers', [])
-        subject = next((h['value'] for h in headers if h['name'] == 'Subject'), '(No Subject)')
-        from_email = next((h['value'] for h in headers if h['name'] == 'From'), '(Unknown Sender)')
-        date_raw = next((h['value'] for h in headers if h['name'] == 'Date'), None)
-
-        try:
-            date_obj = datetime.strptime(date_raw, "%a, %d %b %Y %H:%M:%S %z")
-            date_iso = date_obj.isoformat()
-        except:
-            date_iso = date_raw or ""
-
-        payload = msg_data.get('payload', {})
-        body_text = extract_body_recursive(payload)
-
-        results.append({
-            "subject": subject,
-            "date": date_iso,
-            "from_email": from_email,
-            "body": body_text[:2000]
-        })
+    message_ids = [m['id'] for m in messages]
+    if format_type == 'ids':
+        results = [{"id": msg_id} for msg_id in message_ids]
+    else:
+        results = [parse_message(msg_data)
+                   for msg_data in fetch_messages_batch(service, message_ids, format_type, g.gmail_quota)]
 
     response_data = {
         "query": q,
+        "format": format_type,
         "total_results": len(results),
         "messages": results
     }
@@ -434,22 +1062,128 @@ def query():
     return jsonify(response_data)
 
 
+@app.route('/messages', methods=['POST'])
+def messages_bulk():
+    """
+    Hydrate full messages (with body) for a list of Gmail message ids.
+
+    Request body:
+    {
+        "ids": ["18c2...", "18c3...", ...],
+        "format": "full"  // Optional - "full" (default) or "metadata"
+    }
+
+    Returns messages in the same order as the requested ids; ids Gmail no
+    longer has (deleted since they were listed) are left out.
+    """
+    data = request.get_json(silent=True) or {}
+    message_ids = data.get("ids", [])
+    format_type = data.get("format", "full")
+
+    if not isinstance(message_ids, list) or not all(isinstance(i, str) for i in message_ids):
+        return jsonify({"error": "'ids' must be a list of message id strings"}), 400
+    if format_type not in ('full', 'metadata'):
+        return jsonify({"error": "'format' must be 'full' or 'metadata'"}), 400
+
+    service = get_gmail_service()
+    if service is None:
+        return jsonify({"error": "Not authenticated", "authenticated": False}), 401
+
+    results = [parse_message(msg_data)
+               for msg_data in fetch_messages_batch(service, message_ids, format_type, g.gmail_quota)]
+
+    return jsonify({
+        "total_results": len(results),
+        "messages": results
+    })
+
+
+@app.route('/changes')
+def changes():
+    """
+    Incremental sync via the Gmail history API.
+    /changes?since=<historyId>&label=INBOX returns ids of messages added to the
+    label (or given the label later) since that history id, plus the mailbox's
+    current history id to pass as `since` next time.
+    Without `since`, returns only the current history id.
+    Returns 410 with full_sync_required=true if the history id has expired.
+    """
+    since = request.args.get('since')
+    label = request.args.get('label', 'INBOX')
+
+    service = get_gmail_service()
+    if service is None:
+        return jsonify({"error": "Not authenticated", "authenticated": False}), 401
+
+    if not since:
+        profile = execute_with_quota(g.gmail_quota, service.users().getProfile(userId='me'), QUOTA_UNITS["getProfile"])
+        return jsonify({"history_id": profile.get("historyId"), "message_ids": []})
+
+    added_ids = []
+    seen = set()
+    page_token = None
+    history_id = since
+
+    try:
+        while True:
+            params = {
+                'userId': 'me',
+                'startHistoryId': since,
+                'historyTypes': ['messageAdded', 'labelAdded'],
+                'labelId': label
+            }
+            if page_token:
+                params['pageToken'] = page_token
+
+            resp = execute_with_quota(g.gmail_quota, service.users().history().list(**params), QUOTA_UNITS["history.list"])
+            history_id = resp.get('historyId', history_id)
+
+            for record in resp.get('history', []):
+                added = [a['message'] for a in record.get('messagesAdded', [])]
+                added += [a['message'] for a in record.get('labelsAdded', []) if label in a.get('labelIds', [])]
+                for msg in added:
+                    if msg['id'] not in seen:
+                        seen.add(msg['id'])
+                        added_ids.append(msg['id'])
+
+            page_token = resp.get('nextPageToken')
+            if not page_token:
+                break
+    except HttpError as e:
+        if e.resp.status == 404:
+            return jsonify({"error": "History id expired", "full_sync_required": True}), 410
+        raise
+
+    return jsonify({
+        "since": since,
+        "history_id": history_id,
+        "message_ids": added_ids
+    })
+
+
+@app.route('/quota')
+def quota():
+    """Live Gmail quota use of the caller's session (units/s, utilization, throttling, retries)."""
+    service = get_gmail_service()
+    if service is None:
+        return jsonify({"error": "Not authenticated", "authenticated": False}), 401
+    return jsonify(g.gmail_quota.stats())
+
+
 @app.route('/process')
 def process():
     """
     Main endpoint: Fetch emails, extract companies, analyze applications.
     Returns structured application data for all companies.
     """
-    if not os.path.exists(TOKEN_FILE):
+    service = get_gmail_service()
+    if service is None:
         return jsonify({"error": "Not authenticated", "authenticated": False}), 401
 
     try:
-        creds = Credentials.from_authorized_user_file(TOKEN_FILE, SCOPES)
-        service = build('gmail', 'v1', credentials=creds)
-
         # Step 1: Fetch job-related emails
         query = 'subject:("application" OR "applying" OR "apply" OR "applied") in:inbox after:2024/01/01'
-        emails = fetch_all_emails(service, query, max_results=200)
+        emails = fetch_all_emails(service, query, max_results=200, limiter=g.gmail_quota)
 
         if not emails:
             return jsonify({
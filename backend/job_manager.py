@@ -0,0 +1,369 @@
+"""
+Background processing jobs for the local server.
+- submit() queues a run on a bounded worker pool and returns its Job at once
+- every event a job emits is kept in order, so any number of SSE clients can
+  attach, reattach after a reload (Last-Event-ID) and replay what they missed
+- job state (params, status, last progress, final result) is persisted to
+  SQLite; jobs that were queued or running when the server stopped are marked
+  "interrupted" on the next start
+- single-flight: submitting the same session + user + params while such a job
+  is still queued or running returns that job instead of starting another
+- one run per user: a user's other jobs wait (without taking a worker) until
+  that user's running job has finished, so runs never overwrite each other's cache
+- cancellation: a job whose clients have all detached for `detach_grace`
+  seconds (or that is cancelled explicitly) has its CancelToken set; the
+  runner checks it between units of work and in-flight calls registered with
+  on_cancel() are aborted
+"""
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+JOBS_DB = os.path.join(os.path.dirname(__file__), "jobs.db")
+
+ACTIVE_STATUSES = ("queued", "running")
+FINISHED_STATUSES = ("done", "error", "interrupted", "cancelled")
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class Cancelled(Exception):
+    """Raised inside a job's runner once its CancelToken is set."""
+
+
+class CancelToken:
+    """Cooperative cancellation flag shared by everything a job runs."""
+
+    def __init__(self):
+        self.cancelled = False
+        self._lock = threading.Lock()
+        self._callbacks = []
+
+    def cancel(self):
+        with self._lock:
+            if self.cancelled:
+                return
+            self.cancelled = True
+            callbacks, self._callbacks = self._callbacks, []
+        for fn in callbacks:
+            try:
+                fn()
+            except Exception as e:
+                print(f"  Cancel callback failed: {e}")
+
+    def check(self):
+        """Raise Cancelled if the job has been cancelled."""
+        if self.cancelled:
+            raise Cancelled()
+
+    def on_cancel(self, fn):
+        """Call fn() on cancel (at once if already cancelled), e.g. to close an
+        in-flight response. Returns a function that unregisters it."""
+        with self._lock:
+            if not self.cancelled:
+                self._callbacks.append(fn)
+                return lambda: self._remove(fn)
+        fn()
+        return lambda: None
+
+    def _remove(self, fn):
+        with self._lock:
+            if fn in self._callbacks:
+                self._callbacks.remove(fn)
+
+
+class Job:
+    """One processing run and the events it has emitted so far."""
+
+    def __init__(self, job_id, user_email, params, status="queued", created=None, result=None, progress=None,
+                 session_id=None):
+        self.id = job_id
+        self.user_email = user_email
+        self.params = params
+        self.session_id = session_id  # Render session the job fetches with (a credential: never persisted)
+        self.status = status
+        self.created = created or time.time()
+        self.finished = None
+        self.result = result
+        self.progress = progress  # last "progress" event, for GET /jobs/<id>
+        self.requests = 1         # submissions served by this job (> 1 when coalesced)
+        self.clients = 0          # attached event streams / waiting requests
+        self.cancel_token = CancelToken()
+        self.events = []
+        self._cond = threading.Condition()
+
+    @property
+    def done(self):
+        return self.status in FINISHED_STATUSES
+
+    def emit(self, event):
+        """Append an event; wakes up every attached client."""
+        with self._cond:
+            self.events.append(event)
+            if event.get("type") == "progress":
+                self.progress = event
+            self._cond.notify_all()
+
+    def finish(self, status, result):
+        with self._cond:
+            self.status = status
+            self.result = result
+            self.finished = time.time()
+            self.events.append({"type": "done", "data": result})
+            self._cond.notify_all()
+
+    def events_after(self, seen, timeout):
+        """Events past the first `seen`, waiting up to timeout for new ones.
+        Returns (events, done)."""
+        with self._cond:
+            if len(self.events) <= seen and not self.done:
+                self._cond.wait(timeout)
+            return self.events[seen:], self.done
+
+    def wait(self, timeout=None):
+        """Block until the job has finished; returns its result."""
+        with self._cond:
+            self._cond.wait_for(lambda: self.done, timeout)
+            return self.result
+
+    def summary(self):
+        data = {
+            "job_id": self.id,
+            "status": self.status,
+            "params": self.params,
+            "created": self.created,
+            "events": len(self.events),
+            "requests": self.requests,
+            "clients": self.clients,
+            "progress": self.progress,
+        }
+        if self.done:
+            data["result"] = self.result
+        return data
+
+
+class JobStore:
+    """Thread-safe SQLite record of every job's params, status and result."""
+
+    def __init__(self, path=JOBS_DB):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                job_id TEXT PRIMARY KEY,
+                user_email TEXT,
+                params TEXT,
+                status TEXT NOT NULL,
+                progress TEXT,
+                result TEXT,
+                created_at REAL,
+                updated_at REAL
+            )
+        """)
+        self._conn.commit()
+
+    def save(self, job):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO jobs (job_id, user_email, params, status, progress, result, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (job.id, job.user_email, json.dumps(job.params), job.status,
+                 json.dumps(job.progress) if job.progress else None,
+                 json.dumps(job.result) if job.result is not None else None,
+                 job.created, time.time())
+            )
+            self._conn.commit()
+
+    def load(self, job_id):
+        """A finished Job rebuilt from its row (its only event is "done"), or None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT user_email, params, status, progress, result, created_at FROM jobs WHERE job_id = ?",
+                (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        user_email, params, status, progress, result, created = row
+        job = Job(job_id, user_email, json.loads(params), status, created,
+                  json.loads(result) if result else None, json.loads(progress) if progress else None)
+        if job.done:
+            job.events.append({"type": "done", "data": job.result})
+        return job
+
+    def mark_interrupted(self):
+        """Jobs left queued/running by a previous server process can't finish; returns how many."""
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = 'interrupted', result = ?, updated_at = ? WHERE status IN ('queued', 'running')",
+                (json.dumps({"error": "Server restarted before the job finished"}), time.time())
+            )
+            self._conn.commit()
+            return cursor.rowcount
+
+    def prune(self, older_than):
+        """Delete finished jobs last updated before older_than (epoch seconds)."""
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM jobs WHERE status NOT IN ('queued', 'running') AND updated_at < ?", (older_than,)
+            )
+            self._conn.commit()
+
+
+class JobManager:
+    """
+    Runs jobs on `max_workers` threads. runner(job) does the work, calling
+    job.emit() for progress and job.cancel_token.check() between steps, and
+    returns the final result dict; a result with an "error" key (or an
+    exception) finishes the job as "error", a cancelled one as "cancelled".
+    Jobs of one user run one after another; the others wait in submit order
+    without holding a worker. At most `max_queued` jobs may be queued. Finished jobs stay in
+    memory for `keep_seconds` (full event replay), then only in the store.
+    A job that had clients and has had none for `detach_grace` seconds
+    (long enough for a page reload to reattach) is cancelled.
+    """
+
+    def __init__(self, runner, store, max_workers=2, max_queued=16, keep_seconds=600, history_days=7,
+                 detach_grace=5):
+        self.runner = runner
+        self.store = store
+        self.max_queued = max_queued
+        self.keep_seconds = keep_seconds
+        self.history_days = history_days
+        self.detach_grace = detach_grace
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._in_flight = {}  # (session_id, user_email, params) -> queued/running Job
+        self._user_jobs = {}  # user_email -> that user's unfinished jobs; only the first is on the executor
+
+        interrupted = store.mark_interrupted()
+        if interrupted:
+            print(f"Marked {interrupted} unfinished jobs from the previous run as interrupted")
+        store.prune(time.time() - history_days * 86400)
+
+    @staticmethod
+    def flight_key(user_email, params, session_id=None):
+        """Jobs only coalesce within one session: an identity that failed to resolve
+        is the same string for every session, and must never share results."""
+        return session_id, user_email, json.dumps(params, sort_keys=True)
+
+    def submit(self, user_email, params, session_id=None):
+        """
+        Queue a new job, or return the queued/running job for the same session,
+        user and params (its .requests is incremented). session_id is kept on the Job
+        for its runner. Raises JobQueueFull if too many jobs are already waiting.
+        """
+        key = self.flight_key(user_email, params, session_id)
+        with self._lock:
+            job = self._in_flight.get(key)
+            if job is not None:
+                job.requests += 1
+                print(f"Joined in-flight job {job.id} ({job.requests} requests)")
+                return job
+            self._forget_finished()
+            queued = sum(1 for job in self._jobs.values() if job.status == "queued")
+            if queued >= self.max_queued:
+                raise JobQueueFull()
+            job = Job(uuid.uuid4().hex, user_email, params, session_id=session_id)
+            self._jobs[job.id] = job
+            self._in_flight[key] = job
+            user_jobs = self._user_jobs.setdefault(user_email, deque())
+            user_jobs.append(job)
+            start = len(user_jobs) == 1
+        self.store.save(job)
+        if start:
+            self._executor.submit(self._run, job)
+        else:
+            job.emit({"type": "progress", "step": 0, "message": "Waiting for another run to finish...", "data": {}})
+        return job
+
+    def get(self, job_id):
+        """The live Job, or a finished one rebuilt from the store, or None."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        return job or self.store.load(job_id)
+
+    def attach(self, job):
+        """A client started following the job."""
+        with self._lock:
+            job.clients += 1
+
+    def detach(self, job):
+        """A client stopped following the job (disconnected or finished waiting)."""
+        with self._lock:
+            job.clients -= 1
+            orphaned = job.clients == 0 and not job.done
+        if orphaned:
+            timer = threading.Timer(self.detach_grace, self._cancel_if_orphaned, (job,))
+            timer.daemon = True
+            timer.start()
+
+    def _cancel_if_orphaned(self, job):
+        if job.clients == 0 and not job.done:
+            print(f"Job {job.id} has no clients left, cancelling")
+            self.cancel(job)
+
+    def cancel(self, job):
+        """Stop a queued/running job; identical requests from now on start a new one."""
+        with self._lock:
+            key = self.flight_key(job.user_email, job.params, job.session_id)
+            if self._in_flight.get(key) is job:
+                del self._in_flight[key]
+            user_jobs = self._user_jobs.get(job.user_email, ())
+            # Still waiting behind the user's running job: it never reaches a worker
+            waiting = job in user_jobs and user_jobs[0] is not job
+        job.cancel_token.cancel()
+        if waiting:
+            self._finish(job, {"error": "Cancelled", "cancelled": True}, "cancelled")
+
+    def _run(self, job):
+        result, status = None, None
+        if not job.cancel_token.cancelled:
+            job.status = "running"
+            self.store.save(job)
+            try:
+                result = self.runner(job)
+                status = "error" if not isinstance(result, dict) or "error" in result else "done"
+            except Cancelled:
+                pass
+            except Exception as e:
+                import traceback
+                traceback.print_exc()
+                result, status = {"error": str(e)}, "error"
+        if status != "done" and job.cancel_token.cancelled:
+            result, status = {"error": "Cancelled", "cancelled": True}, "cancelled"
+        self._finish(job, result, status)
+
+    def _finish(self, job, result, status):
+        """Record the outcome and start the user's next waiting job, if any."""
+        next_job = None
+        with self._lock:
+            key = self.flight_key(job.user_email, job.params, job.session_id)
+            if self._in_flight.get(key) is job:
+                del self._in_flight[key]
+            user_jobs = self._user_jobs.get(job.user_email)
+            if user_jobs is not None and job in user_jobs:
+                started = user_jobs[0] is job
+                user_jobs.remove(job)
+                if not user_jobs:
+                    del self._user_jobs[job.user_email]
+                elif started:
+                    next_job = user_jobs[0]
+        job.finish(status, result)
+        self.store.save(job)
+        if next_job is not None:
+            self._executor.submit(self._run, next_job)
+
+    def _forget_finished(self):
+        cutoff = time.time() - self.keep_seconds
+        for job_id in [j.id for j in self._jobs.values() if j.done and j.finished < cutoff]:
+            del self._jobs[job_id]
@@ -0,0 +1,97 @@
+"""
+Incremental JSON scanning for streamed GPT answers (used by local_server.py).
+
+PositionStream is fed the completion text as it arrives and returns each
+object in a "positions" array as soon as its closing brace is seen, so a
+position can be shown before the rest of the answer has been generated.
+Text outside the top-level object (```json fences, prose) is ignored.
+"""
+import json
+
+
+class _Frame:
+    __slots__ = ("kind", "start", "key", "parent_key", "expect_key")
+
+    def __init__(self, kind, start, parent_key):
+        self.kind = kind              # "{" or "["
+        self.start = start            # offset of the opening bracket
+        self.key = None               # last key read (objects)
+        self.parent_key = parent_key  # key this container is the value of
+        self.expect_key = kind == "{"
+
+
+class PositionStream:
+    """
+    feed(text) -> [(path, position)] for every position object completed by text.
+    path is the chain of keys down to the array, e.g. ("positions",) or
+    ("companies", "UBS", "positions") for a batched answer.
+    """
+
+    def __init__(self, array_key="positions"):
+        self.array_key = array_key
+        self.text = ""
+        self.pos = 0
+        self.stack = []
+        self.in_string = False
+        self.escaped = False
+        self.string_start = 0
+        self.done = False
+
+    def feed(self, text):
+        found = []
+        if self.done or not text:
+            return found
+        self.text += text
+        text, stack = self.text, self.stack
+
+        i = self.pos
+        while i < len(text):
+            ch = text[i]
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif ch == "\\":
+                    self.escaped = True
+                elif ch == '"':
+                    self.in_string = False
+                    frame = stack[-1]
+                    if frame.kind == "{" and frame.expect_key:
+                        try:
+                            frame.key = json.loads(text[self.string_start:i + 1])
+                        except ValueError:
+                            frame.key = None
+                i += 1
+                continue
+
+            if not stack:
+                # Outside the answer object: skip to the next "{"
+                if ch == "{":
+                    stack.append(_Frame("{", i, None))
+            elif ch == '"':
+                self.in_string = True
+                self.string_start = i
+            elif ch in "{[":
+                parent = stack[-1]
+                stack.append(_Frame(ch, i, parent.key if parent.kind == "{" else None))
+            elif ch == ":":
+                stack[-1].expect_key = False
+            elif ch == ",":
+                stack[-1].expect_key = stack[-1].kind == "{"
+            elif ch in "}]":
+                frame = stack.pop()
+                if not stack:
+                    self.done = True
+                    break
+                parent = stack[-1]
+                if ch == "}" and parent.kind == "[" and parent.parent_key == self.array_key:
+                    try:
+                        obj = json.loads(text[frame.start:i + 1])
+                    except ValueError:
+                        obj = None
+                    if isinstance(obj, dict):
+                        path = tuple(f.parent_key for f in stack[1:])
+                        found.append((path, obj))
+            i += 1
+
+        self.pos = i
+        return found
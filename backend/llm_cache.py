@@ -0,0 +1,184 @@
+"""
+Content-addressed cache for Azure OpenAI chat completions.
+- Key: SHA-256 of model + messages + temperature (+ other generation params)
+- Value: the completion text, stored in a SQLite file
+- Size-bounded: least-recently-used entries are evicted past MAX_BYTES
+
+Shared by local_server.py, firstfilter.py and secondfilter.py, so re-running
+on unchanged emails makes no LLM calls.
+"""
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+
+CACHE_DB = os.path.join(os.path.dirname(__file__), "llm_cache.db")
+MAX_BYTES = 50 * 1024 * 1024
+
+# Request options that don't change the completion text
+NON_KEY_PARAMS = {"timeout", "stream"}
+
+
+def cache_key(model, messages, temperature=None, **params):
+    """Fingerprint a chat completion request."""
+    fields = {
+        "model": model,
+        "messages": messages,
+        "temperature": temperature,
+        **{k: v for k, v in params.items() if k not in NON_KEY_PARAMS},
+    }
+    blob = json.dumps(fields, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """Thread-safe on-disk LRU cache of completion texts."""
+
+    def __init__(self, path=CACHE_DB, max_bytes=MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS completions (
+                key TEXT PRIMARY KEY,
+                content TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS completions_last_used ON completions (last_used)")
+        self._conn.commit()
+
+    def get(self, key):
+        """Return cached content (and mark it recently used), or None."""
+        with self._lock:
+            row = self._conn.execute("SELECT content FROM completions WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE completions SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, content):
+        """Store content, then evict least-recently-used entries over the size limit."""
+        size = len(content.encode("utf-8"))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO completions (key, content, size, last_used) VALUES (?, ?, ?, ?)",
+                (key, content, size, time.time())
+            )
+            total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM completions").fetchone()[0]
+            if total > self.max_bytes:
+                rows = self._conn.execute("SELECT key, size FROM completions ORDER BY last_used").fetchall()
+                evict = []
+                for old_key, old_size in rows:
+                    if total <= self.max_bytes:
+                        break
+                    evict.append((old_key,))
+                    total -= old_size
+                self._conn.executemany("DELETE FROM completions WHERE key = ?", evict)
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM completions")
+            self._conn.commit()
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_default_cache():
+    """Process-wide cache at CACHE_DB, opened on first use."""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = LLMCache()
+        return _default_cache
+
+
+class CallStats:
+    """Thread-safe tally of one run's completion requests and how many the cache answered."""
+
+    def __init__(self):
+        self.requests = 0
+        self.cache_hits = 0
+        self._lock = threading.Lock()
+
+    def record(self, cache_hit):
+        with self._lock:
+            self.requests += 1
+            self.cache_hits += cache_hit
+
+    @property
+    def llm_calls(self):
+        """Requests that reached the model."""
+        return self.requests - self.cache_hits
+
+
+def cached_completion(client, model, messages, temperature=None, cache=None, stats=None, on_delta=None,
+                      cancel=None, **params):
+    """
+    client.chat.completions.create() through the cache.
+    Returns the completion text ("" if the model returned nothing; empty results are not cached).
+    stats, if given, is a CallStats that counts the request.
+    on_delta, if given, streams the completion: it is called with each piece of
+    text as it arrives (once with the whole text on a cache hit).
+    cancel, if given, is a job_manager.CancelToken: the completion is then
+    streamed so cancelling closes the response mid-answer, and cancel.check()
+    raises instead of returning a partial answer.
+    """
+    if cancel is not None:
+        cancel.check()
+    cache = cache or get_default_cache()
+    key = cache_key(model, messages, temperature, **params)
+
+    content = cache.get(key)
+    if stats is not None:
+        stats.record(content is not None)
+    if content is not None:
+        if on_delta:
+            on_delta(content)
+        return content
+
+    if temperature is not None:
+        params["temperature"] = temperature
+    if on_delta or cancel is not None:
+        pieces = []
+        stream = client.chat.completions.create(model=model, messages=messages, stream=True, **params)
+        # Closing the stream from the cancelling thread aborts the HTTP response
+        unregister = cancel.on_cancel(stream.close) if cancel is not None else None
+        try:
+            for chunk in stream:
+                # Azure sends a first chunk with no choices (content filter results)
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    pieces.append(delta)
+                    if on_delta:
+                        on_delta(delta)
+        except Exception:
+            if cancel is not None:
+                cancel.check()
+            raise
+        finally:
+            if unregister:
+                unregister()
+        if cancel is not None:
+            cancel.check()
+        content = "".join(pieces)
+    else:
+        response = client.chat.completions.create(model=model, messages=messages, **params)
+        content = response.choices[0].message.content or ""
+
+    if content:
+        cache.put(key, content)
+    return content
@@ -10,55 +10,170 @@ import os
 import re
 import json
 import time
+import random
 import hashlib
 import requests
 from flask import Flask, jsonify, request, Response
 from flask_cors import CORS
-import queue
 import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from openai import AzureOpenAI
+from message_store import MessageStore
+from cache_store import CacheStore, CompanyNotFound, InvalidPositionIndex
+from llm_cache import CallStats, cached_completion, get_default_cache
+from stage_classifier import PatternSet, StageClassifier
+from date_utils import parse_date
+from prompt_budget import estimate_tokens, pack_emails
+from rules_extractor import company_key, rules_extract
+from json_stream import PositionStream
+from job_manager import Cancelled, JobManager, JobQueueFull, JobStore
 
 app = Flask(__name__)
-CORS(app)
+# Only the dashboard may call this server from a browser (requests carry the Gmail session id)
+FRONTEND_ORIGIN = os.environ.get("FRONTEND_ORIGIN", "http://localhost:3000")
+CORS(app, origins=[FRONTEND_ORIGIN])
 
 # Render backend URL for fetching emails
 RENDER_URL = "https://gmail-login-backend.onrender.com"
 
+# Shared keep-alive session for Render calls (sized for concurrent company analysis + page prefetch)
+render_session = requests.Session()
+render_session.mount("https://", requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=16))
+
+# Render keeps one Gmail login per session id. The frontend sends it as X-Session-Id
+# and every Render call forwards it per request (see session_headers), never by
+# changing render_session, which all requests and jobs share.
+SESSION_HEADER = "X-Session-Id"
+
+
+def session_headers(session_id):
+    """Headers for a Render call made on behalf of a Gmail session."""
+    return {SESSION_HEADER: session_id} if session_id else {}
+
+# Render answers 429 when the user's Gmail quota is exhausted (after its own retries);
+# those and 5xx responses are retried with jittered backoff instead of truncating results
+RENDER_MAX_RETRIES = int(os.environ.get("RENDER_MAX_RETRIES", 4))
+RENDER_RETRY_BASE_DELAY = 1.0
+RENDER_RETRY_MAX_DELAY = 30.0
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class RenderError(Exception):
+    """A Render call that still failed after its retries (status is the last HTTP status, if any)."""
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+def response_retryable(resp):
+    """False when Render's error body says retrying can't help ({"retryable": false},
+    e.g. a non-retryable Gmail error behind a 502)."""
+    try:
+        return resp.json().get("retryable", True) is not False
+    except (ValueError, AttributeError):
+        return True
+
+
+def render_call(method, url, cancel=None, session_id=None, **kwargs):
+    """
+    render_session.request() for the given Gmail session that retries 429/5xx
+    responses and connection errors with full-jitter backoff (honouring
+    Retry-After). Returns the 200 response; raises RenderError otherwise, so a
+    failed page fails the run instead of silently dropping emails.
+    """
+    kwargs["headers"] = {**kwargs.get("headers", {}), **session_headers(session_id)}
+    for attempt in range(RENDER_MAX_RETRIES + 1):
+        try:
+            resp = render_session.request(method, url, **kwargs)
+        except requests.RequestException as e:
+            resp, problem = None, str(e)
+        else:
+            if resp.status_code == 200:
+                return resp
+            problem = f"HTTP {resp.status_code}"
+            if resp.status_code not in RETRYABLE_STATUS or not response_retryable(resp):
+                break
+        if attempt == RENDER_MAX_RETRIES:
+            break
+        delay = random.uniform(0, min(RENDER_RETRY_MAX_DELAY, RENDER_RETRY_BASE_DELAY * 2 ** attempt))
+        retry_after = resp.headers.get("Retry-After") if resp is not None else None
+        if retry_after and retry_after.isdigit():
+            delay = max(delay, float(retry_after))
+        print(f"  Render {problem}, retrying in {delay:.1f}s")
+        time.sleep(delay)
+        if cancel is not None:
+            cancel.check()
+    raise RenderError(f"{method} {url.replace(RENDER_URL, '')} failed: {problem}",
+                      resp.status_code if resp is not None else None)
+
 # =========================
 # CACHE CONFIGURATION (Permanent, Date-Range Aware)
 # =========================
+# Legacy JSON cache, imported into the SQLite store on first start
 CACHE_FILE = os.path.join(os.path.dirname(__file__), "cache.json")
 
+# Per-user companies/positions (SQLite, one row per company)
+cache_store = CacheStore()
+migrated_users = cache_store.migrate_from_json(CACHE_FILE)
+if migrated_users:
+    print(f"Migrated {migrated_users} users from {CACHE_FILE} to {cache_store.path}")
 
-def load_cache():
-    """Load cache from JSON file"""
-    if not os.path.exists(CACHE_FILE):
-        return {}
-    try:
-        with open(CACHE_FILE, 'r') as f:
-            return json.load(f)
-    except (json.JSONDecodeError, IOError):
-        return {}
-
-
-def save_cache(cache):
-    """Save cache to JSON file"""
-    try:
-        with open(CACHE_FILE, 'w') as f:
-            json.dump(cache, f, indent=2)
-    except IOError as e:
-        print(f"Warning: Could not save cache: {e}")
+# Raw Gmail messages keyed by message id, so re-runs only fetch new mail
+message_store = MessageStore()
 
 
-def get_user_email():
-    """Get the authenticated user's email from Render"""
+# =========================
+# IDENTITY CACHE
+# =========================
+# The identity behind each Render session id is cached; "unknown" is never
+# cached so a fresh login is seen immediately
+IDENTITY_TTL = float(os.environ.get("IDENTITY_TTL", 300))
+_identities = {}  # session id -> (email, expires)
+_identity_lock = threading.Lock()
+
+
+def get_user_email(session_id):
+    """Get the email behind a Render session (cached for IDENTITY_TTL seconds)"""
+    now = time.time()
+    with _identity_lock:
+        email, expires = _identities.get(session_id, (None, 0))
+        if email and now < expires:
+            return email
+
+    email = "unknown"
     try:
-        resp = requests.get(f"{RENDER_URL}/user-info", timeout=10)
+        resp = render_session.get(f"{RENDER_URL}/user-info", headers=session_headers(session_id), timeout=10)
         if resp.status_code == 200:
-            return resp.json().get("email", "unknown")
+            email = resp.json().get("email", "unknown")
     except:
         pass
-    return "unknown"
+
+    with _identity_lock:
+        for sid in [sid for sid, (_, exp) in _identities.items() if exp <= now]:
+            del _identities[sid]
+        if email != "unknown":
+            _identities[session_id] = (email, now + IDENTITY_TTL)
+        else:
+            _identities.pop(session_id, None)
+    return email
+
+
+def forget_user_email(session_id):
+    """Drop a session's cached identity (logout, or Render reports it's no longer authenticated)"""
+    with _identity_lock:
+        _identities.pop(session_id, None)
+
+
+def is_known_user(user_email):
+    """False for a missing or "unknown" identity (Render unreachable or logged out).
+    Such runs must never read or write per-user data: every failed lookup shares that key."""
+    return bool(user_email) and user_email != "unknown"
+
+
+def request_session_id():
+    """The Render session id the current request was made for (None if it has none)."""
+    return request.headers.get(SESSION_HEADER) or None
 
 
 def get_user_cache(user_email):
@@ -73,26 +188,23 @@ def get_user_cache(user_email):
         "total_companies": N,
         "total_applications": N,
         "timestamp": ...,  # last update time (for reference only)
+        "history_id": "...",  # Gmail history id the cache is synced to (for /changes)
     }
-    """
-    cache = load_cache()
-    return cache.get(user_email)
 
+    Served from cache_store's in-memory copy; the entry is shared, so don't mutate it.
+    None for an unidentified user.
+    """
+    if not is_known_user(user_email):
+        return None
+    return cache_store.get_user(user_email)
 
-def save_user_cache(user_email, earliest_date, latest_date, companies, total_companies, total_applications):
-    """Save cached data for a user with date range metadata"""
-    cache = load_cache()
-
-    cache[user_email] = {
-        "earliest_date": earliest_date,
-        "latest_date": latest_date,
-        "companies": companies,
-        "total_companies": total_companies,
-        "total_applications": total_applications,
-        "timestamp": time.time()
-    }
 
-    save_cache(cache)
+def save_user_cache(user_email, earliest_date, latest_date, companies, total_companies, total_applications, history_id=None):
+    """Save cached data for a user with date range metadata (totals are derived from companies)"""
+    if not is_known_user(user_email):
+        print("\n💾 CACHE SAVE skipped: user not identified")
+        return
+    cache_store.save_user(user_email, earliest_date, latest_date, companies, history_id)
     print(f"\n💾 CACHE SAVE:")
     print(f"   User: {user_email}")
     print(f"   Date range: {earliest_date} to {latest_date}")
@@ -215,6 +327,44 @@ def check_cache_coverage(user_email, requested_start, requested_end):
     print(f"   ⚠️ Complex cache gap - fetching full range")
     return None, None
 
+def gmail_date_filter(start_date, end_date):
+    """
+    Gmail after:/before: terms for a date range, and whether the range reaches now.
+    before: is exclusive, so a range ending today (or later) gets no before: at all;
+    otherwise today's mail would be missed while the run still counts as up to date.
+    """
+    today = time.strftime("%Y-%m-%d")
+    date_filter = ""
+    if start_date:
+        date_filter += f" after:{start_date.replace('-', '/')}"
+    open_ended = not end_date or end_date >= today
+    if not open_ended:
+        date_filter += f" before:{end_date.replace('-', '/')}"
+    if not date_filter:
+        date_filter = " after:2025/06/06"
+    return date_filter, open_ended
+
+
+def history_sync_start(cached_data, coverage_type, fetch_end):
+    """
+    Gmail history id to sync from, if this run only needs mail newer than the cache.
+    Refreshing up to today is then proportional to new mail instead of the date window.
+    """
+    today = time.strftime("%Y-%m-%d")
+    if cached_data and coverage_type == "extend_later" and (fetch_end or today) >= today:
+        return cached_data.get("history_id")
+    return None
+
+
+def history_id_to_save(result, cached_data, coverage_type, new_latest):
+    """A run's history id only becomes the sync point if the cache now reaches today
+    (process_with_progress only returns one when its query covered everything up to now)."""
+    today = time.strftime("%Y-%m-%d")
+    if coverage_type != "extend_earlier" and (new_latest or today) >= today and result.get("history_id"):
+        return result.get("history_id")
+    return (cached_data or {}).get("history_id")
+
+
 # Azure OpenAI Configuration (same as original scripts)
 client = AzureOpenAI(
     azure_endpoint="https://api-iw.azure-api.net/sig-shared-jpeast/deployments/gpt-4o-mini/chat/completions?api-version=2025-01-01-preview",
@@ -223,6 +373,26 @@ client = AzureOpenAI(
 )
 MODEL = "gpt-4o-mini"
 
+# Per-company analysis concurrency and per-call GPT timeout (seconds)
+ANALYSIS_WORKERS = int(os.environ.get("ANALYSIS_WORKERS", 4))
+LLM_TIMEOUT = float(os.environ.get("LLM_TIMEOUT", 60))
+
+# Token budget for the emails in each company's analysis prompt, and the most body text per email
+PROMPT_TOKEN_BUDGET = int(os.environ.get("PROMPT_TOKEN_BUDGET", 2000))
+PROMPT_BODY_CHARS = int(os.environ.get("PROMPT_BODY_CHARS", 600))
+
+# Batched analysis: up to ANALYSIS_BATCH_SIZE companies whose emails fit in
+# ANALYSIS_BATCH_TOKENS share one GPT call (1 = one call per company)
+ANALYSIS_BATCH_SIZE = int(os.environ.get("ANALYSIS_BATCH_SIZE", 1))
+ANALYSIS_BATCH_TOKENS = int(os.environ.get("ANALYSIS_BATCH_TOKENS", 400))
+
+# Companies whose rules-first extraction reaches this confidence skip GPT (0-1).
+# 0.8 lets through one title with an application date and at most two unrecognised
+# emails; interviews or extra applications (0.7) still go to GPT
+RULES_CONFIDENCE = float(os.environ.get("RULES_CONFIDENCE", 0.8))
+if not 0 <= RULES_CONFIDENCE <= 1:
+    raise RuntimeError(f"RULES_CONFIDENCE must be between 0 and 1, got {RULES_CONFIDENCE}.")
+
 # =========================
 # FROM FIRSTFILTER.PY
 # =========================
@@ -234,6 +404,10 @@ GENERIC_TOKENS = {
     "graduate", "analyst", "engineer", "program", "programme"
 }
 
+# Substrings that mark an ATS sender domain (build_strict_query ignores tal.net; validation doesn't)
+ATS_DOMAIN_MARKERS = ["workday", "greenhouse", "lever", "brassring", "hirevue", "hackerrank"]
+VALIDATION_ATS_MARKERS = ATS_DOMAIN_MARKERS + ["tal.net"]
+
 ATS_DOMAINS = {
     "workday.com", "myworkday.com", "greenhouse.io", "greenhouse-mail.io",
     "lever.co", "hire.lever.co", "tal.net", "brassring.com",
@@ -317,6 +491,13 @@ STAGE_PATTERNS = {
     ],
 }
 
+# Compiled once (see stage_classifier.py); same matches as re.search per pattern
+STAGE_CLASSIFIER = StageClassifier(STAGE_PATTERNS)
+SKIP_MATCHER = PatternSet(SKIP_PATTERNS)
+
+# Local equivalent of the Gmail subject:("application" OR ...) filter, for history-synced emails
+JOB_SUBJECT_RE = re.compile(r"\b(application|applying|apply|applied)\b", re.IGNORECASE)
+
 BAD_POSITION_PATTERNS = [
     "job title", "actual job title", "empty string", "role at",
     "thank you for", "we've received", "we have received",
@@ -354,6 +535,33 @@ def extract_json(text):
     return {}
 
 
+def extract_company_results(text, companies):
+    """
+    Split a batched GPT answer into {company: {"positions": [...]}}.
+    Accepts {"companies": {name: {...}}} (or the names at the top level) and
+    {"companies": [{"company": name, "positions": [...]}]}; names are matched
+    ignoring case and punctuation, and companies not asked about are dropped.
+    """
+    result = extract_json(text)
+    entries = result.get("companies", result)
+    if isinstance(entries, list):
+        entries = {e.get("company") or e.get("name"): e for e in entries if isinstance(e, dict)}
+    if not isinstance(entries, dict):
+        return {}
+
+    wanted = {company_key(c): c for c in companies}
+    by_company = {}
+    for name, value in entries.items():
+        company = wanted.get(company_key(name))
+        if company is None:
+            continue
+        if isinstance(value, list):
+            value = {"positions": value}
+        if isinstance(value, dict):
+            by_company[company] = value
+    return by_company
+
+
 def clean_domain(email):
     """Extract domain from email address (from firstfilter.py)"""
     if not email:
@@ -366,65 +574,82 @@ def clean_domain(email):
     return s.lower().strip(">").strip('"').strip("'")
 
 
-def parse_date(date_str):
-    """Normalize date to YYYY-MM-DD format (from secondfilter.py)"""
-    if not date_str:
-        return None
-
-    # ISO format: 2025-10-02T03:43:14+00:00
-    match = re.search(r"(\d{4}-\d{2}-\d{2})", date_str)
-    if match:
-        return match.group(1)
-
-    # RFC format: Mon, 03 Nov 2025 21:43:20 +0000
-    try:
-        from datetime import datetime
-        # Remove timezone info for parsing
-        clean = re.sub(r'\s*\([^)]*\)\s*$', '', date_str)  # Remove (UTC) etc
-        clean = re.sub(r'\s*[+-]\d{4}\s*$', '', clean)     # Remove +0000 etc
-        clean = clean.strip()
-
-        for fmt in [
-            "%a, %d %b %Y %H:%M:%S",
-            "%d %b %Y %H:%M:%S",
-        ]:
-            try:
-                dt = datetime.strptime(clean, fmt)
-                return dt.strftime("%Y-%m-%d")
-            except:
-                continue
-    except:
-        pass
-
-    return None
-
-
-def should_skip(email):
-    """Check if email should be skipped (from secondfilter.py)"""
-    subject = email.get("subject", "").lower()
-    from_email = email.get("from_email", "").lower()
-    text = f"{subject} {from_email}"
-
-    for pattern in SKIP_PATTERNS:
-        if re.search(pattern, text, re.IGNORECASE):
-            return True
-    return False
-
+_UNSET = object()
 
-def detect_stages(email):
-    """Pre-detect stages using regex (from secondfilter.py)"""
-    subject = email.get("subject", "").lower()
-    from_email = email.get("from_email", "").lower()
-    body = email.get("body", "").lower()[:500]
-    text = f"{subject} {from_email} {body}"
 
-    detected = []
-    for stage, patterns in STAGE_PATTERNS.items():
-        for pattern in patterns:
-            if re.search(pattern, text, re.IGNORECASE):
-                detected.append(stage)
-                break
-    return detected
+class EmailRecord:
+    """
+    One email plus the features the pipeline needs, each computed at most once
+    instead of re-lowercasing and re-parsing in every step.
+    Header features are computed at ingest; date, body and stage features on
+    first use. with_body() builds the hydrated record for a metadata-only one.
+    """
+    __slots__ = ("id", "subject", "from_email", "date", "body",
+                 "subject_lower", "from_lower", "domain", "domain_is_ats", "sender_domain",
+                 "_date_parsed", "_body_lower", "_stages", "_skip")
+
+    def __init__(self, email):
+        self.id = email.get("id")
+        self.subject = email.get("subject") or ""
+        self.from_email = email.get("from_email") or ""
+        self.date = email.get("date") or ""
+        self.body = email.get("body") or ""
+
+        self.subject_lower = self.subject.lower()
+        self.from_lower = self.from_email.lower()
+        self.domain = clean_domain(self.from_email)
+        self.domain_is_ats = any(ats in self.domain for ats in VALIDATION_ATS_MARKERS)
+        # Company-specific sender domain for build_strict_query (None if no address or an ATS)
+        self.sender_domain = None
+        if "@" in self.from_lower:
+            domain = self.from_lower.split("@")[-1].split(">")[0].strip()
+            if not any(ats in domain for ats in ATS_DOMAIN_MARKERS):
+                self.sender_domain = domain
+        self._date_parsed = _UNSET
+        self._body_lower = None
+        self._stages = None
+        self._skip = None
+
+    def with_body(self, email):
+        """Record for the same message with its body fetched; header features are reused."""
+        record = EmailRecord.__new__(EmailRecord)
+        for slot in EmailRecord.__slots__:
+            setattr(record, slot, getattr(self, slot))
+        record.body = email.get("body") or ""
+        record._body_lower = None
+        record._stages = None
+        return record
+
+    @property
+    def date_parsed(self):
+        if self._date_parsed is _UNSET:
+            self._date_parsed = parse_date(self.date)
+        return self._date_parsed
+
+    @property
+    def body_lower(self):
+        """First 1000 lowercased body characters (validation reads 1000, stages/dedup 500)"""
+        if self._body_lower is None:
+            self._body_lower = self.body.lower()[:1000]
+        return self._body_lower
+
+    @property
+    def stages(self):
+        """Pre-detected stages (from secondfilter.py's detect_stages)"""
+        if self._stages is None:
+            self._stages = STAGE_CLASSIFIER.classify(f"{self.subject_lower} {self.from_lower} {self.body_lower[:500]}")
+        return self._stages
+
+    @property
+    def skip(self):
+        """True if the email is noise (from secondfilter.py's should_skip)"""
+        if self._skip is None:
+            self._skip = SKIP_MATCHER.matches(f"{self.subject_lower} {self.from_lower}")
+        return self._skip
+
+
+def to_records(emails):
+    return [EmailRecord(e) for e in emails]
 
 
 def deduplicate_emails(emails):
@@ -434,9 +659,8 @@ def deduplicate_emails(emails):
     rejection_phrases = ["regret to inform", "will not be moving forward", "not proceed", "unfortunately"]
 
     for email in emails:
-        subject = email.get("subject", "")
-        body = email.get("body", "").lower()[:500]
-        normalized = re.sub(r"^(re:|fwd:|fw:)\s*", "", subject.lower(), flags=re.IGNORECASE).strip()
+        body = email.body_lower[:500]
+        normalized = re.sub(r"^(re:|fwd:|fw:)\s*", "", email.subject_lower, flags=re.IGNORECASE).strip()
         is_rejection = any(phrase in body for phrase in rejection_phrases)
         key = (normalized[:60], is_rejection)
 
@@ -448,32 +672,31 @@ def deduplicate_emails(emails):
 
 
 def clean_body_text(body):
-    """Clean body text for GPT (from secondfilter.py)"""
+    """Clean body text for GPT (from secondfilter.py); length is left to the prompt budget"""
     if not body:
         return ""
     text = re.sub(r'\s+', ' ', body).strip()
     text = re.sub(r'(unsubscribe|privacy policy|terms of service|view in browser).*', '', text, flags=re.IGNORECASE)
     text = re.sub(r'https?://\S+', '[link]', text)
-    if len(text) > 300:
-        text = text[:300] + "..."
     return text
 
 
-def format_compact(emails):
-    """Format emails for GPT with body (from secondfilter.py)"""
-    lines = []
-    for e in emails:
-        date = parse_date(e.get("date", "")) or "?"
-        subject = e.get("subject", "")[:80]
-        from_email = e.get("from_email", "")
-        domain_match = re.search(r"@([^>\s]+)", from_email)
-        domain = domain_match.group(1)[:25] if domain_match else "?"
-        stages = detect_stages(e)
-        stage_str = f" [{','.join(stages)}]" if stages else ""
-        body = clean_body_text(e.get("body", ""))
-        body_str = f"\n   Body: {body}" if body else ""
-        lines.append(f"{date} | {domain} | {subject}{stage_str}{body_str}")
-    return "\n".join(lines)
+def format_header(e):
+    """'date | sender | subject [pre-detected stages]' line (from secondfilter.py's format_compact)"""
+    date = e.date_parsed or "?"
+    subject = e.subject[:80]
+    domain_match = re.search(r"@([^>\s]+)", e.from_email)
+    domain = domain_match.group(1)[:25] if domain_match else "?"
+    stage_str = f" [{','.join(e.stages)}]" if e.stages else ""
+    return f"{date} | {domain} | {subject}{stage_str}"
+
+
+def format_compact(emails, budget=PROMPT_TOKEN_BUDGET):
+    """
+    Format emails for GPT with body, packed into `budget` tokens (see prompt_budget.py).
+    Returns (text, tokens, number of emails included).
+    """
+    return pack_emails(emails, budget, format_header, lambda e: clean_body_text(e.body), PROMPT_BODY_CHARS)
 
 
 def build_strict_query(company, all_messages, date_filter=""):
@@ -511,16 +734,12 @@ def build_strict_query(company, all_messages, date_filter=""):
 
     # 3) Domain-based matching (only for company-specific domains)
     company_domains = set()
-    for m in all_messages:
-        fe = m.get("from_email", "").lower()
-        if "@" in fe:
-            domain = fe.split("@")[-1].split(">")[0].strip()
-            is_ats = any(ats in domain for ats in ["workday", "greenhouse", "lever", "brassring", "hirevue", "hackerrank"])
-            if not is_ats:
-                for token in meaningful_tokens:
-                    if token in domain and len(token) >= 3:
-                        company_domains.add(domain)
-                        break
+    sender_domains = {m.sender_domain for m in all_messages if m.sender_domain}
+    for domain in sender_domains:
+        for token in meaningful_tokens:
+            if token in domain and len(token) >= 3:
+                company_domains.add(domain)
+                break
 
     if company_domains:
         domain_query = " OR ".join([f"from:{d}" for d in company_domains])
@@ -547,17 +766,15 @@ def validate_emails_for_company(company, emails):
 
     validated = []
     for email in emails:
-        subject = email.get("subject", "").lower()
-        from_email = email.get("from_email", "").lower()
-        body = email.get("body", "").lower()[:1000]
+        subject = email.subject_lower
+        body = email.body_lower
 
         subject_match = company_lower in subject or any(t in subject for t in meaningful_tokens if len(t) >= 4)
-        domain = clean_domain(from_email)
+        domain = email.domain
         domain_match = any(t in domain for t in meaningful_tokens if len(t) >= 3)
         body_match = company_lower in body or any(t in body for t in meaningful_tokens if len(t) >= 4)
 
-        is_ats = any(ats in domain for ats in ["workday", "greenhouse", "lever", "brassring", "hirevue", "hackerrank", "tal.net"])
-        if is_ats:
+        if email.domain_is_ats:
             if subject_match or body_match:
                 validated.append(email)
         elif subject_match or domain_match:
@@ -566,32 +783,142 @@ def validate_emails_for_company(company, emails):
     return validated
 
 
-def fetch_emails_from_render(query, max_loops=10):
-    """Fetch emails from Render with pagination (from firstfilter.py)"""
-    all_msgs = []
-    next_page = None
+def prefilter_emails_for_company(company, emails):
+    """
+    Header-only pass of validate_emails_for_company for metadata emails.
+    Keeps emails that already validate on subject/domain, plus ATS emails
+    whose company match can only be decided from the body.
+    """
+    validated = {id(e) for e in validate_emails_for_company(company, emails)}
+    candidates = []
+    for email in emails:
+        if id(email) in validated or email.domain_is_ats:
+            candidates.append(email)
+    return candidates
+
 
-    for _ in range(max_loops):
-        url = f"{RENDER_URL}/query"
-        params = {"q": query, "format": "full"}
-        if next_page:
-            params["page_token"] = next_page
+def iter_render_pages(query, max_loops=10, format_type="full", cancel=None, session_id=None):
+    """Yield pages of messages from Render's /query (pagination from firstfilter.py).
+    Page N+1 is requested in the background while the caller consumes page N.
+
+    format_type: "full" for complete email with body, "metadata" for headers only,
+    "ids" for message ids only
+    cancel: the job's CancelToken, checked before each page is requested
+    session_id: the Render session (Gmail account) to read
+    """
+    url = f"{RENDER_URL}/query"
+
+    def fetch_page(page_token):
+        params = {"q": query, "format": format_type}
+        if page_token:
+            params["page_token"] = page_token
 
         print(f"  Fetching: {url}")
-        resp = requests.get(url, params=params, timeout=60)
-        if resp.status_code != 200:
-            print(f"  Error: {resp.status_code}")
-            break
+        return render_call("GET", url, cancel, session_id, params=params, timeout=60).json()
 
-        data = resp.json()
-        msgs = data.get("messages", [])
-        all_msgs.extend(msgs)
+    with ThreadPoolExecutor(max_workers=1) as prefetcher:
+        future = prefetcher.submit(fetch_page, None)
+        for loop in range(max_loops):
+            data = future.result()
+            if cancel is not None:
+                cancel.check()
+
+            next_page = data.get("next_page_token") if loop + 1 < max_loops else None
+            if next_page:
+                future = prefetcher.submit(fetch_page, next_page)
+
+            yield data.get("messages", [])
+
+            if not next_page:
+                break
+
+
+def fetch_messages_from_render(message_ids, format_type="full", chunk_size=100, cancel=None, session_id=None):
+    """Fetch records for known message ids via Render's /messages endpoint.
+    Returns records in id order; ids Gmail no longer has are dropped, and a
+    chunk that keeps failing raises RenderError."""
+    fetched = {}
+
+    for start in range(0, len(message_ids), chunk_size):
+        if cancel is not None:
+            cancel.check()
+        resp = render_call(
+            "POST", f"{RENDER_URL}/messages", cancel, session_id,
+            json={"ids": message_ids[start:start + chunk_size], "format": format_type},
+            timeout=60
+        )
+        for msg in resp.json().get("messages", []):
+            fetched[msg.get("id")] = msg
+
+    return [fetched[i] for i in message_ids if i in fetched]
+
+
+def get_messages(message_ids, format_type, user_email, cancel=None, session_id=None):
+    """Read records from the local message store, fetching only ids not stored yet."""
+    if not is_known_user(user_email):
+        return fetch_messages_from_render(message_ids, format_type, cancel=cancel, session_id=session_id)
+
+    require_body = format_type == "full"
+    stored = message_store.get_many(user_email, message_ids, require_body=require_body)
+    missing = [i for i in message_ids if i not in stored]
+
+    if missing:
+        fetched = fetch_messages_from_render(missing, format_type, cancel=cancel, session_id=session_id)
+        message_store.put_many(user_email, fetched, has_body=require_body)
+        stored.update({m["id"]: m for m in fetched})
+
+    print(f"  Message store: {len(message_ids) - len(missing)} local, {len(missing)} fetched")
+    return [stored[i] for i in message_ids if i in stored]
+
+
+def iter_emails_from_render(query, max_loops=10, format_type="full", user_email=None, cancel=None, session_id=None):
+    """
+    Stream emails for a Gmail query page by page, so callers can filter and
+    dedup while later pages are still downloading.
+    With a known user_email, Render only lists message ids; records already in
+    the message store are read locally and only new ids are fetched.
+    """
+    use_store = is_known_user(user_email)
+    for page in iter_render_pages(query, max_loops, "ids" if use_store else format_type, cancel, session_id):
+        if use_store:
+            yield from get_messages([m["id"] for m in page], format_type, user_email, cancel, session_id)
+        else:
+            yield from page
 
-        next_page = data.get("next_page_token")
-        if not next_page:
-            break
 
-    return all_msgs
+def fetch_emails_from_render(query, max_loops=10, format_type="full", user_email=None, cancel=None, session_id=None):
+    """Fetch all emails for a Gmail query (see iter_emails_from_render)."""
+    return list(iter_emails_from_render(query, max_loops, format_type, user_email, cancel, session_id))
+
+
+def fetch_changes_from_render(since_history_id=None, session_id=None, cancel=None):
+    """
+    Ask Render which inbox messages were added since a Gmail history id.
+    Returns {"history_id": ..., "message_ids": [...]}, or None if the history id
+    has expired (410) or Render returned no history id, and a date-range fetch
+    is needed. Transient failures are retried (render_call); raises RenderError
+    if they persist.
+    """
+    params = {"since": since_history_id} if since_history_id else {}
+    try:
+        data = render_call("GET", f"{RENDER_URL}/changes", cancel, session_id, params=params, timeout=60).json()
+    except RenderError as e:
+        if e.status != 410:
+            raise
+        print("  History id expired, full sync required")
+        return None
+    if not data.get("history_id"):
+        print("  Changes: no history id returned")
+        return None
+    return data
+
+
+def hydrate_emails_from_render(emails, user_email=None, cancel=None, session_id=None):
+    """Fetch bodies for metadata-only EmailRecords. Returns full records in the same order;
+    emails that fail to hydrate are dropped."""
+    by_id = {e.id: e for e in emails if e.id}
+    full = get_messages([e.id for e in emails if e.id], "full", user_email, cancel, session_id)
+    return [by_id[m["id"]].with_body(m) for m in full if m.get("id") in by_id]
 
 
 # =========================
@@ -607,7 +934,12 @@ def index():
             "/process?refresh=true - Fetch new emails since last cache update",
             "/process?start_date=YYYY-MM-DD&end_date=YYYY-MM-DD - Fetch specific date range",
             "/process-stream - Same as /process but with SSE progress events",
+            "POST /jobs - Start processing in the background (same parameters), returns a job id",
+            "/jobs/<id> - Job status and result",
+            "/jobs/<id>/events - SSE progress events of a job (reattach with Last-Event-ID)",
+            "POST /jobs/<id>/cancel - Stop a job (also happens once all its clients disconnect)",
             "/status - Check auth status",
+            "/logout - Log out on Render and forget the cached identity",
             "/cache-info - View cached date ranges per user",
             "/clear-cache - Clear all cached data"
         ]
@@ -617,19 +949,37 @@ def index():
 @app.route('/status')
 def status():
     """Proxy to Render's status endpoint"""
+    session_id = request_session_id()
     try:
-        resp = requests.get(f"{RENDER_URL}/status")
-        return jsonify(resp.json())
+        resp = render_session.get(f"{RENDER_URL}/status", headers=session_headers(session_id), timeout=10)
+        data = resp.json()
+        if not data.get("authenticated"):
+            forget_user_email(session_id)
+        return jsonify(data)
     except Exception as e:
         return jsonify({"authenticated": False, "error": str(e)})
 
 
+@app.route('/logout')
+def logout():
+    """Proxy to Render's logout and drop the cached identity"""
+    session_id = request_session_id()
+    forget_user_email(session_id)
+    try:
+        resp = render_session.get(f"{RENDER_URL}/logout", headers=session_headers(session_id), timeout=10)
+        return jsonify(resp.json()), resp.status_code
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 502
+
+
 @app.route('/clear-cache')
 def clear_cache():
-    """Clear the entire cache"""
+    """Clear the entire cache (including stored Gmail messages and GPT responses)"""
     try:
-        if os.path.exists(CACHE_FILE):
-            os.remove(CACHE_FILE)
+        message_store.clear()
+        get_default_cache().clear()
+        if cache_store.all_users():
+            cache_store.clear()
             return jsonify({"success": True, "message": "Cache cleared"})
         return jsonify({"success": True, "message": "Cache was already empty"})
     except Exception as e:
@@ -639,7 +989,7 @@ def clear_cache():
 @app.route('/cache-info')
 def cache_info():
     """Get information about cached entries (per user, permanent cache)"""
-    cache = load_cache()
+    cache = cache_store.all_users()
     entries = []
     current_time = time.time()
 
@@ -662,11 +1012,375 @@ def cache_info():
     })
 
 
-def process_with_progress(start_date, end_date, progress_callback=None):
+ANALYSIS_SYSTEM_PROMPT = "You are a precise job application timeline extractor. Output valid JSON only."
+
+ANALYSIS_RULES = """CRITICAL RULES:
+1. POSITION: Extract the actual JOB TITLE (e.g., "Graduate Software Engineer", "Analyst Program 2026", "Data Scientist").
+   - Look for patterns like "applying for [POSITION]", "application for [POSITION]", "Thank you for applying to [POSITION]"
+   - NEVER use generic phrases like "Thank you for your application", "We've received your application", "role at X"
+
+2. MULTIPLE POSITIONS: If the candidate applied to MULTIPLE different positions at this company, return ALL of them as separate entries in the "positions" array. Each position should have its own timeline and status.
+
+3. "video_interview" = ONE-WAY pre-recorded video (HireVue, Willo) only. Phone calls and live video calls are human_interviews.
+
+4. Count human interviews: same event on same day = 1, different days = multiple. "Super Day" = 1 event.
+
+5. "status": For EACH position separately - "rejected" if that specific position was rejected, "offer" if offered, "pending" otherwise."""
+
+POSITIONS_SCHEMA = ('{"positions":[{"position":"Job Title","applied":"YYYY-MM-DD","aptitude_test":"YYYY-MM-DD or null",'
+                    '"simulation_test":"YYYY-MM-DD or null","coding_test":"YYYY-MM-DD or null",'
+                    '"video_interview":"YYYY-MM-DD or null","human_interviews":N,"status":"pending|rejected|offer"}]}')
+
+ANALYSIS_PROMPT = """Analyze job application emails for "{company}".
+
+{section}
+
+{rules}
+
+OUTPUT JSON only (array of positions):
+{schema}"""
+
+BATCH_ANALYSIS_PROMPT = """Analyze job application emails for each of these companies: {names}.
+Each company's emails are listed separately; never mix emails or positions between companies.
+
+{sections}
+
+{rules}
+
+OUTPUT JSON only, one entry per company, keyed by the company name exactly as written above:
+{{"companies":{{"Company Name":{schema}}}}}"""
+
+# Changes whenever the prompts do, so memoized analyses from an older prompt are redone
+PROMPT_DIGEST = hashlib.sha256(json.dumps([
+    ANALYSIS_SYSTEM_PROMPT, ANALYSIS_RULES, POSITIONS_SCHEMA, ANALYSIS_PROMPT, BATCH_ANALYSIS_PROMPT
+]).encode("utf-8")).hexdigest()
+
+
+def email_set_digest(emails):
+    """Digest of a company's deduplicated email ids (plus model, prompts, prompt budget and rules threshold), used to skip unchanged re-analysis."""
+    ids = sorted(e.id or f"{e.date}|{e.subject}" for e in emails)
+    blob = json.dumps([MODEL, PROMPT_DIGEST, PROMPT_TOKEN_BUDGET, PROMPT_BODY_CHARS, RULES_CONFIDENCE, ids])
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class PreparedCompany:
+    """
+    A company's emails after fetching, filtering and stage pre-detection, ready
+    for GPT. `status` is already set ("empty", "reused" or "rules", with
+    `result`) when no GPT call is needed.
+    """
+
+    def __init__(self, company, status=None, result=None):
+        self.company = company
+        self.status = status
+        self.result = result
+        self.company_emails = []
+        self.unique = []
+        self.digest = None
+        self.use_memo = False
+        self.pre_detected = None
+        self.compact_text = ""
+        self.email_tokens = 0
+        self.emails_in_prompt = 0
+        self.confidence = None
+
+    def section(self):
+        """The company's emails and pre-detected status, as they appear in the prompt."""
+        hints = []
+        if self.pre_detected["rejection"]:
+            hints.append(f"REJECTION detected on {self.pre_detected['rejection']}")
+        if self.pre_detected["offer"]:
+            hints.append(f"OFFER detected on {self.pre_detected['offer']}")
+        pre_hint_str = "\n".join(hints)
+        return f"""EMAILS (date | sender | subject [pre-detected stages]):
+{self.compact_text}
+
+{f"PRE-DETECTED STATUS: {pre_hint_str}" if pre_hint_str else ""}"""
+
+    def usage(self, prompt_tokens, batched_with=1):
+        return {
+            "prompt_tokens": prompt_tokens,
+            "emails_in_prompt": self.emails_in_prompt,
+            "emails_total": len(self.unique),
+            "batched_with": batched_with,
+            "rules_confidence": self.confidence
+        }
+
+
+def prepare_company(company, all_emails, inbox_emails, date_filter, user_email, cancel=None, session_id=None):
+    """
+    STEP 4 up to the GPT call: fetch the company's emails, filter, check the
+    memo and pre-detect stages. Returns a PreparedCompany.
+    inbox_emails is the incremental-sync email set (None for date-range runs).
+    Safe to run from worker threads.
+    """
+    if cancel is not None:
+        cancel.check()
+    # Two-phase fetch: headers first, bodies only for emails that can belong to this company
+    if inbox_emails is not None:
+        # Incremental sync: every new inbox email is already in hand
+        company_raw_emails = inbox_emails
+    else:
+        company_query = build_strict_query(company, all_emails, date_filter)
+        company_raw_emails = to_records(fetch_emails_from_render(company_query, format_type="metadata",
+                                                                 user_email=user_email, cancel=cancel,
+                                                                 session_id=session_id))
+    candidates = prefilter_emails_for_company(company, company_raw_emails)
+    hydrated = hydrate_emails_from_render(candidates, user_email, cancel, session_id)
+    company_emails = validate_emails_for_company(company, hydrated)
+
+    if not company_emails:
+        return PreparedCompany(company, "empty")
+
+    filtered = [e for e in company_emails if not e.skip]
+    filtered.sort(key=lambda x: x.date_parsed or "9999")
+    unique = deduplicate_emails(filtered)
+
+    if not unique:
+        return PreparedCompany(company, "empty")
+
+    prepared = PreparedCompany(company)
+    prepared.company_emails = company_emails
+    prepared.unique = unique
+
+    # Reuse the previous result if this company's deduplicated email set is unchanged
+    prepared.use_memo = is_known_user(user_email)
+    prepared.digest = email_set_digest(unique)
+    if prepared.use_memo:
+        found, memo_result = message_store.get_company_result(user_email, company, prepared.digest)
+        if found:
+            prepared.status, prepared.result = "reused", memo_result
+            return prepared
+
+    # Pre-detect stages
+    pre_detected = {
+        "application_submitted": None,
+        "aptitude_test": None,
+        "simulation_test": None,
+        "coding_test": None,
+        "video_interview": None,
+        "human_interview_dates": [],
+        "rejection": None,
+        "offer": None,
+    }
+
+    for email in unique:
+        date = email.date_parsed
+        for stage in email.stages:
+            if stage == "human_interview":
+                if date and date not in pre_detected["human_interview_dates"]:
+                    pre_detected["human_interview_dates"].append(date)
+            elif stage in pre_detected:
+                if date and pre_detected[stage] is None:
+                    pre_detected[stage] = date
+
+    prepared.pre_detected = pre_detected
+
+    # Rules first: GPT is only asked when the subjects and stages leave doubt
+    positions, prepared.confidence = rules_extract(company, unique, pre_detected, BAD_POSITION_PATTERNS)
+    if positions and prepared.confidence >= RULES_CONFIDENCE:
+        prepared.status = "rules"
+        prepared.result = finish_company(prepared, positions, user_email)
+        return prepared
+
+    prepared.compact_text, prepared.email_tokens, prepared.emails_in_prompt = format_compact(unique)
+    return prepared
+
+
+def normalize_position(pos, pre_detected, use_predetected):
+    """One GPT position in the dashboard format; the first one falls back to pre-detected dates."""
+    position_name = pos.get("position", "")
+    if any(bad in position_name.lower() for bad in BAD_POSITION_PATTERNS):
+        position_name = ""
+
+    final_pos = {
+        "position": position_name,
+        "application_submitted": pos.get("applied") or (pre_detected["application_submitted"] if use_predetected else None),
+        "aptitude_test": pos.get("aptitude_test") if pos.get("aptitude_test") not in [None, "null", ""] else (pre_detected["aptitude_test"] if use_predetected else None),
+        "simulation_test": pos.get("simulation_test") if pos.get("simulation_test") not in [None, "null", ""] else (pre_detected["simulation_test"] if use_predetected else None),
+        "coding_test": pos.get("coding_test") if pos.get("coding_test") not in [None, "null", ""] else (pre_detected["coding_test"] if use_predetected else None),
+        "video_interview": pos.get("video_interview") if pos.get("video_interview") not in [None, "null", ""] else (pre_detected["video_interview"] if use_predetected else None),
+        "num_human_interview": str(pos.get("human_interviews", 0) or (len(pre_detected["human_interview_dates"]) if use_predetected else 0)),
+        "app_accepted": (
+            "y" if pos.get("status") == "offer" else
+            ("n" if pos.get("status") == "rejected" else None)
+        )
+    }
+
+    for key in final_pos:
+        if final_pos[key] == "null":
+            final_pos[key] = None
+
+    return final_pos
+
+
+def normalize_positions(result, pre_detected):
+    """GPT's positions for one company, with pre-detected dates filling the gaps of the first one."""
+    positions = result.get("positions", [])
+
+    if not positions and result.get("position"):
+        positions = [result]
+
+    return [normalize_position(pos, pre_detected, i == 0) for i, pos in enumerate(positions)]
+
+
+def stream_positions(batch, on_position):
+    """
+    on_delta callback for a streamed analysis answer: each position is normalized
+    and passed to on_position(company, position) as soon as its JSON object closes.
+    None if nobody is listening (the answer is then not streamed).
+    """
+    if on_position is None:
+        return None
+    parser = PositionStream()
+    by_key = {company_key(p.company): p for p in batch}
+    counts = {}
+
+    def on_delta(text):
+        for path, pos in parser.feed(text):
+            if len(batch) == 1:
+                prepared = batch[0]
+            else:
+                # Batched answer: {"companies": {name: {"positions": [...]}}}
+                prepared = by_key.get(company_key(path[-2])) if len(path) >= 2 and path[-2] else None
+            if prepared is None:
+                continue
+            i = counts.get(prepared.company, 0)
+            counts[prepared.company] = i + 1
+            on_position(prepared.company, normalize_position(pos, prepared.pre_detected, i == 0))
+
+    return on_delta
+
+
+def finish_company(prepared, final_positions, user_email):
+    """Build the company result from its final positions and memoize it."""
+    company_result = None
+    if final_positions:
+        company_result = {
+            "name": prepared.company,
+            "positions": final_positions,
+            "email_count": len(prepared.company_emails)
+        }
+
+    if prepared.use_memo:
+        message_store.put_company_result(user_email, prepared.company, prepared.digest, company_result)
+    return company_result
+
+
+def analyze_prepared(prepared, user_email, stats=None, on_position=None, cancel=None):
+    """
+    STEP 4 GPT call for one prepared company.
+    Returns (result, status, usage): result is None if nothing was found; status
+    is "empty", "reused" (same email set as the last analysis, GPT skipped),
+    "rules" (built by rules_extractor, GPT skipped), "analyzed" or "error"; usage is the prompt's token estimate and how many
+    emails fit in the budget (None when GPT was not called).
+    stats is the run's CallStats; on_position(company, position), if given,
+    receives each position while the answer is still streaming. cancel is the
+    job's CancelToken (cancelling aborts the GPT call and raises Cancelled).
+    """
+    if prepared.status:
+        return prepared.result, prepared.status, None
+
+    analysis_prompt = ANALYSIS_PROMPT.format(company=prepared.company, section=prepared.section(),
+                                             rules=ANALYSIS_RULES, schema=POSITIONS_SCHEMA)
+
+    usage = prepared.usage(estimate_tokens(ANALYSIS_SYSTEM_PROMPT) + estimate_tokens(analysis_prompt))
+
+    try:
+        analysis_text = cached_completion(
+            client,
+            model=MODEL,
+            messages=[
+                {"role": "system", "content": ANALYSIS_SYSTEM_PROMPT},
+                {"role": "user", "content": analysis_prompt}
+            ],
+            temperature=0.1,
+            timeout=LLM_TIMEOUT,
+            stats=stats,
+            on_delta=stream_positions([prepared], on_position),
+            cancel=cancel
+        )
+        final_positions = normalize_positions(extract_json(analysis_text), prepared.pre_detected)
+        company_result = finish_company(prepared, final_positions, user_email)
+    except Cancelled:
+        raise
+    except Exception as e:
+        print(f"  ❌ Error analyzing {prepared.company}: {e}")
+        return None, "error", usage
+
+    return company_result, "analyzed", usage
+
+
+def analyze_batch(batch, user_email, stats=None, on_position=None, cancel=None):
+    """
+    One GPT call for several small prepared companies, answered as a JSON object
+    keyed by company name. Returns a list of (result, status, usage) in batch
+    order; companies missing from the answer are analyzed on their own.
+    """
+    if len(batch) == 1:
+        return [analyze_prepared(batch[0], user_email, stats, on_position, cancel)]
+
+    names = ", ".join(f'"{p.company}"' for p in batch)
+    sections = "\n\n".join(f'=== COMPANY: "{p.company}" ===\n{p.section()}' for p in batch)
+    analysis_prompt = BATCH_ANALYSIS_PROMPT.format(names=names, sections=sections,
+                                                   rules=ANALYSIS_RULES, schema=POSITIONS_SCHEMA)
+
+    # Split the shared prompt's tokens across companies by the size of their emails
+    prompt_tokens = estimate_tokens(ANALYSIS_SYSTEM_PROMPT) + estimate_tokens(analysis_prompt)
+    email_tokens = sum(p.email_tokens for p in batch) or 1
+    usages = [p.usage(round(prompt_tokens * (p.email_tokens or 1) / email_tokens), len(batch)) for p in batch]
+
+    try:
+        analysis_text = cached_completion(
+            client,
+            model=MODEL,
+            messages=[
+                {"role": "system", "content": ANALYSIS_SYSTEM_PROMPT},
+                {"role": "user", "content": analysis_prompt}
+            ],
+            temperature=0.1,
+            timeout=LLM_TIMEOUT,
+            stats=stats,
+            on_delta=stream_positions(batch, on_position),
+            cancel=cancel
+        )
+        by_company = extract_company_results(analysis_text, [p.company for p in batch])
+    except Cancelled:
+        raise
+    except Exception as e:
+        print(f"  ❌ Error analyzing {names}: {e}")
+        return [(None, "error", usage) for usage in usages]
+
+    outcomes = []
+    for prepared, usage in zip(batch, usages):
+        if prepared.company not in by_company:
+            print(f"  ⚠️ {prepared.company} missing from batched answer, analyzing on its own")
+            outcomes.append(analyze_prepared(prepared, user_email, stats, on_position, cancel))
+            continue
+        try:
+            final_positions = normalize_positions(by_company[prepared.company], prepared.pre_detected)
+            outcomes.append((finish_company(prepared, final_positions, user_email), "analyzed", usage))
+        except Exception as e:
+            print(f"  ❌ Error analyzing {prepared.company}: {e}")
+            outcomes.append((None, "error", usage))
+    return outcomes
+
+
+def process_with_progress(start_date, end_date, progress_callback=None, user_email=None, since_history_id=None,
+                          position_callback=None, cancel=None, session_id=None):
     """
     Core processing logic that can emit progress events.
     progress_callback(step, message, data) is called at each stage.
-    Returns the final result.
+    position_callback(company, position), if given, is called with each position
+    as soon as it is known (GPT answers are then streamed); called from worker threads.
+    user_email enables the local message store (skip re-fetching known messages).
+    since_history_id switches to incremental sync: only inbox messages added
+    since that Gmail history id are processed (falls back to the date range
+    if the history id has expired).
+    cancel is the job's CancelToken, checked between pages and between
+    companies; in-flight GPT calls are aborted. Raises Cancelled.
+    session_id is the Render session (Gmail account) every fetch is made for.
+    Returns the final result, including the history id it is synced to.
     """
     def emit(step, message, data=None):
         if progress_callback:
@@ -675,11 +1389,12 @@ def process_with_progress(start_date, end_date, progress_callback=None):
 
     # Check auth
     try:
-        auth_resp = requests.get(f"{RENDER_URL}/status")
+        auth_resp = render_session.get(f"{RENDER_URL}/status", headers=session_headers(session_id), timeout=30)
         if not auth_resp.json().get("authenticated"):
+            forget_user_email(session_id)
             return {"error": "Not authenticated on Render", "authenticated": False}
     except Exception as e:
-        return {"error": f"Cannot reach Render: {e}"}
+        return {"error": f"Cannot reach Render: {e}", "upstream": True}
 
     try:
         # =========================
@@ -688,20 +1403,47 @@ def process_with_progress(start_date, end_date, progress_callback=None):
         emit(0, "Fetching email data...")
 
         # Build date filter for Gmail query
-        date_filter = ""
-        if start_date:
-            date_filter += f" after:{start_date.replace('-', '/')}"
-        if end_date:
-            date_filter += f" before:{end_date.replace('-', '/')}"
-
-        if not date_filter:
-            date_filter = " after:2025/06/06"
-
-        query = f'subject:("application" OR "applying" OR "apply" OR "applied") in:inbox{date_filter}'
-        all_emails = fetch_emails_from_render(query)
+        date_filter, open_ended = gmail_date_filter(start_date, end_date)
+
+        # Record the mailbox position before fetching so mail arriving mid-run is picked up next time.
+        # A date-range run only gets a sync point if its query reaches now; otherwise mail
+        # between its end date and now would never be fetched by later /changes refreshes
+        changes = fetch_changes_from_render(since_history_id, session_id, cancel) if since_history_id else None
+        if changes is None:
+            # Only a sync point for the next run: if Render can't give one, this run goes on
+            # without it and the next run does a date-range fetch
+            try:
+                current = fetch_changes_from_render(session_id=session_id, cancel=cancel) if open_ended else None
+            except RenderError as e:
+                print(f"  No history id for this run: {e}")
+                current = None
+            history_id = current.get("history_id") if current else None
+        else:
+            history_id = changes.get("history_id")
+
+        if changes is not None:
+            # Incremental sync: only messages added since the last run
+            new_ids = changes.get("message_ids", [])
+            inbox_emails = to_records(get_messages(new_ids, "metadata", user_email, cancel, session_id))
+            email_stream = (e for e in inbox_emails if JOB_SUBJECT_RE.search(e.subject))
+            emit(0, f"{len(inbox_emails)} new emails since last sync", {"new_email_count": len(inbox_emails)})
+        else:
+            inbox_emails = None
+            query = f'subject:("application" OR "applying" OR "apply" OR "applied") in:inbox{date_filter}'
+            email_stream = map(EmailRecord, iter_emails_from_render(query, format_type="metadata", user_email=user_email,
+                                                                    cancel=cancel, session_id=session_id))
+
+        # Dedup (STEP 2) runs on each page as it arrives, while the next page downloads
+        all_emails, seen, slim = [], set(), []
+        for m in email_stream:
+            all_emails.append(m)
+            key = (m.from_lower.strip(), m.subject_lower.strip())
+            if key[0] and key[1] and key not in seen:
+                seen.add(key)
+                slim.append(m)
 
         if not all_emails:
-            return {"companies": [], "total_companies": 0, "total_applications": 0}
+            return {"companies": [], "total_companies": 0, "total_applications": 0, "history_id": history_id}
 
         emit(0, f"Found {len(all_emails)} emails", {"email_count": len(all_emails)})
 
@@ -710,26 +1452,18 @@ def process_with_progress(start_date, end_date, progress_callback=None):
         # =========================
         emit(1, "Scanning for job applications...")
 
-        seen, slim = set(), []
-        for m in all_emails:
-            fe = (m.get("from_email") or "").strip()
-            sj = (m.get("subject") or "").strip()
-            key = (fe.lower(), sj.lower())
-            if fe and sj and key not in seen:
-                seen.add(key)
-                slim.append({"from_email": fe, "subject": sj})
-
         emit(1, f"Found {len(slim)} unique applications", {"application_count": len(slim)})
 
         # =========================
         # STEP 3: DETECT COMPANIES
         # =========================
         emit(2, "Detecting companies...")
+        llm_stats = CallStats()
 
         lines = []
         for m in slim[:100]:
-            dom = clean_domain(m["from_email"])
-            subj = m["subject"][:160]
+            dom = m.domain
+            subj = m.subject.strip()[:160]
             lines.append(f"{dom} | {subj}")
 
         company_prompt = f"""Below are job-related emails as 'from_domain | subject'.
@@ -751,15 +1485,18 @@ Emails:
 {chr(10).join(lines)}
 ```"""
 
-        response = client.chat.completions.create(
+        company_text = cached_completion(
+            client,
             model=MODEL,
             messages=[
                 {"role": "system", "content": "You extract company names from job application emails."},
                 {"role": "user", "content": company_prompt}
-            ]
+            ],
+            stats=llm_stats,
+            cancel=cancel
         )
 
-        companies_raw = extract_json(response.choices[0].message.content or "").get("companies_applied", [])
+        companies_raw = extract_json(company_text).get("companies_applied", [])
 
         clean_prompt = f"""Clean this list of company names:
 
@@ -771,15 +1508,18 @@ Emails:
 Input: {companies_raw}
 Output JSON: {{"clean_companies": ["Company1", "Company2", ...]}}"""
 
-        resp2 = client.chat.completions.create(
+        clean_text = cached_completion(
+            client,
             model=MODEL,
             messages=[
                 {"role": "system", "content": "You clean and deduplicate company names."},
                 {"role": "user", "content": clean_prompt}
-            ]
+            ],
+            stats=llm_stats,
+            cancel=cancel
         )
 
-        companies = extract_json(resp2.choices[0].message.content or "").get("clean_companies", companies_raw)
+        companies = extract_json(clean_text).get("clean_companies", companies_raw)
         companies = companies[:15]  # Limit to 15
 
         emit(2, f"Detected {len(companies)} companies", {"companies": companies, "company_count": len(companies)})
@@ -787,142 +1527,107 @@ Output JSON: {{"clean_companies": ["Company1", "Company2", ...]}}"""
         # =========================
         # STEP 4: AI ANALYZING (per company)
         # =========================
-        results = []
+        results_by_idx = {}
+        status_counts = {"analyzed": 0, "reused": 0, "rules": 0, "empty": 0, "error": 0}
+        prompt_tokens_total = 0
         total_companies = len(companies)
+        emit(3, f"AI analyzing {total_companies} companies...", {
+            "progress": 0,
+            "total": total_companies
+        })
 
-        for idx, company in enumerate(companies):
-            emit(3, f"AI analyzing {company}... ({idx + 1}/{total_companies})", {
-                "current_company": company,
-                "progress": idx + 1,
-                "total": total_companies
+        def record(idx, result, status, usage):
+            nonlocal prompt_tokens_total
+            results_by_idx[idx] = result
+            # GPT positions were already passed on while streaming
+            if position_callback and result and status in ("reused", "rules"):
+                for position in result["positions"]:
+                    position_callback(companies[idx], position)
+            status_counts[status] += 1
+            usage = usage or {"prompt_tokens": 0, "emails_in_prompt": 0, "emails_total": 0, "batched_with": 0, "rules_confidence": None}
+            prompt_tokens_total += usage["prompt_tokens"]
+            done = len(results_by_idx)
+            verb = {"reused": "Reused previous analysis for", "rules": "Extracted from email rules:"}.get(status, "AI analyzed")
+            emit(3, f"{verb} {companies[idx]} ({done}/{total_companies})", {
+                "current_company": companies[idx],
+                "company_status": status,
+                "progress": done,
+                "total": total_companies,
+                "analyzed": status_counts["analyzed"],
+                "reused": status_counts["reused"],
+                "rules": status_counts["rules"],
+                **usage,
+                "prompt_tokens_total": prompt_tokens_total
             })
 
-            company_query = build_strict_query(company, all_emails, date_filter)
-            company_raw_emails = fetch_emails_from_render(company_query)
-            company_emails = validate_emails_for_company(company, company_raw_emails)
-
-            if not company_emails:
-                continue
-
-            filtered = [e for e in company_emails if not should_skip(e)]
-            filtered.sort(key=lambda x: parse_date(x.get("date", "")) or "9999")
-            unique = deduplicate_emails(filtered)
-
-            if not unique:
-                continue
-
-            # Pre-detect stages
-            pre_detected = {
-                "application_submitted": None,
-                "aptitude_test": None,
-                "simulation_test": None,
-                "coding_test": None,
-                "video_interview": None,
-                "human_interview_dates": [],
-                "rejection": None,
-                "offer": None,
+        # Companies are independent, so prepare and analyze them concurrently; results keep company order.
+        # With batching on, small companies wait until ANALYSIS_BATCH_SIZE of them can share one GPT call.
+        with ThreadPoolExecutor(max_workers=ANALYSIS_WORKERS) as pool:
+            pending = {
+                pool.submit(prepare_company, company, all_emails, inbox_emails, date_filter, user_email, cancel,
+                            session_id): ("prepare", [idx])
+                for idx, company in enumerate(companies)
             }
+            preparing = len(pending)
+            batch = []
+
+            def submit_batch():
+                pending[pool.submit(analyze_batch, [p for _, p in batch], user_email, llm_stats,
+                                    position_callback, cancel)] = ("analyze", [i for i, _ in batch])
+                batch.clear()
+
+            while pending:
+                finished, _ = wait(pending, timeout=1, return_when=FIRST_COMPLETED)
+                if cancel is not None and cancel.cancelled:
+                    # Companies not started yet are dropped; running ones stop at their next check
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    cancel.check()
+                for future in finished:
+                    kind, idxs = pending.pop(future)
+                    try:
+                        outcome = future.result()
+                    except Exception as e:
+                        print(f"  ❌ Error analyzing {', '.join(companies[i] for i in idxs)}: {e}")
+                        for idx in idxs:
+                            record(idx, None, "error", None)
+                        preparing -= kind == "prepare"
+                        continue
+
+                    if kind == "analyze":
+                        for idx, (result, status, usage) in zip(idxs, outcome):
+                            record(idx, result, status, usage)
+                        continue
+
+                    preparing -= 1
+                    prepared = outcome
+                    if prepared.status == "rules":
+                        record(idxs[0], prepared.result, "rules", prepared.usage(0, 0))
+                    elif prepared.status:
+                        record(idxs[0], prepared.result, prepared.status, None)
+                    elif ANALYSIS_BATCH_SIZE > 1 and prepared.email_tokens <= ANALYSIS_BATCH_TOKENS:
+                        batch.append((idxs[0], prepared))
+                        if len(batch) >= ANALYSIS_BATCH_SIZE:
+                            submit_batch()
+                    else:
+                        pending[pool.submit(analyze_batch, [prepared], user_email, llm_stats, position_callback,
+                                            cancel)] = ("analyze", idxs)
+
+                # Every company is prepared: send the last, partly filled batch
+                if not preparing and batch:
+                    submit_batch()
+
+        metrics = {
+            **status_counts,
+            "prompt_tokens": prompt_tokens_total,
+            "llm_requests": llm_stats.requests,
+            "llm_cache_hits": llm_stats.cache_hits,
+            "llm_calls": llm_stats.llm_calls,
+            "rules_confidence_threshold": RULES_CONFIDENCE
+        }
+        emit(3, f"Analyzed {status_counts['analyzed']} companies, reused {status_counts['reused']} unchanged, "
+                f"{status_counts['rules']} from rules ({llm_stats.llm_calls} GPT calls, ~{prompt_tokens_total} prompt tokens)", metrics)
 
-            for email in unique:
-                date = parse_date(email.get("date", ""))
-                stages = detect_stages(email)
-                for stage in stages:
-                    if stage == "human_interview":
-                        if date and date not in pre_detected["human_interview_dates"]:
-                            pre_detected["human_interview_dates"].append(date)
-                    elif stage in pre_detected:
-                        if date and pre_detected[stage] is None:
-                            pre_detected[stage] = date
-
-            compact_text = format_compact(unique[:15])
-
-            pre_detected_hints = []
-            if pre_detected["rejection"]:
-                pre_detected_hints.append(f"REJECTION detected on {pre_detected['rejection']}")
-            if pre_detected["offer"]:
-                pre_detected_hints.append(f"OFFER detected on {pre_detected['offer']}")
-            pre_hint_str = "\n".join(pre_detected_hints) if pre_detected_hints else ""
-
-            analysis_prompt = f"""Analyze job application emails for "{company}".
-
-EMAILS (date | sender | subject [pre-detected stages]):
-{compact_text}
-
-{f"PRE-DETECTED STATUS: {pre_hint_str}" if pre_hint_str else ""}
-
-CRITICAL RULES:
-1. POSITION: Extract the actual JOB TITLE (e.g., "Graduate Software Engineer", "Analyst Program 2026", "Data Scientist").
-   - Look for patterns like "applying for [POSITION]", "application for [POSITION]", "Thank you for applying to [POSITION]"
-   - NEVER use generic phrases like "Thank you for your application", "We've received your application", "role at X"
-
-2. MULTIPLE POSITIONS: If the candidate applied to MULTIPLE different positions at this company, return ALL of them as separate entries in the "positions" array. Each position should have its own timeline and status.
-
-3. "video_interview" = ONE-WAY pre-recorded video (HireVue, Willo) only. Phone calls and live video calls are human_interviews.
-
-4. Count human interviews: same event on same day = 1, different days = multiple. "Super Day" = 1 event.
-
-5. "status": For EACH position separately - "rejected" if that specific position was rejected, "offer" if offered, "pending" otherwise.
-
-OUTPUT JSON only (array of positions):
-{{"positions":[{{"position":"Job Title","applied":"YYYY-MM-DD","aptitude_test":"YYYY-MM-DD or null","simulation_test":"YYYY-MM-DD or null","coding_test":"YYYY-MM-DD or null","video_interview":"YYYY-MM-DD or null","human_interviews":N,"status":"pending|rejected|offer"}}]}}"""
-
-            try:
-                analysis = client.chat.completions.create(
-                    model=MODEL,
-                    messages=[
-                        {"role": "system", "content": "You are a precise job application timeline extractor. Output valid JSON only."},
-                        {"role": "user", "content": analysis_prompt}
-                    ],
-                    temperature=0.1
-                )
-
-                result = extract_json(analysis.choices[0].message.content or "")
-                positions = result.get("positions", [])
-
-                if not positions and result.get("position"):
-                    positions = [result]
-
-                if not positions:
-                    continue
-
-                final_positions = []
-                for i, pos in enumerate(positions):
-                    position_name = pos.get("position", "")
-                    if any(bad in position_name.lower() for bad in BAD_POSITION_PATTERNS):
-                        position_name = ""
-
-                    use_predetected = (i == 0)
-
-                    final_pos = {
-                        "position": position_name,
-                        "application_submitted": pos.get("applied") or (pre_detected["application_submitted"] if use_predetected else None),
-                        "aptitude_test": pos.get("aptitude_test") if pos.get("aptitude_test") not in [None, "null", ""] else (pre_detected["aptitude_test"] if use_predetected else None),
-                        "simulation_test": pos.get("simulation_test") if pos.get("simulation_test") not in [None, "null", ""] else (pre_detected["simulation_test"] if use_predetected else None),
-                        "coding_test": pos.get("coding_test") if pos.get("coding_test") not in [None, "null", ""] else (pre_detected["coding_test"] if use_predetected else None),
-                        "video_interview": pos.get("video_interview") if pos.get("video_interview") not in [None, "null", ""] else (pre_detected["video_interview"] if use_predetected else None),
-                        "num_human_interview": str(pos.get("human_interviews", 0) or (len(pre_detected["human_interview_dates"]) if use_predetected else 0)),
-                        "app_accepted": (
-                            "y" if pos.get("status") == "offer" else
-                            ("n" if pos.get("status") == "rejected" else None)
-                        )
-                    }
-
-                    for key in final_pos:
-                        if final_pos[key] == "null":
-                            final_pos[key] = None
-
-                    final_positions.append(final_pos)
-
-                if final_positions:
-                    results.append({
-                        "name": company,
-                        "positions": final_positions,
-                        "email_count": len(company_emails)
-                    })
-
-            except Exception as e:
-                print(f"  ❌ Error analyzing {company}: {e}")
-                continue
+        results = [results_by_idx[idx] for idx in sorted(results_by_idx) if results_by_idx[idx]]
 
         # =========================
         # STEP 5: CLASSIFYING
@@ -942,9 +1647,17 @@ OUTPUT JSON only (array of positions):
             "companies": results,
             "total_companies": len(results),
             "total_applications": total_applications,
-            "from_cache": False
+            "from_cache": False,
+            "history_id": history_id,
+            "metrics": metrics
         }
 
+    except Cancelled:
+        print("  ⏹️ Cancelled")
+        raise
+    except RenderError as e:
+        print(f"Error: {e}")
+        return {"error": f"Render request failed: {e}", "upstream": True}
     except Exception as e:
         print(f"Error: {e}")
         import traceback
@@ -952,15 +1665,35 @@ OUTPUT JSON only (array of positions):
         return {"error": str(e)}
 
 
-@app.route('/process-stream')
-def process_stream():
-    """
-    SSE endpoint for real-time progress updates during email processing.
-    Uses incremental caching - only fetches dates not already in cache.
-    """
-    start_date = request.args.get('start_date')
-    end_date = request.args.get('end_date')
-    force_refresh = request.args.get('refresh', '').lower() == 'true'
+# =========================
+# PROCESSING JOBS
+# =========================
+# Each processing run is a background job: POST /jobs returns its id at once,
+# and /jobs/<id>/events streams its events to any number of clients, who can
+# reattach after a reload without starting a second run.
+# Identical requests (same session, user, date range and refresh flag) while a job is
+# in flight join that job; other runs for the same user wait their turn (queued
+# in the JobManager, not holding a worker), so each starts from the cache the
+# previous one saved instead of overwriting it.
+# Once every client has disconnected for JOB_DETACH_GRACE seconds the job is
+# cancelled: it stops fetching and its in-flight GPT calls are aborted.
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 2))
+JOB_QUEUE_LIMIT = int(os.environ.get("JOB_QUEUE_LIMIT", 16))
+JOB_KEEP_SECONDS = float(os.environ.get("JOB_KEEP_SECONDS", 600))
+JOB_DETACH_GRACE = float(os.environ.get("JOB_DETACH_GRACE", 5))
+SSE_HEARTBEAT = 60
+# A write to a closed connection is how a disconnect is noticed, so idle streams
+# send an SSE comment (ignored by EventSource) this often
+SSE_POLL = 1
+
+
+def job_params():
+    """Date range and refresh flag from the query string (or a JSON body)."""
+    body = request.get_json(silent=True) or {}
+    start_date = body.get('start_date') or request.args.get('start_date')
+    end_date = body.get('end_date') or request.args.get('end_date')
+    refresh = body.get('refresh', request.args.get('refresh', ''))
+    force_refresh = refresh is True or str(refresh).lower() == 'true'
 
     # Default: last 12 months if no dates specified
     if not start_date and not end_date:
@@ -968,10 +1701,22 @@ def process_stream():
         end_date = datetime.now().strftime("%Y-%m-%d")
         start_date = (datetime.now() - timedelta(days=365)).strftime("%Y-%m-%d")
 
-    user_email = get_user_email()
+    return {"start_date": start_date, "end_date": end_date, "refresh": force_refresh}
+
+
+def process_job(job):
+    """
+    The full pipeline for one request, using incremental caching - only
+    fetches dates not already in cache. Emits progress/position events
+    (or a single "cached" event) and returns the final result.
+    """
+    start_date = job.params["start_date"]
+    end_date = job.params["end_date"]
+    force_refresh = job.params["refresh"]
+    user_email = job.user_email
 
     print(f"\n{'='*60}")
-    print(f"📥 /process-stream SSE REQUEST")
+    print(f"📥 PROCESSING JOB {job.id}")
     print(f"   user: '{user_email}'")
     print(f"   start_date: '{start_date}'")
     print(f"   end_date: '{end_date}'")
@@ -1002,13 +1747,8 @@ def process_stream():
                 "latest": cached_data.get("latest_date")
             }
         }
-
-        def generate_cached():
-            yield f"data: {json.dumps({'type': 'cached', 'data': cached_response})}\n\n"
-            yield f"data: {json.dumps({'type': 'done', 'data': cached_response})}\n\n"
-
-        return Response(generate_cached(), mimetype='text/event-stream',
-                       headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+        job.emit({"type": "cached", "data": cached_response})
+        return cached_response
 
     # Determine what dates to fetch
     if coverage_type == "extend_earlier":
@@ -1022,148 +1762,18 @@ def process_stream():
         fetch_start = start_date
         fetch_end = end_date
 
-    def generate():
-        progress_queue = queue.Queue()
-
-        def progress_callback(step, message, data):
-            progress_queue.put({
-                "type": "progress",
-                "step": step,
-                "message": message,
-                "data": data
-            })
-
-        result_holder = [None]
+    since_history_id = history_sync_start(cached_data, coverage_type, fetch_end)
 
-        def run_processing():
-            result_holder[0] = process_with_progress(fetch_start, fetch_end, progress_callback)
-            progress_queue.put(None)  # Signal completion
+    def progress_callback(step, message, data):
+        job.emit({"type": "progress", "step": step, "message": message, "data": data})
 
-        thread = threading.Thread(target=run_processing)
-        thread.start()
-
-        while True:
-            try:
-                item = progress_queue.get(timeout=60)
-                if item is None:
-                    break
-                yield f"data: {json.dumps(item)}\n\n"
-            except queue.Empty:
-                yield f"data: {json.dumps({'type': 'heartbeat'})}\n\n"
-
-        thread.join()
-
-        result = result_holder[0]
-        if result and "error" not in result:
-            new_companies = result.get("companies", [])
-
-            # Merge with existing cache if applicable
-            if cached_data and coverage_type in ("extend_earlier", "extend_later"):
-                existing_companies = cached_data.get("companies", [])
-                merged_companies, total_cos, total_apps = merge_company_data(existing_companies, new_companies)
-
-                # Update date range
-                if coverage_type == "extend_earlier":
-                    new_earliest = fetch_start
-                    new_latest = cached_data.get("latest_date", fetch_end)
-                else:  # extend_later
-                    new_earliest = cached_data.get("earliest_date", fetch_start)
-                    new_latest = fetch_end
-
-                # Save merged cache
-                save_user_cache(user_email, new_earliest, new_latest, merged_companies, total_cos, total_apps)
-
-                result = {
-                    "companies": merged_companies,
-                    "total_companies": total_cos,
-                    "total_applications": total_apps,
-                    "from_cache": False,
-                    "incremental_update": True,
-                    "cached_range": {"earliest": new_earliest, "latest": new_latest}
-                }
-            else:
-                # Fresh cache
-                save_user_cache(
-                    user_email,
-                    start_date or fetch_start,
-                    end_date or fetch_end,
-                    new_companies,
-                    result.get("total_companies", 0),
-                    result.get("total_applications", 0)
-                )
-                result["cached_range"] = {"earliest": start_date, "latest": end_date}
-
-        yield f"data: {json.dumps({'type': 'done', 'data': result})}\n\n"
-
-    return Response(generate(), mimetype='text/event-stream',
-                   headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
-
-
-@app.route('/process')
-def process():
-    """
-    Main endpoint using EXACT logic from firstfilter.py + secondfilter.py
-    Uses incremental caching - only fetches dates not already in cache.
-    """
-    start_date = request.args.get('start_date')
-    end_date = request.args.get('end_date')
-    force_refresh = request.args.get('refresh', '').lower() == 'true'
-
-    # Default: last 12 months if no dates specified
-    if not start_date and not end_date:
-        from datetime import datetime, timedelta
-        end_date = datetime.now().strftime("%Y-%m-%d")
-        start_date = (datetime.now() - timedelta(days=365)).strftime("%Y-%m-%d")
-
-    user_email = get_user_email()
-
-    print(f"\n{'='*60}")
-    print(f"📥 /process REQUEST")
-    print(f"   user: '{user_email}'")
-    print(f"   start_date: '{start_date}'")
-    print(f"   end_date: '{end_date}'")
-    print(f"   refresh: {force_refresh}")
-    print(f"{'='*60}")
-
-    # Check cache coverage
-    coverage_result = check_cache_coverage(user_email, start_date, end_date)
-    coverage_type = coverage_result[0] if coverage_result else None
-    cached_data = coverage_result[1] if len(coverage_result) > 1 else None
-
-    # Handle refresh: fetch from cached_latest to today
-    if force_refresh and cached_data:
-        from datetime import datetime
-        fetch_start = cached_data.get("latest_date", start_date)
-        fetch_end = datetime.now().strftime("%Y-%m-%d")
-        coverage_type = "extend_later"
-    elif coverage_type == "full" and not force_refresh:
-        # Full cache hit
-        return jsonify({
-            "companies": cached_data.get("companies", []),
-            "total_companies": cached_data.get("total_companies", 0),
-            "total_applications": cached_data.get("total_applications", 0),
-            "from_cache": True,
-            "cached_range": {
-                "earliest": cached_data.get("earliest_date"),
-                "latest": cached_data.get("latest_date")
-            }
-        })
-
-    # Determine what dates to fetch
-    if coverage_type == "extend_earlier":
-        fetch_start = coverage_result[2]
-        fetch_end = coverage_result[3]
-    elif coverage_type == "extend_later":
-        fetch_start = coverage_result[2] if len(coverage_result) > 2 else cached_data.get("latest_date", start_date)
-        fetch_end = coverage_result[3] if len(coverage_result) > 3 else end_date
-    else:
-        fetch_start = start_date
-        fetch_end = end_date
-
-    result = process_with_progress(fetch_start, fetch_end)
+    def position_callback(company, position):
+        job.emit({"type": "position", "data": {"company": company, "position": position}})
 
+    result = process_with_progress(fetch_start, fetch_end, progress_callback, user_email, since_history_id,
+                                   position_callback, job.cancel_token, job.session_id)
     if "error" in result:
-        return jsonify(result), 500 if "Cannot reach" in result.get("error", "") else 401
+        return result
 
     new_companies = result.get("companies", [])
 
@@ -1172,41 +1782,184 @@ def process():
         existing_companies = cached_data.get("companies", [])
         merged_companies, total_cos, total_apps = merge_company_data(existing_companies, new_companies)
 
+        # Update date range
         if coverage_type == "extend_earlier":
             new_earliest = fetch_start
             new_latest = cached_data.get("latest_date", fetch_end)
-        else:
+        else:  # extend_later
             new_earliest = cached_data.get("earliest_date", fetch_start)
             new_latest = fetch_end
 
-        save_user_cache(user_email, new_earliest, new_latest, merged_companies, total_cos, total_apps)
+        # Save merged cache
+        history_id = history_id_to_save(result, cached_data, coverage_type, new_latest)
+        save_user_cache(user_email, new_earliest, new_latest, merged_companies, total_cos, total_apps, history_id)
 
-        return jsonify({
+        return {
             "companies": merged_companies,
             "total_companies": total_cos,
             "total_applications": total_apps,
             "from_cache": False,
             "incremental_update": True,
-            "cached_range": {"earliest": new_earliest, "latest": new_latest}
-        })
-    else:
-        # Fresh cache
-        save_user_cache(
-            user_email,
-            start_date or fetch_start,
-            end_date or fetch_end,
-            new_companies,
-            result.get("total_companies", 0),
-            result.get("total_applications", 0)
-        )
+            "cached_range": {"earliest": new_earliest, "latest": new_latest},
+            "metrics": result.get("metrics")
+        }
 
-        return jsonify({
-            "companies": new_companies,
-            "total_companies": result.get("total_companies", 0),
-            "total_applications": result.get("total_applications", 0),
-            "from_cache": False,
-            "cached_range": {"earliest": start_date, "latest": end_date}
-        })
+    # Fresh cache
+    save_user_cache(
+        user_email,
+        start_date or fetch_start,
+        end_date or fetch_end,
+        new_companies,
+        result.get("total_companies", 0),
+        result.get("total_applications", 0),
+        history_id_to_save(result, None, coverage_type, end_date or fetch_end)
+    )
+
+    return {
+        "companies": new_companies,
+        "total_companies": result.get("total_companies", 0),
+        "total_applications": result.get("total_applications", 0),
+        "from_cache": False,
+        "cached_range": {"earliest": start_date, "latest": end_date},
+        "metrics": result.get("metrics")
+    }
+
+
+job_manager = JobManager(process_job, JobStore(), max_workers=JOB_WORKERS, max_queued=JOB_QUEUE_LIMIT,
+                         keep_seconds=JOB_KEEP_SECONDS, detach_grace=JOB_DETACH_GRACE)
+
+
+def job_event_stream(job, seen=0):
+    """SSE response replaying a job's events after the first `seen`, then following it live.
+    Each event carries its sequence number as the SSE id, so EventSource
+    reconnects resume where they left off (Last-Event-ID).
+    The stream counts as one of the job's clients until it ends or the browser disconnects."""
+    def generate():
+        job_manager.attach(job)
+        try:
+            sent, idle = seen, 0
+            while True:
+                events, done = job.events_after(sent, SSE_POLL)
+                for event in events:
+                    sent += 1
+                    yield f"id: {sent}\ndata: {json.dumps(event)}\n\n"
+                if done and sent >= len(job.events):
+                    break
+                if events:
+                    idle = 0
+                    continue
+                idle += SSE_POLL
+                if idle >= SSE_HEARTBEAT:
+                    idle = 0
+                    yield f"data: {json.dumps({'type': 'heartbeat'})}\n\n"
+                else:
+                    yield ": keep-alive\n\n"
+        finally:
+            # Also runs when the client disconnects (the next write fails and the generator is closed)
+            job_manager.detach(job)
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no', 'X-Job-Id': job.id})
+
+
+def submit_job():
+    """Start a processing job for the current request; returns (job, None) or (None, error response)."""
+    try:
+        session_id = request_session_id()
+        user_email = get_user_email(session_id)
+        if not is_known_user(user_email):
+            # Without a real identity there is no safe cache key to read or save under
+            if session_id is None:
+                return None, (jsonify({"error": "Not authenticated", "authenticated": False}), 401)
+            return None, (jsonify({"error": "Could not identify the Gmail account on Render, try again shortly"}),
+                          503, {"Retry-After": "5"})
+        return job_manager.submit(user_email, job_params(), session_id), None
+    except JobQueueFull:
+        return None, (jsonify({"error": "Too many processing jobs queued, try again shortly"}), 429)
+
+
+@app.route('/jobs', methods=['POST'])
+def create_job():
+    """Start processing in the background; returns the job id to follow at /jobs/<id>/events."""
+    job, error = submit_job()
+    if error:
+        return error
+    return jsonify(job.summary()), 202
+
+
+@app.route('/jobs/<job_id>')
+def get_job(job_id):
+    """Job status, last progress event and (once finished) its result."""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job.summary())
+
+
+@app.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    """SSE stream of a job's events; send Last-Event-ID (or ?after=N) to skip events already seen."""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    seen = request.headers.get('Last-Event-ID') or request.args.get('after') or 0
+    try:
+        seen = max(int(seen), 0)
+    except ValueError:
+        seen = 0
+    return job_event_stream(job, seen)
+
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    """Stop a queued or running job."""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    if not job.done:
+        job_manager.cancel(job)
+    return jsonify(job.summary())
+
+
+@app.route('/process-stream')
+def process_stream():
+    """
+    SSE endpoint for real-time progress updates during email processing.
+    Starts a job and streams its events (the job id is in the X-Job-Id header).
+    """
+    job, error = submit_job()
+    if error:
+        return error
+    return job_event_stream(job)
+
+
+@app.route('/process')
+def process():
+    """
+    Main endpoint using EXACT logic from firstfilter.py + secondfilter.py
+    Runs a job and waits for its result.
+    """
+    job, error = submit_job()
+    if error:
+        return error
+    job_manager.attach(job)
+    try:
+        result = job.wait()
+    finally:
+        job_manager.detach(job)
+
+    if "error" in result:
+        # 401 only when Render says the session is logged out (the frontend treats it as a logout)
+        if result.get("cancelled"):
+            status = 409
+        elif result.get("authenticated") is False:
+            status = 401
+        elif result.get("upstream"):
+            status = 502
+        else:
+            status = 500
+        return jsonify(result), status
+    return jsonify(result)
 
 
 # =========================
@@ -1243,46 +1996,20 @@ def add_application():
         if not company_name:
             return jsonify({"error": "Company name is required"}), 400
 
-        user_email = get_user_email()
+        user_email = get_user_email(request_session_id())
         if user_email == "unknown":
             return jsonify({"error": "Not authenticated"}), 401
 
-        cache = load_cache()
-        user_cache = cache.get(user_email, {})
-        companies = user_cache.get("companies", [])
-
         # Mark position as manually added
         position_data["manual"] = True
 
-        # Check if company exists
-        company_found = False
-        for company in companies:
-            if company["name"].lower() == company_name.lower():
-                company["positions"].append(position_data)
-                company_found = True
-                break
-
-        if not company_found:
-            # Add new company marked as manual
-            companies.append({
-                "name": company_name,
-                "positions": [position_data],
-                "email_count": 0,
-                "manual": True
-            })
+        # Append to the company (or create it, marked as manual) in one transaction
+        companies = cache_store.add_position(user_email, company_name, position_data)
 
         # Update totals
         total_companies = len(companies)
         total_applications = sum(len(c["positions"]) for c in companies)
 
-        # Save cache
-        user_cache["companies"] = companies
-        user_cache["total_companies"] = total_companies
-        user_cache["total_applications"] = total_applications
-        user_cache["timestamp"] = time.time()
-        cache[user_email] = user_cache
-        save_cache(cache)
-
         return jsonify({
             "success": True,
             "companies": companies,
@@ -1332,50 +2059,30 @@ def update_application():
         if not company_name:
             return jsonify({"error": "Company name is required"}), 400
 
-        user_email = get_user_email()
+        user_email = get_user_email(request_session_id())
         if user_email == "unknown":
             return jsonify({"error": "Not authenticated"}), 401
 
-        cache = load_cache()
-        user_cache = cache.get(user_email, {})
-        companies = user_cache.get("companies", [])
-
-        # Find company
-        company_idx = None
-        for idx, company in enumerate(companies):
-            if company["name"].lower() == company_name.lower():
-                company_idx = idx
-                break
-
-        if company_idx is None:
-            return jsonify({"error": f"Company '{company_name}' not found"}), 404
-
-        # Update company name if requested
-        if new_company_name:
-            companies[company_idx]["name"] = new_company_name
-
-        # Update position if provided
         if position_data is not None and position_index is not None:
-            if position_index < 0 or position_index >= len(companies[company_idx]["positions"]):
-                return jsonify({"error": "Invalid position index"}), 400
-
-            # Preserve manual flag if it was set, or mark as edited
-            was_manual = companies[company_idx]["positions"][position_index].get("manual", False)
             position_data["manual"] = True  # Mark as manually edited
-            companies[company_idx]["positions"][position_index] = position_data
+
+        # Rename and/or replace the position in one transaction
+        try:
+            companies = cache_store.update_company(
+                user_email, company_name,
+                new_company_name=new_company_name,
+                position_index=position_index,
+                position=position_data
+            )
+        except CompanyNotFound:
+            return jsonify({"error": f"Company '{company_name}' not found"}), 404
+        except InvalidPositionIndex:
+            return jsonify({"error": "Invalid position index"}), 400
 
         # Update totals
         total_companies = len(companies)
         total_applications = sum(len(c["positions"]) for c in companies)
 
-        # Save cache
-        user_cache["companies"] = companies
-        user_cache["total_companies"] = total_companies
-        user_cache["total_applications"] = total_applications
-        user_cache["timestamp"] = time.time()
-        cache[user_email] = user_cache
-        save_cache(cache)
-
         return jsonify({
             "success": True,
             "companies": companies,
@@ -1412,50 +2119,22 @@ def delete_application():
         if not company_name:
             return jsonify({"error": "Company name is required"}), 400
 
-        user_email = get_user_email()
+        user_email = get_user_email(request_session_id())
         if user_email == "unknown":
             return jsonify({"error": "Not authenticated"}), 401
 
-        cache = load_cache()
-        user_cache = cache.get(user_email, {})
-        companies = user_cache.get("companies", [])
-
-        # Find company
-        company_idx = None
-        for idx, company in enumerate(companies):
-            if company["name"].lower() == company_name.lower():
-                company_idx = idx
-                break
-
-        if company_idx is None:
+        # Delete the position (dropping the company once empty) or the whole company
+        try:
+            companies = cache_store.delete(user_email, company_name, position_index)
+        except CompanyNotFound:
             return jsonify({"error": f"Company '{company_name}' not found"}), 404
-
-        if position_index is not None:
-            # Delete specific position
-            if position_index < 0 or position_index >= len(companies[company_idx]["positions"]):
-                return jsonify({"error": "Invalid position index"}), 400
-
-            companies[company_idx]["positions"].pop(position_index)
-
-            # If no positions left, remove the company
-            if len(companies[company_idx]["positions"]) == 0:
-                companies.pop(company_idx)
-        else:
-            # Delete entire company
-            companies.pop(company_idx)
+        except InvalidPositionIndex:
+            return jsonify({"error": "Invalid position index"}), 400
 
         # Update totals
         total_companies = len(companies)
         total_applications = sum(len(c["positions"]) for c in companies)
 
-        # Save cache
-        user_cache["companies"] = companies
-        user_cache["total_companies"] = total_companies
-        user_cache["total_applications"] = total_applications
-        user_cache["timestamp"] = time.time()
-        cache[user_email] = user_cache
-        save_cache(cache)
-
         return jsonify({
             "success": True,
             "companies": companies,
@@ -1474,7 +2153,7 @@ def delete_application():
 def get_applications():
     """Get all applications for the current user from cache."""
     try:
-        user_email = get_user_email()
+        user_email = get_user_email(request_session_id())
         if user_email == "unknown":
             return jsonify({"error": "Not authenticated"}), 401
 
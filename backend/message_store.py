@@ -0,0 +1,135 @@
+"""
+Persistent per-user message store for the local processing server.
+- SQLite file keyed by (user_email, Gmail message id)
+- Holds the same {id, subject, date, from_email, body} records Render returns
+- Metadata-only records are upgraded in place once their body is fetched
+- Per-company analysis results, keyed by a digest of the company's email ids
+"""
+import os
+import json
+import time
+import sqlite3
+import threading
+
+STORE_FILE = os.path.join(os.path.dirname(__file__), "messages.db")
+
+
+class MessageStore:
+    """Thread-safe SQLite store of Gmail message records."""
+
+    def __init__(self, path=STORE_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS messages (
+                user_email TEXT NOT NULL,
+                message_id TEXT NOT NULL,
+                subject TEXT,
+                from_email TEXT,
+                date TEXT,
+                body TEXT,
+                has_body INTEGER NOT NULL DEFAULT 0,
+                fetched_at REAL,
+                PRIMARY KEY (user_email, message_id)
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS company_results (
+                user_email TEXT NOT NULL,
+                company TEXT NOT NULL,
+                digest TEXT NOT NULL,
+                result TEXT,
+                updated_at REAL,
+                PRIMARY KEY (user_email, company)
+            )
+        """)
+        self._conn.commit()
+
+    def get_many(self, user_email, message_ids, require_body=False):
+        """Return {message_id: record} for the ids already stored.
+        With require_body=True, metadata-only records are treated as missing."""
+        found = {}
+        ids = list(message_ids)
+        with self._lock:
+            # SQLite caps bound parameters, so look ids up in chunks
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT message_id, subject, from_email, date, body, has_body FROM messages "
+                    f"WHERE user_email = ? AND message_id IN ({placeholders})",
+                    [user_email, *chunk]
+                ).fetchall()
+                for message_id, subject, from_email, date, body, has_body in rows:
+                    if require_body and not has_body:
+                        continue
+                    found[message_id] = {
+                        "id": message_id,
+                        "subject": subject,
+                        "date": date,
+                        "from_email": from_email,
+                        "body": body or "",
+                    }
+        return found
+
+    def put_many(self, user_email, records, has_body=True):
+        """Insert or update records. A stored body is never replaced by a metadata-only record."""
+        now = time.time()
+        rows = [
+            (user_email, r["id"], r.get("subject", ""), r.get("from_email", ""),
+             r.get("date", ""), r.get("body", "") if has_body else "", int(has_body), now)
+            for r in records if r.get("id")
+        ]
+        with self._lock:
+            self._conn.executemany("""
+                INSERT INTO messages (user_email, message_id, subject, from_email, date, body, has_body, fetched_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (user_email, message_id) DO UPDATE SET
+                    subject = excluded.subject,
+                    from_email = excluded.from_email,
+                    date = excluded.date,
+                    body = CASE WHEN excluded.has_body THEN excluded.body ELSE messages.body END,
+                    has_body = MAX(messages.has_body, excluded.has_body),
+                    fetched_at = excluded.fetched_at
+            """, rows)
+            self._conn.commit()
+
+    def get_company_result(self, user_email, company, digest):
+        """Return (True, result) if the company was analyzed with this exact email-set digest.
+        result may be None (the analysis found no positions)."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT result FROM company_results WHERE user_email = ? AND company = ? AND digest = ?",
+                (user_email, company.lower(), digest)
+            ).fetchone()
+        if row is None:
+            return False, None
+        return True, json.loads(row[0]) if row[0] else None
+
+    def put_company_result(self, user_email, company, digest, result):
+        """Remember a company's analysis result for its current email-set digest."""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO company_results (user_email, company, digest, result, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (user_email, company.lower(), digest, json.dumps(result) if result else None, time.time())
+            )
+            self._conn.commit()
+
+    def count(self, user_email):
+        """Number of stored messages for a user."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM messages WHERE user_email = ?", (user_email,)
+            ).fetchone()[0]
+
+    def clear(self, user_email=None):
+        """Delete stored messages and company results for one user, or for everyone."""
+        with self._lock:
+            for table in ("messages", "company_results"):
+                if user_email is None:
+                    self._conn.execute(f"DELETE FROM {table}")
+                else:
+                    self._conn.execute(f"DELETE FROM {table} WHERE user_email = ?", (user_email,))
+            self._conn.commit()
@@ -0,0 +1,125 @@
+"""
+Token-budgeted packing of a company's emails into the STEP 4 analysis prompt.
+Used by local_server.py.
+
+Instead of a fixed "first 15 emails, 300 body characters each", emails are
+ranked by how much they tell GPT and packed into a token budget:
+1. emails that bring a stage not seen yet (application, tests, interviews, outcome)
+2. emails on a date not covered yet
+3. the rest, oldest first
+Every ranked email gets its header line while it fits; the remaining budget
+then goes to bodies, in the same order. Lines stay in chronological order.
+
+Token counts come from tiktoken when it is installed, otherwise from a local
+estimate (about one token per short word or punctuation mark).
+"""
+import re
+
+# Encoding used by gpt-4o / gpt-4o-mini
+TIKTOKEN_ENCODING = "o200k_base"
+
+WORD_RE = re.compile(r"\w+|[^\w\s]")
+
+_encoding = None
+
+
+def _get_encoding():
+    """tiktoken encoding, or False if tiktoken (or its encoding file) is unavailable."""
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding(TIKTOKEN_ENCODING)
+        except Exception:
+            _encoding = False
+    return _encoding
+
+
+def estimate_tokens(text):
+    """Approximate number of tokens GPT will see for text."""
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding:
+        return len(encoding.encode(text))
+    # Long words split into several tokens, roughly every 5 characters
+    return sum((len(w) + 4) // 5 for w in WORD_RE.findall(text))
+
+
+def truncate_to_tokens(text, max_tokens):
+    """Longest prefix of text that fits in max_tokens."""
+    if max_tokens <= 0:
+        return ""
+    encoding = _get_encoding()
+    if encoding:
+        tokens = encoding.encode(text)
+        return text if len(tokens) <= max_tokens else encoding.decode(tokens[:max_tokens])
+    used = 0
+    for match in WORD_RE.finditer(text):
+        used += (len(match.group(0)) + 4) // 5
+        if used > max_tokens:
+            return text[:match.start()].rstrip()
+    return text
+
+
+def rank_emails(emails):
+    """Indexes of emails (chronological, with .stages and .date_parsed), most informative first."""
+    ranked, placed = [], set()
+    seen_stages, seen_dates = set(), set()
+
+    for i, email in enumerate(emails):
+        if set(email.stages) - seen_stages:
+            ranked.append(i)
+            placed.add(i)
+            seen_stages.update(email.stages)
+            seen_dates.add(email.date_parsed)
+    for i, email in enumerate(emails):
+        if i not in placed and email.date_parsed not in seen_dates:
+            ranked.append(i)
+            placed.add(i)
+            seen_dates.add(email.date_parsed)
+    ranked.extend(i for i in range(len(emails)) if i not in placed)
+    return ranked
+
+
+def pack_emails(emails, budget, format_header, body_text, body_chars):
+    """
+    Pick and format emails to fit `budget` tokens.
+    format_header(email) -> header line; body_text(email) -> cleaned body.
+    Returns (text, tokens_used, emails_included).
+    """
+    ranked = rank_emails(emails)
+    headers = {}
+    used = 0
+
+    for i in ranked:
+        header = format_header(emails[i])
+        cost = estimate_tokens(header) + 1  # + newline
+        if used + cost > budget:
+            continue
+        headers[i] = header
+        used += cost
+
+    bodies = {}
+    prefix = "\n   Body: "
+    prefix_cost = estimate_tokens(prefix)
+    ellipsis_cost = estimate_tokens("...")
+    for i in ranked:
+        if i not in headers:
+            continue
+        body = body_text(emails[i])
+        if not body:
+            continue
+        room = budget - used - prefix_cost - ellipsis_cost
+        if room <= 0:
+            break
+        clipped = truncate_to_tokens(body[:body_chars], room)
+        if not clipped:
+            continue
+        if len(clipped) < len(body):
+            clipped += "..."
+        bodies[i] = clipped
+        used += prefix_cost + estimate_tokens(clipped)
+
+    lines = [headers[i] + (prefix + bodies[i] if i in bodies else "") for i in sorted(headers)]
+    return "\n".join(lines), used, len(headers)
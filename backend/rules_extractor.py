@@ -0,0 +1,102 @@
+"""
+Rules-first STEP 4 extraction, used by local_server.py before asking GPT.
+
+For many companies the stage pre-detection already has the application date,
+the tests and the outcome, and GPT only echoes them back. When the subjects
+also name exactly one position ("Thank you for applying for Summer Analyst
+2026"), the position is built from the rules alone.
+
+Confidence (0-1) starts at 1 and drops for what GPT would judge better:
+- no position title, or several different ones  -> 0 (always GPT)
+- both a rejection and an offer                  -> 0
+- no application date                            -> -0.3
+- each application email after the first         -> -0.3 (several
+  applications are probably several positions, merged into one here)
+- human interviews (counting them needs context) -> -0.3
+- each email no stage pattern recognised         -> -0.1
+"""
+import re
+
+TITLE_PATTERNS = [re.compile(p, re.IGNORECASE) for p in (
+    r"\b(?:applying|application|applied)\s+for\s+(?:the\s+)?(?:(?:position|role)\s+of\s+)?(?P<title>.+)",
+    r"\b(?:position|role|job title)\s*:\s*(?P<title>.+)",
+)]
+# Everything after " at ", " with ", " - ", "|", "(" etc. is the company, location or requisition
+TITLE_TAIL_RE = re.compile(r"\s+(?:at|with|in)\s+.*$|\s+[-–—|]\s+.*$|\s*[|:(\[].*$|[\s.!]+$", re.IGNORECASE)
+GENERIC_TITLES = {
+    "role", "position", "job", "opportunity", "vacancy", "us", "our team",
+    "the role", "the position", "this role", "this position", "a role", "a position",
+}
+# "applying for our Graduate Programme" names the employer's scheme, not a title
+PRONOUN_RE = re.compile(r"^(?:our|your|my|their|its|this|that|these|us|we|you)\b", re.IGNORECASE)
+
+NO_APPLICATION_DATE_PENALTY = 0.3
+HUMAN_INTERVIEW_PENALTY = 0.3
+EXTRA_APPLICATION_PENALTY = 0.3
+UNCLASSIFIED_EMAIL_PENALTY = 0.1
+
+
+def company_key(name):
+    return re.sub(r"[^a-z0-9]", "", str(name).lower())
+
+
+def names_company(title, company):
+    """True if the title is (part of) the company name or contains it."""
+    title_key, key = company_key(title), company_key(company)
+    return bool(title_key and key) and (key in title_key or title_key in key)
+
+
+def extract_title(subject, company, bad_patterns=()):
+    """Position title named in a subject line, or None."""
+    for pattern in TITLE_PATTERNS:
+        match = pattern.search(subject)
+        if not match:
+            continue
+        title = TITLE_TAIL_RE.sub("", match.group("title").strip()).strip(" \"'“”‘’")
+        lowered = title.lower()
+        if (len(title) < 3 or len(title) > 80 or not re.search(r"[a-z]", lowered)
+                or lowered in GENERIC_TITLES
+                or PRONOUN_RE.match(title)
+                or names_company(title, company)
+                or any(bad in lowered for bad in bad_patterns)):
+            continue
+        return title
+    return None
+
+
+def rules_extract(company, emails, pre_detected, bad_patterns=()):
+    """
+    Build the company's position from subjects and pre-detected stages.
+    emails are the deduplicated records (with .subject and .stages).
+    Returns (positions, confidence); positions is [] when there is no single title.
+    """
+    titles = {}
+    for email in emails:
+        title = extract_title(email.subject, company, bad_patterns)
+        if title:
+            titles.setdefault(title.lower(), title)
+    if len(titles) != 1:
+        return [], 0.0
+    if pre_detected["rejection"] and pre_detected["offer"]:
+        return [], 0.0
+
+    confidence = 1.0
+    if not pre_detected["application_submitted"]:
+        confidence -= NO_APPLICATION_DATE_PENALTY
+    if pre_detected["human_interview_dates"]:
+        confidence -= HUMAN_INTERVIEW_PENALTY
+    applications = sum(1 for e in emails if "application_submitted" in e.stages)
+    confidence -= EXTRA_APPLICATION_PENALTY * max(applications - 1, 0)
+    confidence -= UNCLASSIFIED_EMAIL_PENALTY * sum(1 for e in emails if not e.stages)
+
+    position = {
+        "position": next(iter(titles.values())),
+        "application_submitted": pre_detected["application_submitted"],
+        "aptitude_test": pre_detected["aptitude_test"],
+        "simulation_test": pre_detected["simulation_test"],
+        "coding_test": pre_detected["coding_test"],
+        "video_interview": pre_detected["video_interview"],
+        "num_human_interview": str(len(pre_detected["human_interview_dates"])),
+        "app_accepted": "y" if pre_detected["offer"] else ("n" if pre_detected["rejection"] else None)
+    }
+    return [position], round(max(confidence, 0.0), 2)
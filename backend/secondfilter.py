@@ -10,8 +10,10 @@ import re
 import json
 import time
 from pathlib import Path
-from datetime import datetime
 from openai import AzureOpenAI
+from llm_cache import cached_completion
+from stage_classifier import PatternSet, StageClassifier
+from date_utils import parse_date
 
 # =========================
 # 0) Azure OpenAI Setup
@@ -108,52 +110,21 @@ STAGE_PATTERNS = {
     ],
 }
 
+# Compiled once (see stage_classifier.py); same matches as re.search per pattern
+STAGE_CLASSIFIER = StageClassifier(STAGE_PATTERNS)
+SKIP_MATCHER = PatternSet(SKIP_PATTERNS)
+
 # =========================
 # 3) HELPER FUNCTIONS
 # =========================
 
-def parse_date(date_str):
-    """Normalize date to YYYY-MM-DD format"""
-    if not date_str:
-        return None
-
-    # ISO format: 2025-10-02T03:43:14+00:00
-    match = re.search(r"(\d{4}-\d{2}-\d{2})", date_str)
-    if match:
-        return match.group(1)
-
-    # RFC format: Mon, 03 Nov 2025 21:43:20 +0000
-    try:
-        # Remove timezone info for parsing
-        clean = re.sub(r'\s*\([^)]*\)\s*$', '', date_str)  # Remove (UTC) etc
-        clean = re.sub(r'\s*[+-]\d{4}\s*$', '', clean)     # Remove +0000 etc
-        clean = clean.strip()
-
-        for fmt in [
-            "%a, %d %b %Y %H:%M:%S",
-            "%d %b %Y %H:%M:%S",
-        ]:
-            try:
-                dt = datetime.strptime(clean, fmt)
-                return dt.strftime("%Y-%m-%d")
-            except:
-                continue
-    except:
-        pass
-
-    return None
-
-
 def should_skip(email):
     """Check if email should be skipped (noise)"""
     subject = email.get("subject", "").lower()
     from_email = email.get("from_email", "").lower()
     text = f"{subject} {from_email}"
 
-    for pattern in SKIP_PATTERNS:
-        if re.search(pattern, text, re.IGNORECASE):
-            return True
-    return False
+    return SKIP_MATCHER.matches(text)
 
 
 def detect_stages(email):
@@ -163,13 +134,7 @@ def detect_stages(email):
     body = email.get("body", "").lower()[:500]  # First 500 chars of body
     text = f"{subject} {from_email} {body}"
 
-    detected = []
-    for stage, patterns in STAGE_PATTERNS.items():
-        for pattern in patterns:
-            if re.search(pattern, text, re.IGNORECASE):
-                detected.append(stage)
-                break
-    return detected
+    return STAGE_CLASSIFIER.classify(text)
 
 
 def deduplicate_emails(emails):
@@ -225,10 +190,13 @@ def clean_body_text(body):
     return text
 
 
-def format_compact(emails):
-    """Format emails in compact format WITH body content for better GPT analysis"""
+def format_compact(emails, email_stages=None):
+    """Format emails in compact format WITH body content for better GPT analysis.
+    email_stages: detect_stages() results already computed for these emails, if any"""
+    if email_stages is None:
+        email_stages = [detect_stages(e) for e in emails]
     lines = []
-    for e in emails:
+    for e, stages in zip(emails, email_stages):
         date = parse_date(e.get("date", "")) or "?"
         subject = e.get("subject", "")[:80]  # Truncate long subjects
 
@@ -237,8 +205,6 @@ def format_compact(emails):
         domain_match = re.search(r"@([^>\s]+)", from_email)
         domain = domain_match.group(1)[:25] if domain_match else "?"
 
-        # Get detected stages for this email
-        stages = detect_stages(e)
         stage_str = f" [{','.join(stages)}]" if stages else ""
 
         # Include truncated body for better context
@@ -333,9 +299,9 @@ def process_company(company_dir: Path, output_dir: Path = None):
         "offer": None,
     }
 
-    for email in unique:
+    email_stages = [detect_stages(e) for e in unique]
+    for email, stages in zip(unique, email_stages):
         date = parse_date(email.get("date", ""))
-        stages = detect_stages(email)
 
         for stage in stages:
             if stage == "human_interview":
@@ -348,7 +314,7 @@ def process_company(company_dir: Path, output_dir: Path = None):
     print(f"  Pre-detected: {json.dumps({k:v for k,v in pre_detected.items() if v}, indent=2)}")
 
     # Step 5: Build compact prompt
-    compact_text = format_compact(unique)
+    compact_text = format_compact(unique, email_stages)
 
     # Calculate token savings
     original_chars = len(json.dumps([{
@@ -397,7 +363,8 @@ OUTPUT JSON only (array of positions):
     t0 = time.perf_counter()
 
     try:
-        response = client.chat.completions.create(
+        raw_output = cached_completion(
+            client,
             model=MODEL,
             messages=[
                 {"role": "system", "content": "You are a precise job application timeline extractor. Output valid JSON only."},
@@ -409,7 +376,6 @@ OUTPUT JSON only (array of positions):
         elapsed = time.perf_counter() - t0
         print(f"  GPT time: {elapsed:.2f}s")
 
-        raw_output = response.choices[0].message.content or ""
         result = extract_json(raw_output)
 
         if not result:
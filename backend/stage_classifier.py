@@ -0,0 +1,54 @@
+"""
+Compiled matchers for the SKIP_PATTERNS / STAGE_PATTERNS lists.
+Used by local_server.py and secondfilter.py (gmail_backend.py keeps its own
+copy, since it is deployed as a single file).
+
+The pattern lists are written for re.search(pattern, text, re.IGNORECASE) on
+text that is already lowercased. IGNORECASE turns off re's fast literal scan,
+so instead each pattern is compiled once with its letters lowercased, and
+patterns with no regex syntax become plain substring checks. Results are
+identical to the per-pattern re.search loop.
+"""
+import re
+
+REGEX_META = set(".^$*+?{}[]|()\\")
+
+# re.IGNORECASE also matches these onto ASCII 's'/'i'; texts containing them take the IGNORECASE path
+CASE_FOLDED_ONLY = ("ſ", "ı")
+
+
+def lower_literals(pattern):
+    """Lowercase a pattern's letters, leaving escapes such as \\S or \\D intact."""
+    return re.sub(r"\\.|[A-Z]+", lambda m: m.group(0) if m.group(0)[0] == "\\" else m.group(0).lower(), pattern)
+
+
+def needs_case_folding(text):
+    return any(c in text for c in CASE_FOLDED_ONLY)
+
+
+class PatternSet:
+    """Matches lowercased text if any of the patterns does."""
+
+    def __init__(self, patterns):
+        lowered = [lower_literals(p) for p in patterns]
+        self.literals = tuple(p for p in lowered if not REGEX_META & set(p))
+        self.regexes = [re.compile(p).search for p in lowered if REGEX_META & set(p)]
+        self.case_folding = [re.compile(p, re.IGNORECASE).search for p in patterns]
+
+    def matches(self, text, case_folding=None):
+        if case_folding is None:
+            case_folding = needs_case_folding(text)
+        if case_folding:
+            return any(search(text) for search in self.case_folding)
+        return any(literal in text for literal in self.literals) or any(search(text) for search in self.regexes)
+
+
+class StageClassifier:
+    """Returns every stage whose patterns match, in STAGE_PATTERNS order."""
+
+    def __init__(self, stage_patterns):
+        self.stages = [(stage, PatternSet(patterns)) for stage, patterns in stage_patterns.items()]
+
+    def classify(self, text):
+        case_folding = needs_case_folding(text)
+        return [stage for stage, patterns in self.stages if patterns.matches(text, case_folding)]
@@ -12,6 +12,7 @@ import useGmailPopup from '../hooks/useGmailPopup';
 import {
   checkAuthStatus,
   processApplicationsWithProgress,
+  activeJobParams,
   transformToApplications,
   getApplications,
 } from '../../services/api';
@@ -70,6 +71,14 @@ export default function Dashboard() {
     // Verify Gmail connection with backend
     const checkConnection = async () => {
       const localConnected = localStorage.getItem('gmail_connected') === 'true';
+      const activeJob = activeJobParams();
+      if (localConnected && activeJob) {
+        // A run started before the page reloaded is still going - reattach to it
+        // right away (with its own date range), before the server gives up on it as abandoned
+        setStartDate(activeJob.start_date);
+        setEndDate(activeJob.end_date);
+        fetchApplications(activeJob.refresh, activeJob);
+      }
       if (localConnected) {
         // Verify with backend
         const backendConnected = await checkAuthStatus();
@@ -115,10 +124,15 @@ export default function Dashboard() {
     }
   };
 
-  const fetchApplications = async (refresh = false) => {
+  // range ({ start_date, end_date }) overrides the date pickers, e.g. to reattach to a stored job
+  const fetchApplications = async (refresh = false, range = null) => {
     setProcessing(true);
     setError(null);
 
+    // On an empty dashboard, show positions as the server finds them
+    const streamPositions = applications.length === 0;
+    const streamed = {};
+
     try {
       const handleProgress = (event) => {
         if (event.type === "progress" && event.step !== undefined) {
@@ -126,6 +140,12 @@ export default function Dashboard() {
           if (event.message) {
             setProgressMessage(event.message);
           }
+        } else if (event.type === "position" && streamPositions) {
+          const { company, position } = event.data;
+          streamed[company] = [...(streamed[company] || []), position];
+          setApplications(transformToApplications({
+            companies: Object.entries(streamed).map(([name, positions]) => ({ name, positions })),
+          }));
         } else if (event.type === "cached") {
           // Fast-forward through all steps for cached data
           setLoadingStep(5);
@@ -133,7 +153,12 @@ export default function Dashboard() {
         }
       };
 
-      const data = await processApplicationsWithProgress(startDate, endDate, refresh, handleProgress);
+      const data = await processApplicationsWithProgress(
+        range ? range.start_date : startDate,
+        range ? range.end_date : endDate,
+        refresh,
+        handleProgress
+      );
 
       // Show cache notice with details
       if (data.from_cache || data.incremental_update) {
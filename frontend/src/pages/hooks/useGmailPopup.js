@@ -1,3 +1,5 @@
+import { isRenderMessage, rememberSession } from "../../services/api";
+
 export default function useGmailPopup() {
   return () => {
     return new Promise((resolve) => {
@@ -17,7 +19,9 @@ export default function useGmailPopup() {
 
       // Listen for auth success message from popup
       const handleMessage = (event) => {
+        if (!isRenderMessage(event)) return;
         if (event.data?.status === "success" && event.data?.authenticated) {
+          rememberSession(event.data);
           localStorage.setItem("gmail_connected", "true");
           window.removeEventListener("message", handleMessage);
           resolve(true);
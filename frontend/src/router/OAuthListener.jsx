@@ -1,12 +1,14 @@
 import { useEffect } from "react";
+import { isRenderMessage, rememberSession } from "../services/api";
 
 export default function OAuthListener() {
   useEffect(() => {
     const handler = (event) => {
-      if (!event.data) return;
+      if (!event.data || !isRenderMessage(event)) return;
 
         if (event.data.status === "success") {
         localStorage.setItem("authenticated", "true");
+        rememberSession(event.data);
 
         window.dispatchEvent(new Event("auth-success"));
 
@@ -1,13 +1,41 @@
 // Render for OAuth, local for heavy processing
 const RENDER_URL = "https://gmail-login-backend.onrender.com";
 const LOCAL_URL = "http://localhost:5001";
+const SESSION_KEY = "gmail_session";
+const JOB_KEY = "process_job";
+
+/**
+ * True for messages posted by the Render OAuth popup (any other window could
+ * post a fake "success" or a session id of its choosing)
+ */
+export function isRenderMessage(event) {
+  return event.origin === RENDER_URL;
+}
+
+/**
+ * Keep the Render session id from the OAuth popup's success message
+ */
+export function rememberSession(message) {
+  if (message?.session_id) {
+    localStorage.setItem(SESSION_KEY, message.session_id);
+  }
+}
+
+/**
+ * Headers identifying this browser's Gmail session to Render (and to the local
+ * server, which forwards it)
+ */
+function sessionHeaders(headers = {}) {
+  const sessionId = localStorage.getItem(SESSION_KEY);
+  return sessionId ? { ...headers, "X-Session-Id": sessionId } : headers;
+}
 
 /**
  * Check if the backend is authenticated with Gmail
  */
 export async function checkAuthStatus() {
   try {
-    const response = await fetch(`${RENDER_URL}/status`);
+    const response = await fetch(`${RENDER_URL}/status`, { headers: sessionHeaders() });
     const data = await response.json();
     return data.authenticated;
   } catch (error) {
@@ -21,7 +49,7 @@ export async function checkAuthStatus() {
  */
 export async function getUserInfo() {
   try {
-    const response = await fetch(`${RENDER_URL}/user-info`);
+    const response = await fetch(`${RENDER_URL}/user-info`, { headers: sessionHeaders() });
     if (!response.ok) {
       return null;
     }
@@ -33,14 +61,22 @@ export async function getUserInfo() {
 }
 
 /**
- * Log out and clear authentication
+ * Log out and clear authentication.
+ * Goes through the local server (so it forgets the cached identity),
+ * falling back to Render directly if the local server isn't running.
  */
 export async function logout() {
   try {
-    const response = await fetch(`${RENDER_URL}/logout`);
+    let response;
+    try {
+      response = await fetch(`${LOCAL_URL}/logout`, { headers: sessionHeaders() });
+    } catch (localError) {
+      response = await fetch(`${RENDER_URL}/logout`, { headers: sessionHeaders() });
+    }
     const data = await response.json();
     if (data.success) {
       localStorage.removeItem("gmail_connected");
+      localStorage.removeItem(SESSION_KEY);
     }
     return data.success;
   } catch (error) {
@@ -50,29 +86,81 @@ export async function logout() {
 }
 
 /**
- * Process emails with real-time progress updates via SSE
+ * The { id, params } of a processing job started earlier that may still be
+ * running (e.g. before a page reload), or null
+ */
+function storedJob() {
+  try {
+    return JSON.parse(localStorage.getItem(JOB_KEY));
+  } catch (e) {
+    return null;
+  }
+}
+
+/**
+ * Params ({ start_date, end_date, refresh }) of a job started earlier that may
+ * still be running, or null; pass them back to processApplicationsWithProgress
+ * to reattach to it
+ */
+export function activeJobParams() {
+  return storedJob()?.params || null;
+}
+
+/**
+ * Reuse the stored job if it was started with the same params and is still
+ * queued/running, otherwise start a new one (identical requests from other
+ * tabs are joined by the server)
+ */
+async function startOrResumeJob(startDate, endDate, refresh) {
+  const params = { start_date: startDate, end_date: endDate, refresh: Boolean(refresh) };
+  const stored = storedJob();
+  if (stored?.id && JSON.stringify(stored.params) === JSON.stringify(params)) {
+    try {
+      const response = await fetch(`${LOCAL_URL}/jobs/${stored.id}`);
+      const job = await response.json();
+      if (response.ok && (job.status === "queued" || job.status === "running")) {
+        return stored.id;
+      }
+    } catch (e) {
+      // Local server restarted or unreachable - start a new job below
+    }
+  }
+  localStorage.removeItem(JOB_KEY);
+
+  const response = await fetch(`${LOCAL_URL}/jobs`, {
+    method: "POST",
+    headers: sessionHeaders({ "Content-Type": "application/json" }),
+    body: JSON.stringify(params),
+  });
+  const job = await response.json();
+  if (!response.ok) {
+    throw new Error(job.error || "Failed to start processing");
+  }
+  localStorage.setItem(JOB_KEY, JSON.stringify({ id: job.job_id, params }));
+  return job.job_id;
+}
+
+/**
+ * Process emails with real-time progress updates via SSE.
+ * Processing runs as a background job on the local server; if a job started
+ * before a page reload with the same params is still running, this reattaches
+ * to it (replaying its progress) instead of starting a second run.
  * @param startDate - Start date in YYYY-MM-DD format
  * @param endDate - End date in YYYY-MM-DD format (optional)
  * @param refresh - Bypass cache and fetch fresh data
  * @param onProgress - Callback for progress updates
  * @returns Promise that resolves with the final ProcessResponse
  */
-export function processApplicationsWithProgress(
+export async function processApplicationsWithProgress(
   startDate,
   endDate,
   refresh,
   onProgress
 ) {
-  return new Promise((resolve, reject) => {
-    // Build URL with date parameters
-    let url = `${LOCAL_URL}/process-stream`;
-    const params = new URLSearchParams();
-    if (startDate) params.append("start_date", startDate);
-    if (endDate) params.append("end_date", endDate);
-    if (refresh) params.append("refresh", "true");
-    if (params.toString()) url += `?${params.toString()}`;
+  const jobId = await startOrResumeJob(startDate, endDate, refresh);
 
-    const eventSource = new EventSource(url);
+  return new Promise((resolve, reject) => {
+    const eventSource = new EventSource(`${LOCAL_URL}/jobs/${jobId}/events`);
 
     eventSource.onmessage = (event) => {
       try {
@@ -83,9 +171,10 @@ export function processApplicationsWithProgress(
           onProgress(data);
         }
 
-        // Handle completion
-        if (data.type === "done" || data.type === "cached") {
+        // Handle completion ("cached" is always followed by "done")
+        if (data.type === "done") {
           eventSource.close();
+          localStorage.removeItem(JOB_KEY);
           const result = data.data;
           if (result?.error) {
             reject(new Error(result.error));
@@ -99,6 +188,7 @@ export function processApplicationsWithProgress(
     };
 
     eventSource.onerror = (error) => {
+      // The job keeps running on the server; the next call reattaches to it
       console.error("SSE error:", error);
       eventSource.close();
       reject(new Error("Connection to server lost"));
@@ -122,7 +212,7 @@ export async function processApplications(startDate, endDate, refresh) {
     if (refresh) params.append("refresh", "true");
     if (params.toString()) url += `?${params.toString()}`;
 
-    const response = await fetch(url);
+    const response = await fetch(url, { headers: sessionHeaders() });
 
     if (!response.ok) {
       const errorData = await response.json();
@@ -239,7 +329,7 @@ export async function addApplication(
   try {
     const response = await fetch(`${LOCAL_URL}/applications/add`, {
       method: "POST",
-      headers: { "Content-Type": "application/json" },
+      headers: sessionHeaders({ "Content-Type": "application/json" }),
       body: JSON.stringify({ company, position }),
     });
 
@@ -275,7 +365,7 @@ export async function updateApplication(
 
     const response = await fetch(`${LOCAL_URL}/applications/update`, {
       method: "PUT",
-      headers: { "Content-Type": "application/json" },
+      headers: sessionHeaders({ "Content-Type": "application/json" }),
       body: JSON.stringify(body),
     });
 
@@ -305,7 +395,7 @@ export async function deleteApplication(
 
     const response = await fetch(`${LOCAL_URL}/applications/delete`, {
       method: "DELETE",
-      headers: { "Content-Type": "application/json" },
+      headers: sessionHeaders({ "Content-Type": "application/json" }),
       body: JSON.stringify(body),
     });
 
@@ -325,7 +415,7 @@ export async function deleteApplication(
  */
 export async function getApplications() {
   try {
-    const response = await fetch(`${LOCAL_URL}/applications`);
+    const response = await fetch(`${LOCAL_URL}/applications`, { headers: sessionHeaders() });
     const data = await response.json();
     if (!response.ok) {
       throw new Error(data.error || "Failed to get applications");